@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cantina.settings')
 
 application = get_asgi_application()
+
+# Card swipes are resolved from memory; load the codes before the first request.
+from core import cartoes  # noqa: E402
+
+cartoes.aquecer_worker()
@@ -111,6 +111,42 @@ TIME_ZONE = os.getenv("TIME_ZONE", "America/Sao_Paulo")
 USE_I18N = True
 USE_TZ = True
 
+# Stock consumption strategy used by checkout: "lock" (SELECT ... FOR UPDATE)
+# or "conditional" (UPDATE ... WHERE estoque >= n, no up-front row locks).
+CHECKOUT_STOCK_MODE = os.getenv("CHECKOUT_STOCK_MODE", "lock")
+
+# How long a checkout Idempotency-Key is replayed before it can be pruned.
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+
+# Bearer token of the unattended jobs reading the sales feed
+# (Authorization: Bearer <token>); unset, only admin sessions can read it.
+FEED_TOKEN = os.getenv("FEED_TOKEN")
+
+# Worker processes rendering the month-end invoice ZIP. The default, 1,
+# renders them in the request's own process: on a single CPU two processes
+# were no faster (400 invoices: 25 s in process, 26.6 s with 2). Raise it
+# only on hosts with spare cores, after timing gerar_faturas --processos.
+INVOICE_ZIP_WORKERS = int(os.getenv("INVOICE_ZIP_WORKERS", "1"))
+
+# The cache holds per-version copies of the catalog (the versions themselves
+# come from the database, see core.catalogo), the checkout retry counters and
+# the card resolver version, which are per process unless REDIS_URL points
+# every process at one Redis (needs the "redis" package).
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
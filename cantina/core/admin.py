@@ -1,6 +1,8 @@
 from django.contrib import admin
+from django.db import transaction
 
-from .models import Categoria, Cliente, ItemVenda, MovimentacaoEstoque, Produto, Venda
+from . import estoque, resumos
+from .models import Categoria, Cliente, ItemVenda, MovimentacaoEstoque, ParcelaEstoque, Produto, Venda
 
 
 @admin.register(Categoria)
@@ -11,17 +13,32 @@ class CategoriaAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('nome',)}
 
 
+class ParcelaEstoqueInline(admin.TabularInline):
+    model = ParcelaEstoque
+    extra = 0
+    can_delete = False
+    readonly_fields = ['slot', 'quantidade']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Produto)
 class ProdutoAdmin(admin.ModelAdmin):
-    list_display = ("nome", "categoria", "preco", "custo", "estoque", "fator_estoque", "produto_estoque", "ativo")
+    list_display = ("nome", "categoria", "preco", "custo", "estoque", "estoque_total", "fator_estoque", "produto_estoque", "ativo")
     list_editable = ("preco", "custo", "estoque", "ativo")
     search_fields = ("nome",)
+    inlines = [ParcelaEstoqueInline]
     fieldsets = (
         (None, {
             'fields': ('nome', 'categoria', 'descricao', 'preco', 'custo', 'ativo'),
         }),
         ('Estoque', {
-            'fields': ('estoque',),
+            'fields': ('estoque', 'estoque_parcelas'),
+            'description': (
+                'Com "Parcelas de estoque" maior que 0 o estoque é dividido em contadores '
+                'independentes, e o campo Estoque mostra o total atual das parcelas.'
+            ),
         }),
         ('Vínculo de estoque (ex: fatias de pizza)', {
             'fields': ('produto_estoque', 'fator_estoque'),
@@ -35,6 +52,35 @@ class ProdutoAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).com_estoque_atual()
+
+    @admin.display(description='Estoque atual', ordering='estoque_atual')
+    def estoque_total(self, obj):
+        return obj.estoque_atual
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None and obj.estoque_parcelas:
+            # Edit the live slot total, not the last folded value.
+            obj.estoque = obj.estoque_atual
+        return obj
+
+    def save_model(self, request, obj, form, change):
+        campos_estoque = {'estoque', 'estoque_parcelas'}
+        if not change or not campos_estoque & set(form.changed_data):
+            super().save_model(request, obj, form, change)
+            return
+
+        with transaction.atomic():
+            anterior = Produto.objects.select_for_update().get(pk=obj.pk)
+            total = obj.estoque
+            if 'estoque' not in form.changed_data:
+                total = estoque.estoque_atual(anterior, bloquear=True)
+            super().save_model(request, obj, form, change)
+            if obj.estoque_parcelas or anterior.estoque_parcelas:
+                estoque.distribuir(obj, total)
+
 
 @admin.register(Cliente)
 class ClienteAdmin(admin.ModelAdmin):
@@ -58,6 +104,33 @@ class VendaAdmin(admin.ModelAdmin):
     readonly_fields = ['data_hora', 'subtotal', 'desconto_percentual', 'desconto_valor', 'total']
     inlines = [ItemVendaInline]
 
+    # Keep the sales rollups in step with edits made here.
+    def save_model(self, request, obj, form, change):
+        if change:
+            resumos.remover([Venda.objects.select_for_update().get(pk=obj.pk)])
+        super().save_model(request, obj, form, change)
+        resumos.adicionar([obj])
+
+    def save_related(self, request, form, formsets, change):
+        venda = form.instance
+        if change:
+            resumos.remover((), self._itens(venda))
+        super().save_related(request, form, formsets, change)
+        resumos.adicionar((), self._itens(venda))
+
+    def delete_model(self, request, obj):
+        resumos.remover([obj], self._itens(obj))
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        vendas = list(queryset.select_for_update())
+        resumos.remover(vendas, ItemVenda.objects.filter(venda__in=vendas).select_related('venda'))
+        super().delete_queryset(request, queryset)
+
+    @staticmethod
+    def _itens(venda):
+        return venda.itens.select_related('venda')
+
 
 @admin.register(MovimentacaoEstoque)
 class MovimentacaoEstoqueAdmin(admin.ModelAdmin):
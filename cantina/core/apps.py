@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # Registers the catalog, live update and card resolver signals.
+        from . import cartoes, catalogo, tempo_real  # noqa: F401
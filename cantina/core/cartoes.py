@@ -0,0 +1,88 @@
+"""Process-local card code resolver for card and RFID swipes.
+
+Every worker keeps ``codigo_cartao -> (id, nome, codigo_cartao)`` for the
+active clients in a dict, so a swipe is answered without touching the
+database. ``Cliente`` saves and deletes bump a version in the cache after
+commit; a worker reloads its dict when the version it loaded is no longer
+current. The default locmem cache is per process, so the bump only reaches
+the worker that saved the client; the others reload once their dict is
+``VALIDADE`` seconds old. A shared cache (``REDIS_URL``) makes the bump reach
+every worker at once.
+"""
+
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Cliente
+
+CHAVE_VERSAO = 'cartoes:versao'
+# Seconds a worker trusts its dict without a version bump.
+VALIDADE = 15
+
+_lock = threading.Lock()
+_versao = None
+_carregado_em = None
+_cartoes = {}
+
+
+def _versao_atual():
+    atual = cache.get(CHAVE_VERSAO)
+    if atual is None:
+        cache.add(CHAVE_VERSAO, time.time_ns() // 1000, timeout=None)
+        atual = cache.get(CHAVE_VERSAO)
+    return atual
+
+
+def aquecer():
+    """Loads the active card codes; called at worker start and when the dict is stale."""
+    global _cartoes, _versao, _carregado_em
+    with _lock:
+        versao = _versao_atual()
+        clientes = (
+            Cliente.objects
+            .filter(ativo=True, codigo_cartao__isnull=False)
+            .exclude(codigo_cartao='')
+            .values_list('id', 'nome', 'codigo_cartao')
+        )
+        _cartoes = {codigo.upper(): (id, nome, codigo) for id, nome, codigo in clientes}
+        _versao = versao
+        _carregado_em = time.monotonic()
+
+
+def aquecer_worker():
+    """
+    Warm-up run by the WSGI and ASGI entry points before the first request.
+    Without a migrated database the codes are loaded on the first swipe.
+    """
+    try:
+        aquecer()
+    except DatabaseError:
+        pass
+
+
+def _expirado():
+    return _carregado_em is None or time.monotonic() - _carregado_em >= VALIDADE
+
+
+def resolver(codigo):
+    """``(id, nome, codigo_cartao)`` of the active client with this card, or None."""
+    if _expirado() or _versao != _versao_atual():
+        aquecer()
+    return _cartoes.get(codigo.strip().upper())
+
+
+def _incrementar_versao():
+    try:
+        cache.incr(CHAVE_VERSAO)
+    except ValueError:
+        _versao_atual()
+
+
+@receiver([post_save, post_delete], sender=Cliente)
+def _cliente_alterado(sender, **kwargs):
+    transaction.on_commit(_incrementar_versao)
@@ -0,0 +1,244 @@
+"""Cached POS catalog.
+
+The active catalog (categories, products, prices and current stock) is built
+once per catalog version and kept in the cache under that version. Every
+write that changes a product appends its id to ``AlteracaoProduto`` in the
+same transaction (category changes append a row without a product), and the
+version is the change-log sequence (``sequencia_atual``). Being read from the
+database, it is the same in every worker process, whatever the cache backend;
+each process just builds its own copy of a version. Terminals use the version
+as an ETag and get a 304 while nothing changed.
+
+Terminals that poll for fresh stock use ``alteracoes_desde`` instead, asking
+for the products changed after the last sequence they saw.
+
+The product count per category shown in the admin pages is cached under its
+own version, the sequence of the record edits (``cadastro``) only, since the
+catalog version also moves with every sale.
+"""
+
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .models import AlteracaoProduto, Categoria, Produto
+
+# Old versions are never read again; they only need to outlive a burst of
+# requests for the current one.
+TIMEOUT_CATALOGO = 60 * 60
+# Ids are assigned at insert but become visible at commit, so a slower
+# transaction can commit a lower id after a higher one was read. Changes
+# younger than this are sent again on the next poll, and are not yet part of
+# the catalog version.
+MARGEM_SEQUENCIA = timedelta(seconds=5)
+
+# Sent after a committed catalog change (see core.tempo_real).
+catalogo_alterado = Signal()
+
+
+def _sequencia(alteracoes):
+    """Last id of ``alteracoes`` that no transaction still in flight can precede."""
+    ids = alteracoes.order_by('id').values_list('id', flat=True)
+    recente = ids.filter(criado_em__gte=timezone.now() - MARGEM_SEQUENCIA).first()
+    if recente is not None:
+        return recente - 1
+    return ids.last() or 0
+
+
+def versao():
+    """Current catalog version."""
+    return sequencia_atual()
+
+
+def invalidar():
+    """Wakes the live catalog streams once the current transaction commits."""
+    transaction.on_commit(lambda: catalogo_alterado.send(sender=None))
+
+
+def _produtos(produtos):
+    """
+    Active products as sent to the POS. Stock is the one checkout consumes:
+    ``estoque_fonte`` is the stock of ``fonte`` (``produto_estoque`` or the
+    product itself) and ``estoque`` the units of the product it still covers
+    at ``fator`` units each. ``estoque_fonte`` 0 means untracked stock.
+    """
+    linhas = list(
+        produtos
+        .filter(ativo=True)
+        .com_estoque_atual()
+        .order_by('nome')
+        .values(
+            'id', 'nome', 'descricao', 'preco', 'estoque_atual',
+            'produto_estoque_id', 'fator_estoque', 'categoria__slug',
+        )
+    )
+    estoques = {produto['id']: produto['estoque_atual'] for produto in linhas}
+    fontes = {produto['produto_estoque_id'] for produto in linhas} - estoques.keys() - {None}
+    if fontes:
+        estoques.update(
+            Produto.objects.filter(id__in=fontes).com_estoque_atual().values_list('id', 'estoque_atual')
+        )
+
+    catalogo = []
+    for produto in linhas:
+        fonte = produto['produto_estoque_id'] or produto['id']
+        fator = produto['fator_estoque']
+        # A factor of 0 consumes nothing: the product is sold as untracked.
+        estoque_fonte = max(estoques.get(fonte, 0), 0) if fator else 0
+        catalogo.append({
+            'id': produto['id'],
+            'nome': produto['nome'],
+            'descricao': produto['descricao'],
+            'preco': str(produto['preco']),
+            'estoque': estoque_fonte // fator if fator else 0,
+            'fonte': fonte,
+            'fator': fator,
+            'estoque_fonte': estoque_fonte,
+            'categoria': produto['categoria__slug'],
+        })
+    return catalogo
+
+
+def montar_catalogo():
+    """Builds the catalog straight from the database."""
+    categorias = list(
+        Categoria.objects
+        .filter(ativo=True)
+        .values('id', 'nome', 'slug')
+    )
+    return {'categorias': categorias, 'produtos': _produtos(Produto.objects.all())}
+
+
+def obter_catalogo():
+    """
+    Returns ``(versao, catalogo)``, building and caching the catalog on the
+    first request for the current version.
+    """
+    atual = versao()
+    chave = f'catalogo:{atual}'
+    catalogo = cache.get(chave)
+    if catalogo is None:
+        catalogo = montar_catalogo()
+        cache.set(chave, catalogo, TIMEOUT_CATALOGO)
+    return atual, catalogo
+
+
+def categorias_com_contagem():
+    """Active categories with ``qtd_produtos``, their number of active products."""
+    chave = f'catalogo:categorias:{_sequencia(AlteracaoProduto.objects.filter(cadastro=True))}'
+    categorias = cache.get(chave)
+    if categorias is None:
+        categorias = list(
+            Categoria.objects
+            .filter(ativo=True)
+            .annotate(qtd_produtos=Count('produtos', filter=Q(produtos__ativo=True)))
+            .values('id', 'nome', 'slug', 'ativo', 'qtd_produtos')
+        )
+        cache.set(chave, categorias, TIMEOUT_CATALOGO)
+    return categorias
+
+
+def registrar_alteracoes(produto_ids, cadastro=False):
+    """
+    Appends the changed products (None: a category) to the change log, and
+    the products drawing on their stock (``produto_estoque``), whose stock
+    in the catalog follows it.
+    """
+    produto_ids = set(produto_ids)
+    fontes = produto_ids - {None}
+    dependentes = set(
+        Produto.objects.filter(produto_estoque_id__in=fontes).values_list('id', flat=True)
+    ) - produto_ids if fontes else set()
+    AlteracaoProduto.objects.bulk_create([
+        *(
+            AlteracaoProduto(produto_id=produto_id, cadastro=cadastro)
+            for produto_id in sorted(produto_ids, key=lambda produto_id: produto_id or 0)
+        ),
+        *(AlteracaoProduto(produto_id=produto_id) for produto_id in sorted(dependentes)),
+    ])
+
+
+def sequencia_atual():
+    """
+    Sequence a terminal can safely resume from: the last change, minus the
+    changes still inside ``MARGEM_SEQUENCIA``.
+    """
+    return _sequencia(AlteracaoProduto.objects.all())
+
+
+def alteracoes_desde(desde):
+    """
+    Products changed after sequence ``desde``: the active ones in
+    ``produtos`` and the deactivated or deleted ones in ``removidos``.
+
+    When ``desde`` is unknown (0, pruned from the log or ahead of it) the
+    whole active catalog is returned with ``completo = True``.
+    """
+    # Read before the products, so a change racing this request is resent.
+    sequencia = sequencia_atual()
+    limites = AlteracaoProduto.objects.aggregate(primeira=Min('id'), ultima=Max('id'))
+    primeira, ultima = limites['primeira'] or 1, limites['ultima'] or 0
+
+    if desde <= 0 or desde > ultima or desde < primeira - 1:
+        return {
+            'sequencia': sequencia,
+            'completo': True,
+            'produtos': _produtos(Produto.objects.all()),
+            'removidos': [],
+        }
+
+    alterados = set(
+        AlteracaoProduto.objects
+        .filter(id__gt=desde)
+        .values_list('produto_id', flat=True)
+        .distinct()
+    )
+    if None in alterados:
+        # A category changed: the terminal reloads the whole catalog.
+        return {**alteracoes_desde(0), 'sequencia': max(sequencia, desde)}
+
+    produtos = _produtos(Produto.objects.filter(id__in=alterados))
+    ativos = {produto['id'] for produto in produtos}
+    return {
+        'sequencia': max(sequencia, desde),
+        'completo': False,
+        'produtos': produtos,
+        'removidos': sorted(alterados - ativos),
+    }
+
+
+def limpar_alteracoes(dias):
+    """
+    Prunes the change log older than ``dias``; returns the number of rows.
+    The last change of each sequence is kept, so the versions never go back
+    to a value a terminal may still hold as its ETag.
+    """
+    limite = timezone.now() - timedelta(days=dias)
+    ultimas = [
+        AlteracaoProduto.objects.aggregate(ultima=Max('id'))['ultima'],
+        AlteracaoProduto.objects.filter(cadastro=True).aggregate(ultima=Max('id'))['ultima'],
+    ]
+    removidas, _ = (
+        AlteracaoProduto.objects
+        .filter(criado_em__lt=limite)
+        .exclude(id__in=[ultima for ultima in ultimas if ultima is not None])
+        .delete()
+    )
+    return removidas
+
+
+@receiver([post_save, post_delete], sender=Produto)
+def _produto_alterado(sender, instance, **kwargs):
+    registrar_alteracoes([instance.pk], cadastro=True)
+    invalidar()
+
+
+@receiver([post_save, post_delete], sender=Categoria)
+def _categoria_alterada(sender, **kwargs):
+    registrar_alteracoes([None], cadastro=True)
+    invalidar()
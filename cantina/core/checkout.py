@@ -0,0 +1,630 @@
+"""Checkout engine shared by the POS sale endpoints.
+
+A sale is recorded with a number of queries that does not depend on the size
+of the cart: every sold product and every linked stock source is locked in a
+single ordered ``SELECT ... FOR UPDATE``, the items are written with one
+``bulk_create`` and the stock is decremented with one ``bulk_update``.
+
+With ``settings.CHECKOUT_STOCK_MODE = "conditional"`` nothing is locked up
+front. The stock is consumed at the end of the transaction with one
+``UPDATE ... SET estoque = estoque - n WHERE id = ? AND estoque >= n`` per
+stock source, so terminals selling the same hot product only contend for the
+duration of that statement and the commit.
+
+Products with sharded stock (``Produto.estoque_parcelas``) are consumed
+through ``core.estoque`` in both modes.
+
+Locks are always taken in primary-key order. Deadlocks, serialization
+failures and SQLite "database is locked" errors are retried transparently
+with jittered exponential backoff; the retry counters are kept in the cache
+(see ``contadores_retry``).
+
+A sale may carry an idempotency key. The key and the response are stored in
+the same transaction as the sale, so a terminal retrying the same key gets the
+original response back without selling twice.
+
+``registrar_lote`` records a batch of sales queued by an offline terminal
+in a single transaction, with the same validation as a single sale.
+"""
+
+import logging
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import catalogo, estoque, resumos
+from .models import ChaveIdempotencia, Cliente, ItemVenda, Produto, Venda
+
+MAX_DESCONTO_PERCENTUAL = Decimal('50.00')
+FORMAS_PAGAMENTO_VALIDAS = {codigo for codigo, _ in Venda.FORMA_PAGAMENTO_CHOICES}
+
+MODO_BLOQUEIO = 'lock'
+MODO_CONDICIONAL = 'conditional'
+MODOS_ESTOQUE = {MODO_BLOQUEIO, MODO_CONDICIONAL}
+
+MAX_VENDAS_LOTE = 200
+MAX_CHAVE = ChaveIdempotencia._meta.get_field('chave').max_length
+# Offline terminals may have slightly skewed clocks.
+TOLERANCIA_RELOGIO = timedelta(minutes=5)
+
+MAX_TENTATIVAS = 5
+ESPERA_BASE = 0.02  # seconds; doubled on every retry
+ESPERA_MAXIMA = 0.5
+
+SQLSTATE_DEADLOCK = '40P01'
+SQLSTATE_SERIALIZACAO = '40001'
+MOTIVOS_RETRY = ('deadlock', 'serializacao', 'bloqueado', 'esgotado')
+
+logger = logging.getLogger(__name__)
+
+
+class VendaInvalida(Exception):
+    """A sale was rejected; ``mensagem`` is safe to show to the operator."""
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.mensagem = mensagem
+        self.status = status
+
+
+class VendaRepetida(Exception):
+    """The idempotency key was already used; ``resposta`` is the original response."""
+
+    def __init__(self, resposta):
+        super().__init__('Venda já registrada')
+        self.resposta = resposta
+
+
+def resposta_venda(venda):
+    """JSON body returned to the POS for a finished sale."""
+    return {
+        'success': True,
+        'venda_id': venda.id,
+        'subtotal': float(venda.subtotal),
+        'desconto_percentual': float(venda.desconto_percentual),
+        'desconto_valor': float(venda.desconto_valor),
+        'total': float(venda.total),
+        'message': f'Venda #{venda.id} finalizada com sucesso!',
+    }
+
+
+def _limite_chaves():
+    return timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+
+
+def _chaves_validas():
+    return ChaveIdempotencia.objects.filter(criado_em__gte=_limite_chaves())
+
+
+def _chaves_expiradas():
+    return ChaveIdempotencia.objects.filter(criado_em__lt=_limite_chaves())
+
+
+def buscar_resposta_idempotente(operador, chave):
+    """Stored response for an unexpired key, or None."""
+    return (
+        _chaves_validas()
+        .filter(operador=operador, chave=chave)
+        .values_list('resposta', flat=True)
+        .first()
+    )
+
+
+def limpar_chaves_expiradas():
+    """Deletes expired idempotency keys (a single DELETE: nothing cascades from them)."""
+    apagadas, _ = _chaves_expiradas().delete()
+    return apagadas
+
+
+def _parse_itens(itens):
+    """Validates the raw cart lines and returns a list of (produto_id, quantidade)."""
+    if not itens or not isinstance(itens, list):
+        raise VendaInvalida('Dados incompletos')
+
+    linhas = []
+    for item in itens:
+        if not isinstance(item, dict):
+            raise VendaInvalida('Item inválido na venda')
+
+        produto_id = item.get('id')
+        quantidade_raw = item.get('quantity')
+
+        if produto_id is None or quantidade_raw is None:
+            raise VendaInvalida('Item inválido na venda')
+
+        try:
+            produto_id = int(produto_id)
+        except (TypeError, ValueError):
+            raise VendaInvalida('Item inválido na venda')
+
+        try:
+            quantidade = int(quantidade_raw)
+        except (TypeError, ValueError):
+            raise VendaInvalida('Quantidade inválida')
+
+        if quantidade <= 0:
+            raise VendaInvalida('Quantidade deve ser maior que zero')
+
+        linhas.append((produto_id, quantidade))
+    return linhas
+
+
+def _parse_desconto(valor):
+    try:
+        desconto_percentual = Decimal(str(valor))
+    except (InvalidOperation, TypeError, ValueError):
+        raise VendaInvalida('Desconto inválido')
+
+    if not desconto_percentual.is_finite():
+        raise VendaInvalida('Desconto inválido')
+
+    if desconto_percentual < 0 or desconto_percentual > MAX_DESCONTO_PERCENTUAL:
+        raise VendaInvalida('Desconto deve estar entre 0% e 50%')
+    return desconto_percentual
+
+
+def _com_fontes(produto_ids):
+    fontes = (
+        Produto.objects
+        .filter(id__in=produto_ids, produto_estoque__isnull=False)
+        .values('produto_estoque_id')
+    )
+    return Produto.objects.filter(Q(id__in=produto_ids) | Q(id__in=fontes)).order_by('id')
+
+
+def carregar_produtos(produto_ids, bloquear=True):
+    """
+    Loads the given products and their stock sources in one ordered query.
+
+    With ``bloquear`` the rows are locked in primary-key order, so two
+    checkouts touching the same products always acquire their locks in the
+    same sequence. Products with sharded stock are never locked (their stock
+    lives in ``ParcelaEstoque``); they are read by a second, unlocked query
+    that only runs when the cart contains one.
+    """
+    if not bloquear:
+        return {produto.id: produto for produto in _com_fontes(produto_ids)}
+
+    produtos = {
+        produto.id: produto
+        for produto in _com_fontes(produto_ids).exclude(estoque_parcelas__gt=0).select_for_update()
+    }
+    faltando = set(produto_ids) - produtos.keys()
+    faltando |= {
+        produto.produto_estoque_id
+        for produto in produtos.values()
+        if produto.produto_estoque_id and produto.produto_estoque_id not in produtos
+    }
+    if faltando:
+        produtos.update((produto.id, produto) for produto in _com_fontes(faltando))
+    return produtos
+
+
+def _baixar_estoque_condicional(consumo, nomes):
+    """Consumes stock with one conditional UPDATE per source, in id order."""
+    for fonte_id in sorted(consumo):
+        quantidade = consumo[fonte_id]
+        atualizados = (
+            Produto.objects
+            .filter(id=fonte_id, estoque__gte=quantidade)
+            .update(estoque=F('estoque') - quantidade)
+        )
+        if not atualizados:
+            raise VendaInvalida(f'Estoque insuficiente para {nomes[fonte_id]}')
+
+
+def _gravar_chave(operador, chave, venda):
+    """
+    Stores the key with the sale. A concurrent request with the same key
+    blocks on the unique index until this transaction ends, then fails here
+    and gets the stored response instead of selling twice. An expired key
+    that was not pruned yet is taken over as a new one.
+    """
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                ChaveIdempotencia.objects.create(
+                    chave=chave, operador=operador, venda=venda, resposta=resposta_venda(venda),
+                )
+            return
+        except IntegrityError:
+            resposta = buscar_resposta_idempotente(operador, chave)
+            if resposta is not None:
+                raise VendaRepetida(resposta)
+            _chaves_expiradas().filter(operador=operador, chave=chave).delete()
+    raise IntegrityError(f'Chave de idempotência {chave!r} em uso')
+
+
+def _motivo_conflito(exc):
+    """Classifies a database error as a retryable lock conflict, or returns None."""
+    causa = exc.__cause__
+    sqlstate = getattr(causa, 'sqlstate', None) or getattr(causa, 'pgcode', None)
+    if sqlstate == SQLSTATE_DEADLOCK:
+        return 'deadlock'
+    if sqlstate == SQLSTATE_SERIALIZACAO:
+        return 'serializacao'
+    if 'database is locked' in str(exc) or 'database table is locked' in str(exc):
+        return 'bloqueado'
+    return None
+
+
+def _contar_retry(motivo):
+    chave = f'checkout:retry:{motivo}'
+    cache.add(chave, 0, timeout=None)
+    try:
+        cache.incr(chave)
+    except ValueError:
+        # Evicted between add() and incr().
+        cache.set(chave, 1, timeout=None)
+
+
+def contadores_retry():
+    """Retry counters per conflict type, plus how many checkouts gave up."""
+    valores = cache.get_many([f'checkout:retry:{motivo}' for motivo in MOTIVOS_RETRY])
+    return {motivo: valores.get(f'checkout:retry:{motivo}', 0) for motivo in MOTIVOS_RETRY}
+
+
+def _com_retry(funcao, *args):
+    """
+    Runs ``funcao`` in its own transaction, retrying lock conflicts up to
+    ``MAX_TENTATIVAS`` times; after that the sale is rejected with status 503.
+    Inside an outer transaction there is nothing safe to retry, so the error
+    is propagated to the caller.
+    """
+    if connection.in_atomic_block:
+        return funcao(*args)
+
+    for tentativa in range(1, MAX_TENTATIVAS + 1):
+        try:
+            return funcao(*args)
+        except DatabaseError as exc:
+            motivo = _motivo_conflito(exc)
+            if motivo is None:
+                raise
+            _contar_retry(motivo)
+            if tentativa == MAX_TENTATIVAS:
+                _contar_retry('esgotado')
+                logger.warning('Checkout desistiu após %d tentativas (%s)', tentativa, motivo)
+                raise VendaInvalida('Sistema ocupado, tente novamente', status=503) from exc
+            time.sleep(random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** tentativa)))
+
+
+def _preparar_venda(dados):
+    """Validates the payload fields that do not need the database."""
+    linhas = _parse_itens(dados.get('itens'))
+
+    forma = dados.get('forma_pagamento')
+    if forma not in FORMAS_PAGAMENTO_VALIDAS:
+        raise VendaInvalida('Forma de pagamento inválida')
+
+    desconto_percentual = _parse_desconto(dados.get('desconto_percentual', 0))
+
+    cliente_id = dados.get('cliente_id') or None
+    if cliente_id is not None:
+        try:
+            cliente_id = int(cliente_id)
+        except (TypeError, ValueError):
+            raise VendaInvalida('Cliente não encontrado', status=404)
+
+    return linhas, forma, desconto_percentual, cliente_id
+
+
+def _validar_cliente(cliente, cliente_id, forma):
+    if cliente_id and cliente is None:
+        raise VendaInvalida('Cliente não encontrado', status=404)
+    if forma == 'FIA' and not cliente:
+        raise VendaInvalida('Fiado só é permitido para cliente identificado')
+
+
+def _nova_venda(operador, cliente, forma, desconto_percentual, subtotal, data_hora=None):
+    desconto_valor = (subtotal * desconto_percentual) / Decimal('100')
+    venda = Venda(
+        cliente=cliente,
+        operador=operador,
+        subtotal=subtotal,
+        desconto_percentual=desconto_percentual,
+        desconto_valor=desconto_valor,
+        total=subtotal - desconto_valor,
+        forma_pagamento=forma,
+        paga=(forma != 'FIA'),
+        quitada_em=None if forma == 'FIA' else (data_hora or timezone.now()),
+    )
+    if data_hora is not None:
+        venda.data_hora = data_hora
+    return venda
+
+
+class _Consumo:
+    """
+    Stock consumed by the sales of one transaction.
+
+    Only sources with tracked stock are followed (estoque 0 means the product
+    is not stock-controlled). With ``parcelas_no_total`` the caller has locked
+    the slots of sharded products and stored their total in ``estoque``, so
+    they are checked like any other product and redistributed at the end.
+    """
+
+    def __init__(self, produtos, parcelas_no_total=False):
+        self.produtos = produtos
+        self.parcelas_no_total = parcelas_no_total
+        self.restante = {}
+        self.consumo = {}
+        self.parcelado = {}
+        self.nomes = {}
+
+    def reservar(self, linhas):
+        """
+        Checks the stock for the lines of one sale and returns its unsaved
+        items and subtotal. Nothing is reserved when a line is rejected.
+        """
+        restante = dict(self.restante)
+        consumo_venda = []
+        parcelado_venda = []
+        subtotal = Decimal('0.00')
+        itens = []
+
+        for produto_id, quantidade in linhas:
+            produto = self.produtos.get(produto_id)
+            if produto is None or not produto.ativo:
+                raise VendaInvalida('Produto não encontrado', status=404)
+
+            fonte = self.produtos[produto.produto_estoque_id or produto.id]
+            consumo = quantidade * produto.fator_estoque
+            if fonte.estoque_parcelas and not self.parcelas_no_total:
+                # Sharded stock is checked by estoque.consumir() in aplicar().
+                parcelado_venda.append((fonte.id, consumo, produto.nome))
+            elif fonte.estoque > 0:
+                disponivel = restante.get(fonte.id, fonte.estoque)
+                if consumo > disponivel:
+                    raise VendaInvalida(f'Estoque insuficiente para {produto.nome}')
+                restante[fonte.id] = disponivel - consumo
+                consumo_venda.append((fonte.id, consumo, produto.nome))
+
+            preco = Decimal(str(produto.preco))
+            subtotal_item = preco * quantidade
+            subtotal += subtotal_item
+
+            itens.append(ItemVenda(
+                produto=produto,
+                quantidade=quantidade,
+                preco_unitario=preco,
+                subtotal=subtotal_item,
+                custo_unitario=produto.custo,
+            ))
+
+        self.restante = restante
+        for destino, consumos in ((self.consumo, consumo_venda), (self.parcelado, parcelado_venda)):
+            for fonte_id, consumo, nome in consumos:
+                destino[fonte_id] = destino.get(fonte_id, 0) + consumo
+                self.nomes.setdefault(fonte_id, nome)
+        return itens, subtotal
+
+    def aplicar(self, modo_estoque):
+        """Writes the reserved consumption; raises VendaInvalida if it no longer fits."""
+        catalogo.invalidar()
+        catalogo.registrar_alteracoes([*self.consumo, *self.parcelado, *self.restante])
+        for fonte_id in sorted(self.parcelado):
+            fonte = self.produtos[fonte_id]
+            if not estoque.consumir(fonte_id, self.parcelado[fonte_id], fonte.estoque_parcelas):
+                raise VendaInvalida(f'Estoque insuficiente para {self.nomes[fonte_id]}')
+
+        if modo_estoque == MODO_CONDICIONAL:
+            # Late in the transaction, so the row locks taken by the UPDATEs
+            # are held briefly; only the key and the rollups follow them.
+            _baixar_estoque_condicional(self.consumo, self.nomes)
+            return
+
+        fontes = []
+        for fonte_id, saldo in self.restante.items():
+            fonte = self.produtos[fonte_id]
+            if fonte.estoque_parcelas:
+                estoque.distribuir(fonte, saldo)
+            else:
+                fonte.estoque = saldo
+                fontes.append(fonte)
+        if fontes:
+            Produto.objects.bulk_update(fontes, ['estoque'])
+
+
+def registrar_venda(operador, dados, modo_estoque=None, chave_idempotencia=None):
+    """
+    Validates a POS payload and persists the sale, its items and the stock
+    movement. Raises ``VendaInvalida`` when the sale must be rejected and
+    ``VendaRepetida`` when ``chave_idempotencia`` belongs to a finished sale.
+
+    ``modo_estoque`` overrides ``settings.CHECKOUT_STOCK_MODE``. Lock
+    conflicts are retried (see ``_com_retry``).
+    """
+    modo_estoque = modo_estoque or settings.CHECKOUT_STOCK_MODE
+    if modo_estoque not in MODOS_ESTOQUE:
+        raise ValueError(f'Modo de estoque desconhecido: {modo_estoque}')
+
+    if chave_idempotencia:
+        resposta = buscar_resposta_idempotente(operador, chave_idempotencia)
+        if resposta is not None:
+            raise VendaRepetida(resposta)
+
+    return _com_retry(_registrar_venda, operador, dados, modo_estoque, chave_idempotencia)
+
+
+def _registrar_venda(operador, dados, modo_estoque, chave_idempotencia):
+    linhas, forma, desconto_percentual, cliente_id = _preparar_venda(dados)
+
+    cliente = None
+    if cliente_id:
+        cliente = Cliente.objects.filter(id=cliente_id, ativo=True).first()
+    _validar_cliente(cliente, cliente_id, forma)
+
+    with transaction.atomic():
+        produtos = carregar_produtos(
+            {produto_id for produto_id, _ in linhas},
+            bloquear=(modo_estoque == MODO_BLOQUEIO),
+        )
+        consumo = _Consumo(produtos)
+        itens, subtotal = consumo.reservar(linhas)
+
+        venda = _nova_venda(operador, cliente, forma, desconto_percentual, subtotal)
+        venda.save()
+
+        for item in itens:
+            item.venda = venda
+        ItemVenda.objects.bulk_create(itens)
+
+        consumo.aplicar(modo_estoque)
+
+        if chave_idempotencia:
+            _gravar_chave(operador, chave_idempotencia, venda)
+
+        # Last: every checkout updates the same rollup rows, so their locks
+        # are taken just before commit.
+        resumos.adicionar([venda], itens)
+
+    return venda
+
+
+def _parse_data_hora(valor):
+    if not isinstance(valor, str):
+        raise VendaInvalida('Data/hora inválida')
+    try:
+        data_hora = parse_datetime(valor)
+    except ValueError:
+        data_hora = None
+    if data_hora is None:
+        raise VendaInvalida('Data/hora inválida')
+    if timezone.is_naive(data_hora):
+        data_hora = timezone.make_aware(data_hora)
+    if data_hora > timezone.now() + TOLERANCIA_RELOGIO:
+        raise VendaInvalida('Data/hora no futuro')
+    return data_hora
+
+
+def registrar_lote(operador, vendas):
+    """
+    Records a batch of sales queued by an offline terminal.
+
+    Each sale has the ``finalizar_venda`` payload plus ``uuid`` (used as its
+    idempotency key) and ``data_hora`` (client timestamp, ISO 8601). The
+    batch runs in one transaction: products are locked once for every sale,
+    and sales, items and keys are written with bulk inserts. Returns one
+    result per sale, in input order; sales already synced are replayed.
+    """
+    if not isinstance(vendas, list) or not vendas:
+        raise VendaInvalida('Dados incompletos')
+    if len(vendas) > MAX_VENDAS_LOTE:
+        raise VendaInvalida(f'Envie no máximo {MAX_VENDAS_LOTE} vendas por lote')
+
+    try:
+        return _com_retry(_registrar_lote, operador, vendas)
+    except IntegrityError:
+        # The same batch was synced concurrently; its keys are committed now
+        # and this run replays them.
+        return _com_retry(_registrar_lote, operador, vendas)
+
+
+def _registrar_lote(operador, vendas):
+    resultados = [None] * len(vendas)
+    pendentes = []
+    uuids = set()
+
+    def falha(indice, uuid, exc):
+        resultados[indice] = {'uuid': uuid, 'success': False, 'error': exc.mensagem, 'status': exc.status}
+
+    for indice, dados in enumerate(vendas):
+        uuid = dados.get('uuid') if isinstance(dados, dict) else None
+        try:
+            if not isinstance(uuid, str) or not uuid.strip() or len(uuid) > MAX_CHAVE:
+                raise VendaInvalida('UUID inválido')
+            if uuid in uuids:
+                raise VendaInvalida('UUID repetido no lote')
+            uuids.add(uuid)
+            data_hora = _parse_data_hora(dados.get('data_hora'))
+            linhas, forma, desconto_percentual, cliente_id = _preparar_venda(dados)
+        except VendaInvalida as exc:
+            falha(indice, uuid, exc)
+            continue
+        pendentes.append({
+            'indice': indice,
+            'uuid': uuid,
+            'data_hora': data_hora,
+            'linhas': linhas,
+            'forma': forma,
+            'desconto_percentual': desconto_percentual,
+            'cliente_id': cliente_id,
+        })
+
+    with transaction.atomic():
+        uuids_pendentes = [p['uuid'] for p in pendentes]
+        repetidas = dict(
+            _chaves_validas()
+            .filter(operador=operador, chave__in=uuids_pendentes)
+            .values_list('chave', 'resposta')
+        )
+        # Expired keys not pruned yet are used again as new ones.
+        _chaves_expiradas().filter(operador=operador, chave__in=uuids_pendentes).delete()
+        for pendente in pendentes:
+            if pendente['uuid'] in repetidas:
+                resultados[pendente['indice']] = {
+                    'uuid': pendente['uuid'], 'duplicada': True, **repetidas[pendente['uuid']],
+                }
+        pendentes = [p for p in pendentes if p['uuid'] not in repetidas]
+
+        produtos = carregar_produtos({
+            produto_id for pendente in pendentes for produto_id, _ in pendente['linhas']
+        })
+        for produto in produtos.values():
+            if produto.estoque_parcelas:
+                produto.estoque = estoque.estoque_atual(produto, bloquear=True)
+        clientes = Cliente.objects.filter(ativo=True).in_bulk(
+            {p['cliente_id'] for p in pendentes if p['cliente_id']}
+        )
+
+        consumo = _Consumo(produtos, parcelas_no_total=True)
+        aceitas = []
+        for pendente in pendentes:
+            cliente = clientes.get(pendente['cliente_id'])
+            try:
+                _validar_cliente(cliente, pendente['cliente_id'], pendente['forma'])
+                itens, subtotal = consumo.reservar(pendente['linhas'])
+            except VendaInvalida as exc:
+                falha(pendente['indice'], pendente['uuid'], exc)
+                continue
+            venda = _nova_venda(
+                operador, cliente, pendente['forma'], pendente['desconto_percentual'],
+                subtotal, pendente['data_hora'],
+            )
+            aceitas.append((pendente, venda, itens))
+
+        if connection.features.can_return_rows_from_bulk_insert:
+            Venda.objects.bulk_create([venda for _, venda, _ in aceitas])
+        else:
+            for _, venda, _ in aceitas:
+                venda.save()
+
+        itens_lote = []
+        for _, venda, itens in aceitas:
+            for item in itens:
+                item.venda = venda
+            itens_lote.extend(itens)
+        ItemVenda.objects.bulk_create(itens_lote)
+
+        consumo.aplicar(MODO_BLOQUEIO)
+
+        ChaveIdempotencia.objects.bulk_create([
+            ChaveIdempotencia(
+                chave=pendente['uuid'], operador=operador, venda=venda, resposta=resposta_venda(venda),
+            )
+            for pendente, venda, _ in aceitas
+        ])
+        resumos.adicionar([venda for _, venda, _ in aceitas], itens_lote)
+
+    for pendente, venda, _ in aceitas:
+        resultados[pendente['indice']] = {'uuid': pendente['uuid'], **resposta_venda(venda)}
+    return resultados
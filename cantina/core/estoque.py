@@ -0,0 +1,115 @@
+"""Sharded stock counters for high-contention products.
+
+A product with ``estoque_parcelas = N`` keeps its stock in N ``ParcelaEstoque``
+rows. Checkouts decrement a random slot with a conditional UPDATE, so
+terminals selling the same product rarely touch the same row. The authoritative
+total is the sum of the slots; ``Produto.estoque`` is folded from it by
+``consolidar()`` (see the ``consolidar_estoque`` command) and on every manual
+stock movement.
+"""
+
+import random
+
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from . import catalogo
+from .models import ParcelaEstoque, Produto
+
+
+def estoque_atual(produto, bloquear=False):
+    """Current stock of ``produto``; with ``bloquear`` the slots are locked."""
+    if not produto.estoque_parcelas:
+        return produto.estoque
+
+    parcelas = ParcelaEstoque.objects.filter(produto=produto)
+    if bloquear:
+        parcelas = parcelas.select_for_update().order_by('slot')
+        return sum(parcelas.values_list('quantidade', flat=True))
+    return parcelas.aggregate(total=Sum('quantidade'))['total'] or 0
+
+
+def distribuir(produto, total):
+    """
+    Spreads ``total`` evenly over the product's slots and stores it as the
+    folded ``estoque``. With ``estoque_parcelas = 0`` the slots are removed.
+    Must run inside a transaction holding the product lock.
+    """
+    n = produto.estoque_parcelas
+    ParcelaEstoque.objects.filter(produto=produto, slot__gte=n).delete()
+
+    if n:
+        base, resto = divmod(total, n)
+        ParcelaEstoque.objects.bulk_create(
+            [
+                ParcelaEstoque(produto=produto, slot=slot, quantidade=base + (1 if slot < resto else 0))
+                for slot in range(n)
+            ],
+            update_conflicts=True,
+            unique_fields=['produto', 'slot'],
+            update_fields=['quantidade'],
+        )
+
+    Produto.objects.filter(id=produto.id).update(estoque=total)
+    produto.estoque = total
+    catalogo.registrar_alteracoes([produto.id])
+    catalogo.invalidar()
+
+
+def consumir(produto_id, quantidade, n_parcelas):
+    """
+    Consumes ``quantidade`` from a sharded product. Returns False when the
+    stock is insufficient.
+
+    Slots are tried in random order with a conditional UPDATE; only when no
+    single slot can cover the sale are all slots locked and drained together.
+    A total of 0 keeps the "estoque 0 means untracked" rule.
+    """
+    slots = list(range(n_parcelas))
+    random.shuffle(slots)
+    for slot in slots:
+        atualizados = (
+            ParcelaEstoque.objects
+            .filter(produto_id=produto_id, slot=slot, quantidade__gte=quantidade)
+            .update(quantidade=F('quantidade') - quantidade)
+        )
+        if atualizados:
+            return True
+
+    parcelas = list(
+        ParcelaEstoque.objects
+        .select_for_update()
+        .filter(produto_id=produto_id)
+        .order_by('slot')
+    )
+    total = sum(parcela.quantidade for parcela in parcelas)
+    if total == 0:
+        return True
+    if total < quantidade:
+        return False
+
+    restante = quantidade
+    for parcela in parcelas:
+        usado = min(parcela.quantidade, restante)
+        parcela.quantidade -= usado
+        restante -= usado
+    ParcelaEstoque.objects.bulk_update(parcelas, ['quantidade'])
+    return True
+
+
+def consolidar():
+    """Folds the slot totals into ``Produto.estoque`` for every sharded product."""
+    soma_parcelas = (
+        ParcelaEstoque.objects
+        .filter(produto=OuterRef('pk'))
+        .values('produto')
+        .annotate(total=Sum('quantidade'))
+        .values('total')
+    )
+    atualizados = (
+        Produto.objects
+        .filter(estoque_parcelas__gt=0)
+        .update(estoque=Coalesce(Subquery(soma_parcelas), 0))
+    )
+    # The catalog reads the slot totals of these products, so it is unchanged.
+    return atualizados
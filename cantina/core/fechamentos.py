@@ -0,0 +1,146 @@
+"""Month close: reports of closed months, stored instead of recomputed.
+
+``fechar()`` stores the monthly report, the sales dashboard figures and the
+report XLSX of a month in ``FechamentoMes``/``ArquivoFechamento``; other
+files of the month (the client invoices) are stored on their first download.
+Reads of a closed month are served from what is stored, with an ETag made of
+the month's version.
+
+Every change to the sales goes through ``core.resumos``, which calls
+``invalidar()`` with the months it touched: their version is bumped and
+their data is regenerated on the next read. Data is only stored under the
+version read before computing it, so a report computed while a change
+commits is never kept as current.
+"""
+
+from decimal import Decimal
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import relatorios
+from .models import ArquivoFechamento, FechamentoMes
+
+ARQUIVO_RELATORIO = 'relatorio.xlsx'
+
+# Decimal values, stored as strings by DjangoJSONEncoder.
+_DECIMAIS = {
+    'valor_unit', 'custo_unit', 'valor_total', 'custo_total', 'lucro',
+    'cantina_valor', 'cantina_custo', 'cantina_lucro',
+    'servicos_valor', 'servicos_custo', 'servicos_lucro',
+    'geral_valor', 'geral_custo', 'geral_lucro',
+    'total_a_receber_mes', 'faturamento_mes', 'ticket_medio_mes',
+    'total_fiado', 'total_pendente',
+}
+
+
+def _decimais(dados):
+    if isinstance(dados, list):
+        return [_decimais(valor) for valor in dados]
+    if isinstance(dados, dict):
+        return {
+            chave: Decimal(valor) if chave in _DECIMAIS else _decimais(valor)
+            for chave, valor in dados.items()
+        }
+    return dados
+
+
+def _guardar(fechamento, **campos):
+    FechamentoMes.objects.filter(pk=fechamento.pk, versao=fechamento.versao).update(**campos)
+
+
+def obter(ano, mes):
+    """The ``FechamentoMes`` of the month, without its stored reports; None if open."""
+    return FechamentoMes.objects.filter(ano=ano, mes=mes).defer('relatorio', 'painel').first()
+
+
+def etag(fechamento):
+    # Weak: a file regenerated for the same version has the same content but
+    # not the same bytes (the XLSX carries its creation time).
+    return f'W/"fechamento-{fechamento.pk}-{fechamento.versao}"'
+
+
+def relatorio(ano, mes):
+    """``(fechamento, rows, totals)`` of the monthly report; ``fechamento`` is None if open."""
+    fechamento = FechamentoMes.objects.filter(ano=ano, mes=mes).defer('painel').first()
+    if fechamento is not None and fechamento.relatorio is not None:
+        dados = _decimais(fechamento.relatorio)
+        return fechamento, dados['rows'], dados['totals']
+
+    rows, totals = relatorios.linhas_relatorio(ano, mes)
+    if fechamento is not None:
+        _guardar(fechamento, relatorio={'rows': rows, 'totals': totals})
+    return fechamento, rows, totals
+
+
+def painel(ano, mes):
+    """``(fechamento, dados)`` of the sales dashboard; ``fechamento`` is None if open."""
+    fechamento = FechamentoMes.objects.filter(ano=ano, mes=mes).defer('relatorio').first()
+    if fechamento is not None and fechamento.painel is not None:
+        return fechamento, _decimais(fechamento.painel)
+
+    dados = relatorios.painel_vendas(ano, mes)
+    if fechamento is not None:
+        _guardar(fechamento, painel=dados)
+    return fechamento, dados
+
+
+def arquivo(fechamento, nome, gerar):
+    """
+    Bytes of the XLSX ``nome`` of a closed month; ``gerar(destino)`` writes it
+    when it is not stored for the current version.
+    """
+    conteudo = (
+        ArquivoFechamento.objects
+        .filter(fechamento=fechamento, nome=nome, versao=fechamento.versao)
+        .values_list('conteudo', flat=True)
+        .first()
+    )
+    if conteudo is not None:
+        return bytes(conteudo)
+
+    with relatorios.arquivo_planilha(gerar) as gerado:
+        conteudo = gerado.read()
+    ArquivoFechamento.objects.update_or_create(
+        fechamento=fechamento, nome=nome,
+        defaults={'versao': fechamento.versao, 'conteudo': conteudo},
+    )
+    return conteudo
+
+
+def fechar(ano, mes, usuario):
+    """Closes the month, or refreshes it if already closed, and stores its reports."""
+    fechamento, criado = FechamentoMes.objects.get_or_create(
+        ano=ano, mes=mes, defaults={'fechado_por': usuario},
+    )
+    if not criado:
+        invalidar([(ano, mes)])
+
+    fechamento, rows, totals = relatorio(ano, mes)
+    painel(ano, mes)
+    arquivo(
+        fechamento, ARQUIVO_RELATORIO,
+        lambda destino: relatorios.planilha_relatorio(ano, mes, rows, totals, destino),
+    )
+    return fechamento
+
+
+def reabrir(ano, mes):
+    """Reopens the month, dropping what was stored; returns whether it was closed."""
+    apagados, _ = FechamentoMes.objects.filter(ano=ano, mes=mes).delete()
+    return bool(apagados)
+
+
+def invalidar(meses):
+    """Outdates what is stored for the closed months among ``meses`` (``(ano, mes)`` pairs)."""
+    filtro = Q()
+    for ano, mes in set(meses):
+        filtro |= Q(ano=ano, mes=mes)
+    if not filtro:
+        return
+    FechamentoMes.objects.filter(filtro).update(
+        versao=F('versao') + 1,
+        atualizado_em=timezone.now(),
+        relatorio=None,
+        painel=None,
+    )
@@ -0,0 +1,95 @@
+"""Change feed of sales, sale items and stock movements, for external consumers.
+
+Records are read in keyset order of ``(modificado_em, id)`` — ``criado_em``
+for the append-only stock movements — and streamed as newline-delimited
+JSON, each line tagged with its ``fonte`` (venda, item or movimentacao).
+The last line carries an opaque cursor with the position reached on
+each source; passing it back as ``desde`` resumes right after it.
+
+Only records older than ``MARGEM`` are read: a transaction that has not
+committed yet may hold a timestamp older than rows already visible, and a
+cursor past it would skip the row for good. Deletions are not in the feed.
+"""
+
+import base64
+import json
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ItemVenda, MovimentacaoEstoque, Venda
+
+# Must be longer than any transaction that writes sales or stock movements.
+MARGEM = timedelta(minutes=1)
+# Records per source in one response; the cursor says whether there is more.
+LIMITE = 5000
+
+# (fonte, model, keyset timestamp, fields)
+FONTES = [
+    ('venda', Venda, 'modificado_em', [
+        'id', 'modificado_em', 'data_hora', 'cliente_id', 'operador_id',
+        'forma_pagamento', 'subtotal', 'desconto_percentual', 'desconto_valor',
+        'total', 'paga', 'quitada_em', 'observacao',
+    ]),
+    ('item', ItemVenda, 'modificado_em', [
+        'id', 'modificado_em', 'venda_id', 'produto_id', 'quantidade',
+        'preco_unitario', 'custo_unitario', 'subtotal',
+    ]),
+    ('movimentacao', MovimentacaoEstoque, 'criado_em', [
+        'id', 'criado_em', 'produto_id', 'tipo', 'quantidade',
+        'custo_unitario', 'motivo', 'usuario_id',
+    ]),
+]
+
+
+def ler_cursor(cursor):
+    """``{fonte: (timestamp, id)}`` of a cursor; ``{}`` when empty. Raises ValueError."""
+    if not cursor:
+        return {}
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        posicoes = {}
+        for fonte, _, _, _ in FONTES:
+            if fonte in dados:
+                momento, pk = dados[fonte]
+                momento = parse_datetime(momento)
+                if momento is None or not isinstance(pk, int):
+                    raise ValueError
+                posicoes[fonte] = (momento, pk)
+    except (TypeError, ValueError, AttributeError):
+        raise ValueError('Cursor inválido') from None
+    return posicoes
+
+
+def gerar_cursor(posicoes):
+    dados = {fonte: [momento.isoformat(), pk] for fonte, (momento, pk) in posicoes.items()}
+    return base64.urlsafe_b64encode(json.dumps(dados).encode()).decode().rstrip('=')
+
+
+def linhas(posicoes, limite=LIMITE):
+    """NDJSON lines of the records after ``posicoes``, ending with the cursor line."""
+    posicoes = dict(posicoes)
+    ate = timezone.now() - MARGEM
+    completo = True
+
+    for fonte, modelo, campo, campos in FONTES:
+        registros = modelo.objects.filter(**{f'{campo}__lt': ate})
+        if fonte in posicoes:
+            momento, pk = posicoes[fonte]
+            registros = registros.filter(
+                Q(**{f'{campo}__gt': momento}) | Q(**{campo: momento, 'id__gt': pk})
+            )
+        registros = registros.order_by(campo, 'id').values(*campos)[:limite]
+
+        lidos = 0
+        for registro in registros.iterator(chunk_size=1000):
+            lidos += 1
+            posicoes[fonte] = (registro[campo], registro['id'])
+            yield json.dumps({'fonte': fonte, **registro}, cls=DjangoJSONEncoder) + '\n'
+        if lidos == limite:
+            completo = False
+
+    yield json.dumps({'fonte': 'cursor', 'cursor': gerar_cursor(posicoes), 'completo': completo}) + '\n'
@@ -0,0 +1,129 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from core import resumos
+from core.checkout import MODO_BLOQUEIO, MODO_CONDICIONAL, registrar_venda
+from core.models import Categoria, ItemVenda, Produto, Venda
+
+SLUG_BENCHMARK = 'benchmark-checkout'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara a vazão do checkout com bloqueio (SELECT FOR UPDATE) e com baixa '
+        'condicional de estoque, simulando N terminais vendendo o mesmo produto. '
+        'Cria e remove os próprios dados; use em uma base de desenvolvimento/staging.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--terminais', type=int, default=8, help='Threads vendendo em paralelo')
+        parser.add_argument('--vendas', type=int, default=50, help='Vendas por terminal')
+        parser.add_argument(
+            '--modo',
+            choices=[MODO_BLOQUEIO, MODO_CONDICIONAL, 'ambos'],
+            default='ambos',
+        )
+
+    def handle(self, *args, **options):
+        terminais = options['terminais']
+        vendas = options['vendas']
+        if terminais < 1 or vendas < 1:
+            raise CommandError('--terminais e --vendas devem ser maiores que zero.')
+
+        modos = [MODO_BLOQUEIO, MODO_CONDICIONAL] if options['modo'] == 'ambos' else [options['modo']]
+
+        if Categoria.objects.filter(slug=SLUG_BENCHMARK).exists():
+            raise CommandError(f'Categoria "{SLUG_BENCHMARK}" já existe; remova-a antes de rodar o benchmark.')
+
+        categoria = Categoria.objects.create(nome='Benchmark', slug=SLUG_BENCHMARK, ativo=False)
+        venda_ids = []
+        try:
+            pizza = Produto.objects.create(
+                nome='Pizza (benchmark)', categoria=categoria,
+                custo=1, preco=6, estoque=1,
+            )
+            fatia = Produto.objects.create(
+                nome='Pizza Fatia (benchmark)', categoria=categoria,
+                custo=1, preco=6, produto_estoque=pizza, fator_estoque=1,
+            )
+
+            self.stdout.write(
+                f'{terminais} terminais x {vendas} vendas ({connection.vendor})'
+            )
+            for modo in modos:
+                # Enough stock for every sale, so failures are contention only.
+                Produto.objects.filter(id=pizza.id).update(estoque=terminais * vendas + 1)
+                resultado = self._rodar(modo, fatia.id, terminais, vendas)
+                venda_ids.extend(resultado['venda_ids'])
+                self._relatar(modo, resultado)
+        finally:
+            self._remover_vendas(venda_ids)
+            categoria.delete()
+
+    def _remover_vendas(self, venda_ids):
+        # Takes the sales out of the rollups and the sales counter too.
+        with transaction.atomic():
+            vendas = list(Venda.objects.select_for_update().filter(id__in=venda_ids))
+            resumos.remover(vendas, ItemVenda.objects.filter(venda__in=vendas).select_related('venda'))
+            Venda.objects.filter(id__in=venda_ids).delete()
+
+    def _rodar(self, modo, produto_id, terminais, vendas):
+        payload = {
+            'forma_pagamento': 'DIN',
+            'itens': [{'id': produto_id, 'quantity': 1}],
+        }
+        lock = threading.Lock()
+        latencias = []
+        venda_ids = []
+        erros = []
+
+        def terminal():
+            try:
+                for _ in range(vendas):
+                    inicio = time.perf_counter()
+                    try:
+                        venda = registrar_venda(None, payload, modo_estoque=modo)
+                    except Exception as exc:
+                        with lock:
+                            erros.append(exc)
+                        continue
+                    duracao = time.perf_counter() - inicio
+                    with lock:
+                        latencias.append(duracao)
+                        venda_ids.append(venda.id)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=terminal) for _ in range(terminais)]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+
+        return {
+            'duracao': duracao,
+            'latencias': latencias,
+            'venda_ids': venda_ids,
+            'erros': erros,
+        }
+
+    def _relatar(self, modo, resultado):
+        latencias = sorted(resultado['latencias'])
+        ok = len(latencias)
+        vazao = ok / resultado['duracao'] if resultado['duracao'] else 0
+        linha = f'{modo:>12}: {ok} vendas em {resultado["duracao"]:.2f}s ({vazao:.1f} vendas/s)'
+        if latencias:
+            p95 = latencias[min(ok - 1, int(ok * 0.95))]
+            linha += (
+                f' | latência p50 {statistics.median(latencias) * 1000:.1f} ms'
+                f' p95 {p95 * 1000:.1f} ms'
+            )
+        if resultado['erros']:
+            linha += f' | {len(resultado["erros"])} falhas ({type(resultado["erros"][0]).__name__})'
+        self.stdout.write(linha)
@@ -0,0 +1,106 @@
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import relatorios
+from core.models import Categoria, Cliente, ItemVenda, Produto, Venda
+
+SLUG_BENCHMARK = 'benchmark-planilhas'
+# Month the benchmark sales are dated in, away from real data.
+ANO, MES = 2000, 1
+ITENS_POR_VENDA = 5
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede tempo e pico de memória da geração da fatura e do relatório mensal em XLSX '
+        'para N linhas. Cria e remove os próprios dados; use em uma base de desenvolvimento/staging.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, default=50000, help='Linhas da fatura e do relatório')
+
+    def handle(self, *args, **options):
+        linhas = options['linhas']
+        if linhas < ITENS_POR_VENDA:
+            raise CommandError(f'--linhas deve ser pelo menos {ITENS_POR_VENDA}.')
+
+        if Categoria.objects.filter(slug=SLUG_BENCHMARK).exists():
+            raise CommandError(f'Categoria "{SLUG_BENCHMARK}" já existe; remova-a antes de rodar o benchmark.')
+
+        categoria = Categoria.objects.create(nome='Benchmark', slug=SLUG_BENCHMARK, ativo=False)
+        cliente = Cliente.objects.create(nome='Cliente (benchmark)', ativo=False)
+        try:
+            produtos = Produto.objects.bulk_create([
+                Produto(nome=f'Produto {i} (benchmark)', categoria=categoria, custo=1, preco=3, ativo=False)
+                for i in range(20)
+            ])
+            self._criar_vendas(cliente, produtos, linhas // ITENS_POR_VENDA)
+
+            self.stdout.write(f'{linhas} linhas')
+            self._medir('fatura', lambda destino: relatorios.planilha_fatura(cliente, ANO, MES, destino))
+
+            rows = [
+                {
+                    'categoria': 'Benchmark', 'nome': f'Produto {i}', 'qtd': 2,
+                    'valor_unit': Decimal('3.00'), 'custo_unit': Decimal('1.00'),
+                    'valor_total': Decimal('6.00'), 'custo_total': Decimal('2.00'), 'lucro': Decimal('4.00'),
+                    'subtotal': None,
+                }
+                for i in range(linhas)
+            ]
+            rows[-1]['subtotal'] = {
+                'categoria': 'Benchmark', 'qtd': 2 * linhas, 'valor_total': Decimal('6.00') * linhas,
+                'custo_total': Decimal('2.00') * linhas, 'lucro': Decimal('4.00') * linhas,
+            }
+            totals = {
+                f'{grupo}_{chave}': Decimal('1.00')
+                for grupo in ('cantina', 'geral') for chave in ('valor', 'custo', 'lucro')
+            }
+            self._medir('relatório', lambda destino: relatorios.planilha_relatorio(ANO, MES, rows, totals, destino))
+        finally:
+            Venda.objects.filter(cliente=cliente).delete()
+            cliente.delete()
+            Produto.objects.filter(categoria=categoria).delete()
+            categoria.delete()
+
+    def _criar_vendas(self, cliente, produtos, quantidade):
+        inicio = timezone.make_aware(datetime(ANO, MES, 1, 8))
+        vendas = Venda.objects.bulk_create([
+            Venda(
+                cliente=cliente, forma_pagamento='FIA', paga=i % 2 == 0,
+                subtotal=15, total=15, data_hora=inicio + timedelta(minutes=i % 40000),
+            )
+            for i in range(quantidade)
+        ], batch_size=1000)
+        ItemVenda.objects.bulk_create([
+            ItemVenda(
+                venda=venda, produto=produtos[(i + j) % len(produtos)],
+                quantidade=1, preco_unitario=3, subtotal=3, custo_unitario=1,
+            )
+            for i, venda in enumerate(vendas) for j in range(ITENS_POR_VENDA)
+        ], batch_size=2000)
+
+    def _medir(self, nome, gerar):
+        # Timed without tracemalloc, which slows allocation-heavy code down
+        # several times; the peak comes from a second, traced run.
+        inicio = time.perf_counter()
+        with relatorios.arquivo_planilha(gerar) as arquivo:
+            duracao = time.perf_counter() - inicio
+            tamanho = arquivo.seek(0, 2)
+
+        tracemalloc.start()
+        try:
+            relatorios.arquivo_planilha(gerar).close()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.stdout.write(
+            f'{nome:>10}: {duracao:.2f}s | pico {pico / 2**20:.1f} MiB'
+            f' | {tamanho / 1024:.0f} KiB'
+        )
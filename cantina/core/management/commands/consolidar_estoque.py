@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import estoque
+
+
+class Command(BaseCommand):
+    help = (
+        'Atualiza Produto.estoque com o total das parcelas de estoque dos produtos '
+        'com estoque parcelado. Pode rodar periodicamente (ex: cron a cada minuto).'
+    )
+
+    def handle(self, *args, **options):
+        atualizados = estoque.consolidar()
+        self.stdout.write(self.style.SUCCESS(f'{atualizados} produto(s) consolidado(s).'))
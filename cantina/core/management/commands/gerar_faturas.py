@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.relatorios import faturas_zip
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera em um ZIP a fatura de cada cliente com vendas fiado no mês, '
+        'mostrando o progresso. Com --processos maior que 1, as planilhas '
+        'são renderizadas em paralelo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('ano', type=int)
+        parser.add_argument('mes', type=int)
+        parser.add_argument('--saida', help='Arquivo ZIP (padrão: faturas_AAAA_MM.zip)')
+        parser.add_argument(
+            '--processos', type=int, default=settings.INVOICE_ZIP_WORKERS,
+            help='Processos renderizando as planilhas',
+        )
+
+    def handle(self, *args, **options):
+        ano, mes = options['ano'], options['mes']
+        if not (1 <= mes <= 12):
+            raise CommandError('Mês inválido.')
+        saida = options['saida'] or f'faturas_{ano}_{mes:02d}.zip'
+
+        def progresso(feitas, total):
+            # About every 10% on long lists.
+            if feitas == total or feitas % max(total // 10, 1) == 0:
+                self.stdout.write(f'{feitas}/{total} faturas')
+
+        with open(saida, 'wb') as arquivo:
+            for parte in faturas_zip(ano, mes, options['processos'], progresso):
+                arquivo.write(parte)
+
+        self.stdout.write(self.style.SUCCESS(f'Faturas gravadas em {saida}.'))
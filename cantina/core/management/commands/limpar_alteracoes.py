@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.catalogo import limpar_alteracoes
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove o histórico de alterações do catálogo mais antigo que --dias. '
+        'Terminais com uma sequência anterior recebem o catálogo completo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=7)
+
+    def handle(self, *args, **options):
+        apagadas = limpar_alteracoes(options['dias'])
+        self.stdout.write(self.style.SUCCESS(f'{apagadas} alteração(ões) removida(s).'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.checkout import limpar_chaves_expiradas
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove as chaves de idempotência do checkout mais antigas que '
+        'IDEMPOTENCY_KEY_TTL_HOURS. Pode rodar diariamente via cron.'
+    )
+
+    def handle(self, *args, **options):
+        apagadas = limpar_chaves_expiradas()
+        self.stdout.write(self.style.SUCCESS(f'{apagadas} chave(s) removida(s).'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from core.resumos import reconciliar_contador
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula o contador global de vendas (quantidade e faturamento) a partir das vendas. '
+        'Pode ser agendado periodicamente.'
+    )
+
+    def handle(self, *args, **options):
+        antes, depois = reconciliar_contador()
+        if antes == depois:
+            self.stdout.write(self.style.SUCCESS(f"Contador conferido: {depois['qtd_vendas']} venda(s)."))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"Contador corrigido: {antes['qtd_vendas']} venda(s) / R$ {antes['faturamento']} -> "
+                f"{depois['qtd_vendas']} venda(s) / R$ {depois['faturamento']}."
+            ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.resumos import reconstruir
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula a tabela de resumos diários de vendas a partir das vendas. '
+        'Use após importar ou corrigir vendas diretamente no banco.'
+    )
+
+    def handle(self, *args, **options):
+        linhas = reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'{linhas} resumo(s) diário(s) gerado(s).'))
@@ -0,0 +1,32 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_alter_venda_data_hora'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='estoque_parcelas',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Divide o estoque em N contadores para produtos muito vendidos (ex: pizza, coxinha). Deixe 0 para o comportamento normal.', verbose_name='Parcelas de estoque'),
+        ),
+        migrations.CreateModel(
+            name='ParcelaEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('quantidade', models.IntegerField(default=0)),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parcelas', to='core.produto')),
+            ],
+            options={
+                'verbose_name': 'Parcela de Estoque',
+                'verbose_name_plural': 'Parcelas de Estoque',
+                'ordering': ['produto', 'slot'],
+                'constraints': [models.UniqueConstraint(fields=('produto', 'slot'), name='parcela_estoque_unica')],
+            },
+        ),
+    ]
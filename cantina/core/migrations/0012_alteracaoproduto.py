@@ -0,0 +1,24 @@
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_chaveidempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlteracaoProduto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('produto_id', models.BigIntegerField()),
+                ('criado_em', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Alteração de Produto',
+                'verbose_name_plural': 'Alterações de Produto',
+            },
+        ),
+    ]
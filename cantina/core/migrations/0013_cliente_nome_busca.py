@@ -0,0 +1,80 @@
+import unicodedata
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def preencher_nome_busca(apps, schema_editor):
+    Cliente = apps.get_model('core', 'Cliente')
+    clientes = list(Cliente.objects.only('id', 'nome'))
+    for cliente in clientes:
+        decomposto = unicodedata.normalize('NFKD', cliente.nome.casefold())
+        cliente.nome_busca = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    Cliente.objects.bulk_update(clientes, ['nome_busca'], batch_size=500)
+
+
+# Substring search on nome_busca: a trigram GIN index on Postgres, an FTS5
+# trigram table kept in sync by triggers on SQLite.
+SQL_BUSCA = {
+    'postgresql': (
+        [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            'CREATE INDEX cliente_nome_busca_trgm ON core_cliente '
+            'USING gin (nome_busca gin_trgm_ops)',
+        ],
+        ['DROP INDEX IF EXISTS cliente_nome_busca_trgm'],
+    ),
+    'sqlite': (
+        [
+            "CREATE VIRTUAL TABLE core_cliente_busca USING fts5("
+            "nome_busca, content='core_cliente', content_rowid='id', tokenize='trigram')",
+            'CREATE TRIGGER core_cliente_busca_ai AFTER INSERT ON core_cliente BEGIN '
+            'INSERT INTO core_cliente_busca(rowid, nome_busca) VALUES (new.id, new.nome_busca); END',
+            'CREATE TRIGGER core_cliente_busca_ad AFTER DELETE ON core_cliente BEGIN '
+            "INSERT INTO core_cliente_busca(core_cliente_busca, rowid, nome_busca) "
+            "VALUES ('delete', old.id, old.nome_busca); END",
+            'CREATE TRIGGER core_cliente_busca_au AFTER UPDATE ON core_cliente BEGIN '
+            "INSERT INTO core_cliente_busca(core_cliente_busca, rowid, nome_busca) "
+            "VALUES ('delete', old.id, old.nome_busca); "
+            'INSERT INTO core_cliente_busca(rowid, nome_busca) VALUES (new.id, new.nome_busca); END',
+            "INSERT INTO core_cliente_busca(core_cliente_busca) VALUES ('rebuild')",
+        ],
+        [
+            'DROP TRIGGER IF EXISTS core_cliente_busca_ai',
+            'DROP TRIGGER IF EXISTS core_cliente_busca_ad',
+            'DROP TRIGGER IF EXISTS core_cliente_busca_au',
+            'DROP TABLE IF EXISTS core_cliente_busca',
+        ],
+    ),
+}
+
+
+def criar_indice_busca(apps, schema_editor):
+    for sql in SQL_BUSCA.get(schema_editor.connection.vendor, ([], []))[0]:
+        schema_editor.execute(sql)
+
+
+def remover_indice_busca(apps, schema_editor):
+    for sql in SQL_BUSCA.get(schema_editor.connection.vendor, ([], []))[1]:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_alteracaoproduto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='nome_busca',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(django.db.models.functions.text.Upper('codigo_cartao'), name='cliente_cartao_upper'),
+        ),
+        migrations.RunPython(preencher_nome_busca, migrations.RunPython.noop),
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+    ]
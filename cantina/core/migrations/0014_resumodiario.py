@@ -0,0 +1,55 @@
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def preencher_resumos(apps, schema_editor):
+    Venda = apps.get_model('core', 'Venda')
+    ResumoDiario = apps.get_model('core', 'ResumoDiario')
+    ResumoDiario.objects.bulk_create(
+        [
+            ResumoDiario(
+                data=linha['data'],
+                forma_pagamento=linha['forma_pagamento'],
+                paga=linha['paga'],
+                quantidade=linha['quantidade'],
+                total=linha['soma'],
+            )
+            for linha in (
+                Venda.objects
+                .annotate(data=TruncDate('data_hora'))
+                .values('data', 'forma_pagamento', 'paga')
+                .annotate(quantidade=Count('id'), soma=Sum('total'))
+                .order_by()
+            )
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_cliente_nome_busca'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('forma_pagamento', models.CharField(choices=[('DIN', 'Dinheiro'), ('CAR', 'Cartão'), ('PIX', 'PIX'), ('FIA', 'Fiado')], max_length=3)),
+                ('paga', models.BooleanField()),
+                ('quantidade', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'verbose_name': 'Resumo Diário',
+                'verbose_name_plural': 'Resumos Diários',
+                'ordering': ['data', 'forma_pagamento', 'paga'],
+                'constraints': [models.UniqueConstraint(fields=('data', 'forma_pagamento', 'paga'), name='resumo_diario_unico')],
+            },
+        ),
+        migrations.RunPython(preencher_resumos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_resumodiario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(fields=['data_hora'], name='venda_data_hora'),
+        ),
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(fields=['cliente', 'forma_pagamento', 'paga', 'data_hora'], name='venda_cliente_fiado'),
+        ),
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(fields=['operador', 'data_hora'], name='venda_operador_data'),
+        ),
+    ]
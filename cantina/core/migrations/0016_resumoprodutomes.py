@@ -0,0 +1,65 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def preencher_resumos(apps, schema_editor):
+    ItemVenda = apps.get_model('core', 'ItemVenda')
+    ResumoProdutoMes = apps.get_model('core', 'ResumoProdutoMes')
+    ResumoProdutoMes.objects.bulk_create(
+        [
+            ResumoProdutoMes(
+                produto_id=linha['produto_id'],
+                ano=linha['ano'],
+                mes=linha['mes'],
+                quantidade=linha['qtd'],
+                valor=linha['soma'],
+                custo=linha['custo_total'],
+            )
+            for linha in (
+                ItemVenda.objects
+                .annotate(ano=ExtractYear('venda__data_hora'), mes=ExtractMonth('venda__data_hora'))
+                .values('produto_id', 'ano', 'mes')
+                .annotate(
+                    qtd=Sum('quantidade'),
+                    soma=Sum('subtotal'),
+                    custo_total=Sum(
+                        F('quantidade') * F('produto__custo'),
+                        output_field=DecimalField(max_digits=12, decimal_places=2),
+                    ),
+                )
+                .order_by()
+            )
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_venda_indices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoProdutoMes',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('quantidade', models.IntegerField(default=0)),
+                ('valor', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('custo', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos_mensais', to='core.produto')),
+            ],
+            options={
+                'verbose_name': 'Resumo Mensal de Produto',
+                'verbose_name_plural': 'Resumos Mensais de Produtos',
+                'ordering': ['ano', 'mes', 'produto'],
+                'constraints': [models.UniqueConstraint(fields=('ano', 'mes', 'produto'), name='resumo_produto_mes_unico')],
+            },
+        ),
+        migrations.RunPython(preencher_resumos, migrations.RunPython.noop),
+    ]
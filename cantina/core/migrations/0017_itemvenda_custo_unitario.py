@@ -0,0 +1,39 @@
+from django.db import migrations, models, transaction
+from django.db.models import Max, OuterRef, Subquery
+
+LOTE = 5000
+
+
+def preencher_custo_unitario(apps, schema_editor):
+    """Snapshots the current product cost on past items, in id batches."""
+    ItemVenda = apps.get_model('core', 'ItemVenda')
+    Produto = apps.get_model('core', 'Produto')
+    custo = Produto.objects.filter(id=OuterRef('produto_id')).values('custo')
+
+    ultimo = ItemVenda.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0
+    for inicio in range(0, ultimo + 1, LOTE):
+        with transaction.atomic():
+            (
+                ItemVenda.objects
+                .filter(id__gte=inicio, id__lt=inicio + LOTE, custo_unitario__isnull=True)
+                .update(custo_unitario=Subquery(custo))
+            )
+
+
+class Migration(migrations.Migration):
+    # Each backfill batch commits on its own instead of locking the whole
+    # item table in a single transaction.
+    atomic = False
+
+    dependencies = [
+        ('core', '0016_resumoprodutomes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemvenda',
+            name='custo_unitario',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Custo unitário'),
+        ),
+        migrations.RunPython(preencher_custo_unitario, migrations.RunPython.noop),
+    ]
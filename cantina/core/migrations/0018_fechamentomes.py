@@ -0,0 +1,58 @@
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_itemvenda_custo_unitario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FechamentoMes',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('fechado_em', models.DateTimeField(auto_now_add=True)),
+                ('versao', models.PositiveIntegerField(default=1)),
+                ('atualizado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('relatorio', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('painel', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('fechado_por', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Fechamento de Mês',
+                'verbose_name_plural': 'Fechamentos de Mês',
+                'ordering': ['-ano', '-mes'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArquivoFechamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=100)),
+                ('versao', models.PositiveIntegerField()),
+                ('conteudo', models.BinaryField()),
+                ('gerado_em', models.DateTimeField(auto_now=True)),
+                ('fechamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='arquivos', to='core.fechamentomes')),
+            ],
+            options={
+                'verbose_name': 'Arquivo de Fechamento',
+                'verbose_name_plural': 'Arquivos de Fechamento',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='fechamentomes',
+            constraint=models.UniqueConstraint(fields=('ano', 'mes'), name='fechamento_mes_unico'),
+        ),
+        migrations.AddConstraint(
+            model_name='arquivofechamento',
+            constraint=models.UniqueConstraint(fields=('fechamento', 'nome'), name='arquivo_fechamento_unico'),
+        ),
+    ]
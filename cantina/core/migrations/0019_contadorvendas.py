@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def preencher_contador(apps, schema_editor):
+    Venda = apps.get_model('core', 'Venda')
+    ContadorVendas = apps.get_model('core', 'ContadorVendas')
+    totais = Venda.objects.aggregate(quantidade=Count('id'), total=Sum('total'))
+    ContadorVendas.objects.create(slot=0, quantidade=totais['quantidade'], total=totais['total'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_fechamentomes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorVendas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField(unique=True)),
+                ('quantidade', models.BigIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Contador de Vendas',
+                'verbose_name_plural': 'Contadores de Vendas',
+                'ordering': ['slot'],
+            },
+        ),
+        migrations.RunPython(preencher_contador, migrations.RunPython.noop),
+    ]
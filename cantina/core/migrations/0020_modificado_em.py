@@ -0,0 +1,36 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_contadorvendas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='venda',
+            name='modificado_em',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='itemvenda',
+            name='modificado_em',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(fields=['modificado_em', 'id'], name='venda_modificado'),
+        ),
+        migrations.AddIndex(
+            model_name='itemvenda',
+            index=models.Index(fields=['modificado_em', 'id'], name='itemvenda_modificado'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacaoestoque',
+            index=models.Index(fields=['criado_em', 'id'], name='movimentacao_criado'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_modificado_em'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alteracaoproduto',
+            name='cadastro',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='alteracaoproduto',
+            name='produto_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='alteracaoproduto',
+            index=models.Index(fields=['cadastro', 'id'], name='alteracao_cadastro'),
+        ),
+    ]
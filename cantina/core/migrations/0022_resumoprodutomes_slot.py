@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_alteracaoproduto_cadastro'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='resumoprodutomes',
+            options={'ordering': ['ano', 'mes', 'produto', 'slot'], 'verbose_name': 'Resumo Mensal de Produto', 'verbose_name_plural': 'Resumos Mensais de Produtos'},
+        ),
+        migrations.RemoveConstraint(
+            model_name='resumoprodutomes',
+            name='resumo_produto_mes_unico',
+        ),
+        migrations.AddField(
+            model_name='resumoprodutomes',
+            name='slot',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='resumoprodutomes',
+            constraint=models.UniqueConstraint(fields=('ano', 'mes', 'produto', 'slot'), name='resumo_produto_mes_slot_unico'),
+        ),
+    ]
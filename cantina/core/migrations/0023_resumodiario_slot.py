@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_resumoprodutomes_slot'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='resumodiario',
+            options={'ordering': ['data', 'forma_pagamento', 'paga', 'slot'], 'verbose_name': 'Resumo Diário', 'verbose_name_plural': 'Resumos Diários'},
+        ),
+        migrations.RemoveConstraint(
+            model_name='resumodiario',
+            name='resumo_diario_unico',
+        ),
+        migrations.AddField(
+            model_name='resumodiario',
+            name='slot',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='resumodiario',
+            constraint=models.UniqueConstraint(fields=('data', 'forma_pagamento', 'paga', 'slot'), name='resumo_diario_slot_unico'),
+        ),
+    ]
@@ -1,5 +1,11 @@
-from django.db import models
+import unicodedata
+
+from django.db import connections, models
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Upper
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 
 
@@ -18,6 +24,27 @@ class Categoria(models.Model):
         return self.nome
 
 
+class ProdutoQuerySet(models.QuerySet):
+    def com_estoque_atual(self):
+        """
+        Annotates ``estoque_atual``: the sum of the stock slots for products
+        with sharded stock, ``estoque`` for every other product.
+        """
+        soma_parcelas = (
+            ParcelaEstoque.objects
+            .filter(produto=OuterRef('pk'))
+            .values('produto')
+            .annotate(total=Sum('quantidade'))
+            .values('total')
+        )
+        return self.annotate(
+            estoque_atual=Case(
+                When(estoque_parcelas__gt=0, then=Coalesce(Subquery(soma_parcelas), 0)),
+                default=F('estoque'),
+            )
+        )
+
+
 class Produto(models.Model):
     nome = models.CharField(max_length=200)
     categoria = models.ForeignKey(
@@ -71,6 +98,18 @@ class Produto(models.Model):
         verbose_name='Fator de estoque',
     )
 
+    # Sharded stock for high-contention products. When > 0 the stock lives in
+    # N ParcelaEstoque rows that checkouts decrement independently, and
+    # ``estoque`` only holds the last folded total (see core.estoque).
+    estoque_parcelas = models.PositiveSmallIntegerField(
+        default=0,
+        help_text='Divide o estoque em N contadores para produtos muito vendidos '
+                  '(ex: pizza, coxinha). Deixe 0 para o comportamento normal.',
+        verbose_name='Parcelas de estoque',
+    )
+
+    objects = ProdutoQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Produto"
         verbose_name_plural = "Produtos"
@@ -80,6 +119,62 @@ class Produto(models.Model):
         return f"{self.nome} - Venda: R$ {self.preco} | Custo: R$ {self.custo}"
 
 
+class ParcelaEstoque(models.Model):
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='parcelas')
+    slot = models.PositiveSmallIntegerField()
+    quantidade = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Parcela de Estoque'
+        verbose_name_plural = 'Parcelas de Estoque'
+        ordering = ['produto', 'slot']
+        constraints = [
+            models.UniqueConstraint(fields=['produto', 'slot'], name='parcela_estoque_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.produto.nome} #{self.slot}: {self.quantidade}"
+
+
+def normalizar_busca(texto):
+    """Lower-cases and strips accents: "João" -> "joao"."""
+    decomposto = unicodedata.normalize('NFKD', texto.casefold())
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+
+class ClienteQuerySet(models.QuerySet):
+    def busca(self, termo):
+        """
+        Clients matching ``termo`` by card code or name, ignoring case and
+        accents, ranked exact card > name prefix > name substring.
+
+        Name substrings use the trigram index on Postgres and the
+        ``core_cliente_busca`` FTS5 table on SQLite (see migration 0013).
+        """
+        normalizado = normalizar_busca(termo)
+        cartao = Q(cartao_upper=termo.upper())
+        nome = Q(nome_busca__contains=normalizado)
+        # The FTS5 trigram tokenizer only matches terms of 3+ characters.
+        if connections[self.db].vendor == 'sqlite' and len(normalizado) >= 3:
+            frase = '"' + normalizado.replace('"', '""') + '"'
+            nome = Q(id__in=RawSQL(
+                'SELECT rowid FROM core_cliente_busca WHERE core_cliente_busca MATCH %s',
+                [frase],
+            ))
+
+        return (
+            self
+            .annotate(cartao_upper=Upper('codigo_cartao'))
+            .filter(cartao | nome)
+            .annotate(relevancia=Case(
+                When(cartao, then=Value(0)),
+                When(nome_busca__startswith=normalizado, then=Value(1)),
+                default=Value(2),
+            ))
+            .order_by('relevancia', 'nome')
+        )
+
+
 class Cliente(models.Model):
     nome = models.CharField(max_length=200)
     codigo_cartao = models.CharField(max_length=100, unique=True, blank=True, null=True)
@@ -87,14 +182,29 @@ class Cliente(models.Model):
     ativo = models.BooleanField(default=True)
     criado_em = models.DateTimeField(auto_now_add=True)
 
+    # ``nome`` lower-cased and without accents, kept up to date by save().
+    nome_busca = models.CharField(max_length=200, blank=True, editable=False, db_index=True)
+
+    objects = ClienteQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Cliente'
         verbose_name_plural = 'Clientes'
         ordering = ['nome']
+        indexes = [
+            models.Index(Upper('codigo_cartao'), name='cliente_cartao_upper'),
+        ]
 
     def __str__(self):
         return self.nome
 
+    def save(self, *args, **kwargs):
+        self.nome_busca = normalizar_busca(self.nome)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'nome' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'nome_busca'}
+        super().save(*args, **kwargs)
+
 
 class Venda(models.Model):
     FORMA_PAGAMENTO_CHOICES = [
@@ -121,25 +231,111 @@ class Venda(models.Model):
     paga = models.BooleanField(default=True)
     quitada_em = models.DateTimeField(null=True, blank=True)
     observacao = models.TextField(blank=True)
+    # Read by the change feed (core.feed); bulk updates must set it too.
+    modificado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Serve the period filters of core.periodos: the monthly dashboard and
+        # reports, a client's fiado invoice/settlement and the operator's day.
+        indexes = [
+            models.Index(fields=['data_hora'], name='venda_data_hora'),
+            models.Index(fields=['cliente', 'forma_pagamento', 'paga', 'data_hora'], name='venda_cliente_fiado'),
+            models.Index(fields=['operador', 'data_hora'], name='venda_operador_data'),
+            models.Index(fields=['modificado_em', 'id'], name='venda_modificado'),
+        ]
 
     def __str__(self):
         cliente_nome = self.cliente.nome if self.cliente else "Consumidor final"
         return f"Venda #{self.id} - {cliente_nome}"
 
 
+# Daily rollup of the sales, maintained incrementally by core.resumos and
+# rebuilt from Venda by the reconstruir_resumos command. Each day, payment
+# method and paid flag is spread over a few slots; readers sum them.
+class ResumoDiario(models.Model):
+    data = models.DateField()
+    forma_pagamento = models.CharField(max_length=3, choices=Venda.FORMA_PAGAMENTO_CHOICES)
+    paga = models.BooleanField()
+    slot = models.PositiveSmallIntegerField(default=0)
+    quantidade = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = 'Resumo Diário'
+        verbose_name_plural = 'Resumos Diários'
+        ordering = ['data', 'forma_pagamento', 'paga', 'slot']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['data', 'forma_pagamento', 'paga', 'slot'], name='resumo_diario_slot_unico',
+            ),
+        ]
+
+
+# Sales of each product per local month, maintained with ResumoDiario by
+# core.resumos. ``custo`` sums the items' ``custo_unitario``. Each product and
+# month is spread over a few slots, like ContadorVendas; readers sum them.
+class ResumoProdutoMes(models.Model):
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='resumos_mensais')
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    slot = models.PositiveSmallIntegerField(default=0)
+    quantidade = models.IntegerField(default=0)
+    valor = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    custo = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = 'Resumo Mensal de Produto'
+        verbose_name_plural = 'Resumos Mensais de Produtos'
+        ordering = ['ano', 'mes', 'produto', 'slot']
+        constraints = [
+            models.UniqueConstraint(fields=['ano', 'mes', 'produto', 'slot'], name='resumo_produto_mes_slot_unico'),
+        ]
+
+
+# Number of sales and revenue of all time, spread over a few slots so
+# concurrent checkouts rarely update the same row (see core.resumos).
+class ContadorVendas(models.Model):
+    slot = models.PositiveSmallIntegerField(unique=True)
+    quantidade = models.BigIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = 'Contador de Vendas'
+        verbose_name_plural = 'Contadores de Vendas'
+        ordering = ['slot']
+
+    def __str__(self):
+        return f"#{self.slot}: {self.quantidade}"
+
+
 class ItemVenda(models.Model):
     venda = models.ForeignKey(Venda, on_delete=models.CASCADE, related_name='itens')
     produto = models.ForeignKey(Produto, on_delete=models.CASCADE)
     quantidade = models.IntegerField(default=1)
     preco_unitario = models.DecimalField(max_digits=10, decimal_places=2)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    # Product cost at the time of the sale; later cost changes (weighted
+    # average on stock entries) don't alter past profit.
+    custo_unitario = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        verbose_name='Custo unitário',
+    )
+    modificado_em = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'Item de Venda'
         verbose_name_plural = 'Itens de Venda'
+        indexes = [
+            models.Index(fields=['modificado_em', 'id'], name='itemvenda_modificado'),
+        ]
 
     def save(self, *args, **kwargs):
         self.subtotal = self.quantidade * self.preco_unitario
+        if self.custo_unitario is None:
+            self.custo_unitario = self.produto.custo
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -171,6 +367,91 @@ class MovimentacaoEstoque(models.Model):
         verbose_name = 'Movimentação de Estoque'
         verbose_name_plural = 'Movimentações de Estoque'
         ordering = ['-criado_em']
+        indexes = [
+            models.Index(fields=['criado_em', 'id'], name='movimentacao_criado'),
+        ]
 
     def __str__(self):
         return f"{self.get_tipo_display()} - {self.produto.nome} ({self.quantidade})"
+
+
+# Response of a finished checkout, replayed when a terminal retries a request
+# with the same Idempotency-Key.
+class ChaveIdempotencia(models.Model):
+    chave = models.CharField(max_length=100)
+    operador = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    venda = models.ForeignKey(Venda, on_delete=models.SET_NULL, null=True, blank=True)
+    resposta = models.JSONField()
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Chave de Idempotência'
+        verbose_name_plural = 'Chaves de Idempotência'
+        constraints = [
+            models.UniqueConstraint(fields=['operador', 'chave'], name='chave_idempotencia_unica'),
+        ]
+
+    def __str__(self):
+        return self.chave
+
+
+# Append-only change log of the POS catalog. The autoincrement id is the
+# sequence terminals sync from (see core.catalogo.alteracoes_desde) and the
+# catalog version; rows hold a plain id so deleted products can still be
+# reported. A null ``produto_id`` is a category change, which may affect the
+# whole catalog; ``cadastro`` marks edits of the product or category record,
+# as opposed to stock movements.
+class AlteracaoProduto(models.Model):
+    produto_id = models.BigIntegerField(null=True)
+    cadastro = models.BooleanField(default=False)
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Alteração de Produto'
+        verbose_name_plural = 'Alterações de Produto'
+        indexes = [
+            models.Index(fields=['cadastro', 'id'], name='alteracao_cadastro'),
+        ]
+
+
+# Closed month: the reports frozen by core.fechamentos. ``versao`` is bumped
+# whenever a sale of the month changes; stored data of an older version is
+# regenerated on the next read.
+class FechamentoMes(models.Model):
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    fechado_em = models.DateTimeField(auto_now_add=True)
+    fechado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    versao = models.PositiveIntegerField(default=1)
+    atualizado_em = models.DateTimeField(default=timezone.now)
+    relatorio = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    painel = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+
+    class Meta:
+        verbose_name = 'Fechamento de Mês'
+        verbose_name_plural = 'Fechamentos de Mês'
+        ordering = ['-ano', '-mes']
+        constraints = [
+            models.UniqueConstraint(fields=['ano', 'mes'], name='fechamento_mes_unico'),
+        ]
+
+    def __str__(self):
+        return f'{self.mes:02d}/{self.ano}'
+
+
+class ArquivoFechamento(models.Model):
+    fechamento = models.ForeignKey(FechamentoMes, on_delete=models.CASCADE, related_name='arquivos')
+    nome = models.CharField(max_length=100)
+    versao = models.PositiveIntegerField()
+    conteudo = models.BinaryField()
+    gerado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Arquivo de Fechamento'
+        verbose_name_plural = 'Arquivos de Fechamento'
+        constraints = [
+            models.UniqueConstraint(fields=['fechamento', 'nome'], name='arquivo_fechamento_unico'),
+        ]
+
+    def __str__(self):
+        return self.nome
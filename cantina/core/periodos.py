@@ -0,0 +1,27 @@
+"""Local calendar periods as half-open ``[inicio, fim)`` datetime ranges.
+
+Filtering with ``data_hora__gte=inicio, data_hora__lt=fim`` compares the
+stored UTC values directly and can use the ``Venda.data_hora`` indexes,
+unlike ``__year``/``__month``/``__date``, which convert every row to the
+local timezone first.
+"""
+
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+
+def _inicio_do_dia(data):
+    return timezone.make_aware(datetime(data.year, data.month, data.day))
+
+
+def intervalo_dia(data):
+    """Range of the local day ``data``."""
+    return _inicio_do_dia(data), _inicio_do_dia(data + timedelta(days=1))
+
+
+def intervalo_mes(ano, mes):
+    """Range of the local month ``mes``/``ano``."""
+    inicio = timezone.make_aware(datetime(ano, mes, 1))
+    fim = timezone.make_aware(datetime(ano + 1, 1, 1) if mes == 12 else datetime(ano, mes + 1, 1))
+    return inicio, fim
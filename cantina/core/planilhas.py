@@ -0,0 +1,99 @@
+"""XLSX writing: write-only workbooks with shared named styles.
+
+No Django imports here: the worker processes that render the month-end
+invoices (``relatorios.faturas_zip``) are spawned and import this module
+without setting Django up.
+"""
+
+import io
+
+MOEDA = 'R$ #,##0.00'
+
+# Named styles shared by the cells of the XLSX files:
+# name -> (bold, font color, font size, fill, centered, currency)
+_ESTILOS = {
+    'titulo': (True, None, 13, None, False, False),
+    'cabecalho': (True, 'FFFFFF', None, '1F2937', True, False),
+    'moeda': (False, None, None, None, False, True),
+    'subtotal': (True, None, None, 'F3F4F6', False, False),
+    'subtotal_moeda': (True, None, None, 'F3F4F6', False, True),
+    'total_cantina': (True, None, None, 'DBEAFE', False, False),
+    'total_cantina_moeda': (True, None, None, 'DBEAFE', False, True),
+    'total_geral': (True, None, None, 'D1FAE5', False, False),
+    'total_geral_moeda': (True, None, None, 'D1FAE5', False, True),
+    'total_fatura': (True, None, None, 'E5E7EB', False, False),
+    'total_fatura_moeda': (True, None, None, 'E5E7EB', False, True),
+    'pendente': (True, 'DC2626', None, 'FEE2E2', False, False),
+    'pendente_moeda': (True, 'DC2626', None, 'FEE2E2', False, True),
+}
+
+
+def planilha(titulo, larguras):
+    """Write-only workbook with the named styles and one sheet with the column widths."""
+    from openpyxl import Workbook
+    from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    for nome, (negrito, cor, tamanho, fundo, centro, moeda) in _ESTILOS.items():
+        estilo = NamedStyle(name=nome, font=Font(bold=negrito, color=cor, size=tamanho))
+        if fundo:
+            estilo.fill = PatternFill(start_color=fundo, end_color=fundo, fill_type='solid')
+        if centro:
+            estilo.alignment = Alignment(horizontal='center')
+        if moeda:
+            estilo.number_format = MOEDA
+        wb.add_named_style(estilo)
+
+    ws = wb.create_sheet(titulo)
+    for col, largura in enumerate(larguras, 1):
+        ws.column_dimensions[get_column_letter(col)].width = largura
+    return wb, ws
+
+
+def celula(ws, valor, estilo):
+    from openpyxl.cell import WriteOnlyCell
+
+    nova = WriteOnlyCell(ws, valor)
+    nova.style = estilo
+    return nova
+
+
+def linha_total(ws, colunas, estilo, valores):
+    """Row of ``colunas`` cells in ``estilo``; ``valores`` maps column -> value (currency past column 1)."""
+    return [
+        celula(ws, valores.get(col), estilo if col == 1 or col not in valores else f'{estilo}_moeda')
+        for col in range(1, colunas + 1)
+    ]
+
+
+def fatura(titulo, aba, linhas, total_geral, total_pendente, destino):
+    """
+    Writes an invoice to ``destino``; ``linhas`` are
+    ``(data, produto, quantidade, preço unitário, subtotal, paga)``.
+    """
+    wb, ws = planilha(aba, [12, 30, 6, 14, 14, 10])
+    ws.merged_cells.add('A1:F1')
+    ws.append([celula(ws, titulo, 'titulo')])
+    ws.append([celula(ws, h, 'cabecalho') for h in ['Data', 'Produto', 'Qtd', 'Preço Unit.', 'Total', 'Status']])
+
+    # A write-only sheet serializes each row as it is appended, so the styled
+    # cells are reused across rows instead of styling a new cell per value.
+    preco, total = celula(ws, None, 'moeda'), celula(ws, None, 'moeda')
+    for data, produto, quantidade, preco_unitario, subtotal, paga in linhas:
+        preco.value = float(preco_unitario)
+        total.value = float(subtotal)
+        ws.append([data, produto, quantidade, preco, total, 'Pago' if paga else 'Pendente'])
+
+    ws.append(linha_total(ws, 6, 'total_fatura', {1: 'TOTAL', 5: float(total_geral or 0)}))
+    if total_pendente:
+        ws.append(linha_total(ws, 6, 'pendente', {1: 'PENDENTE', 5: float(total_pendente)}))
+
+    wb.save(destino)
+
+
+def fatura_bytes(titulo, aba, linhas, total_geral, total_pendente):
+    """``fatura()`` as bytes; run in the worker processes."""
+    destino = io.BytesIO()
+    fatura(titulo, aba, linhas, total_geral, total_pendente, destino)
+    return destino.getvalue()
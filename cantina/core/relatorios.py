@@ -0,0 +1,529 @@
+"""Monthly reports: the product report, the sales dashboard figures and the
+XLSX files (monthly report, client invoice and the ZIP with every invoice of
+the month), plus the monthly and weekly trend series and the weekday x hour
+heatmap.
+
+The views render these live for open months; ``fechamentos`` stores them for
+closed ones.
+"""
+
+import itertools
+import multiprocessing
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from operator import itemgetter
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from . import planilhas
+from .models import ItemVenda, ResumoDiario, ResumoProdutoMes, Venda
+from .periodos import intervalo_mes
+
+MESES_NOMES = [
+    '', 'Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
+    'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro',
+]
+
+SLUG_SERVICOS = 'servicos'
+
+TIPO_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def linhas_relatorio(ano, mes):
+    """
+    Returns (rows, totals) for the monthly report, read from the product x
+    month rollup in one query. Shared by dashboard and XLSX views.
+
+    Rows come grouped by category; the last row of each category carries the
+    category's totals in ``subtotal`` (None on the other rows).
+    """
+    itens = (
+        ResumoProdutoMes.objects
+        .filter(ano=ano, mes=mes)
+        .values(
+            'produto_id', 'produto__nome',
+            'produto__categoria_id', 'produto__categoria__slug', 'produto__categoria__nome',
+        )
+        .annotate(qtd=Sum('quantidade'), valor_total=Sum('valor'), custo_total=Sum('custo'))
+        .annotate(lucro=F('valor_total') - F('custo_total'))
+        .filter(qtd__gt=0)
+        .order_by('produto__categoria__nome', 'produto__categoria_id', 'produto__nome')
+    )
+
+    rows = []
+    categoria_id = None
+    cantina_valor = Decimal('0')
+    cantina_custo = Decimal('0')
+    servicos_valor = Decimal('0')
+    servicos_custo = Decimal('0')
+    total_qtd = 0
+
+    for item in itens:
+        qtd = item['qtd']
+        valor_total = item['valor_total']
+        custo_total = item['custo_total']
+        valor_unit = (valor_total / qtd).quantize(Decimal('0.01'))
+        custo_unit = (custo_total / qtd).quantize(Decimal('0.01'))
+        lucro = item['lucro']
+        is_servico = item['produto__categoria__slug'] == SLUG_SERVICOS
+
+        if not rows or item['produto__categoria_id'] != categoria_id:
+            categoria_id = item['produto__categoria_id']
+            subtotal = {
+                'categoria': item['produto__categoria__nome'], 'qtd': 0,
+                'valor_total': Decimal('0'), 'custo_total': Decimal('0'), 'lucro': Decimal('0'),
+            }
+        else:
+            # Only the last row of the category keeps the subtotal.
+            rows[-1]['subtotal'] = None
+        subtotal['qtd'] += qtd
+        subtotal['valor_total'] += valor_total
+        subtotal['custo_total'] += custo_total
+        subtotal['lucro'] += lucro
+
+        rows.append({
+            'nome': item['produto__nome'],
+            'categoria': item['produto__categoria__nome'],
+            'valor_unit': valor_unit,
+            'custo_unit': custo_unit,
+            'qtd': qtd,
+            'valor_total': valor_total,
+            'custo_total': custo_total,
+            'lucro': lucro,
+            'is_servico': is_servico,
+            'subtotal': subtotal,
+        })
+
+        total_qtd += qtd
+        if is_servico:
+            servicos_valor += valor_total
+            servicos_custo += custo_total
+        else:
+            cantina_valor += valor_total
+            cantina_custo += custo_total
+
+    totals = {
+        'cantina_valor': cantina_valor,
+        'cantina_custo': cantina_custo,
+        'cantina_lucro': cantina_valor - cantina_custo,
+        'servicos_valor': servicos_valor,
+        'servicos_custo': servicos_custo,
+        'servicos_lucro': servicos_valor - servicos_custo,
+        'geral_valor': cantina_valor + servicos_valor,
+        'geral_custo': cantina_custo + servicos_custo,
+        'geral_lucro': (cantina_valor + servicos_valor) - (cantina_custo + servicos_custo),
+        'total_qtd': total_qtd,
+    }
+    return rows, totals
+
+
+def painel_vendas(ano, mes):
+    """KPIs and open tabs per client of the month, for the sales dashboard."""
+    kpis = ResumoDiario.objects.filter(data__year=ano, data__month=mes).aggregate(
+        faturamento=Sum('total'),
+        qtd=Sum('quantidade'),
+        a_receber=Sum('total', filter=Q(forma_pagamento='FIA', paga=False)),
+    )
+    faturamento_mes = kpis['faturamento'] or Decimal('0')
+    qtd_vendas_mes = kpis['qtd'] or 0
+
+    inicio, fim = intervalo_mes(ano, mes)
+    fiados_raw = (
+        Venda.objects
+        .filter(data_hora__gte=inicio, data_hora__lt=fim, forma_pagamento='FIA')
+        .values('cliente_id', 'cliente__nome')
+        .annotate(
+            total_fiado=Sum('total'),
+            total_pendente=Sum('total', filter=Q(paga=False)),
+            qtd_fiado=Count('id'),
+            qtd_pendente=Count('id', filter=Q(paga=False)),
+        )
+        .order_by('cliente__nome')
+    )
+
+    fiados_por_cliente = []
+    for row in fiados_raw:
+        fiados_por_cliente.append({
+            'cliente_id': row['cliente_id'],
+            'cliente_nome': row['cliente__nome'] or 'Consumidor final',
+            'total_fiado': row['total_fiado'] or Decimal('0'),
+            'total_pendente': row['total_pendente'] or Decimal('0'),
+            'qtd_fiado': row['qtd_fiado'] or 0,
+            'qtd_pendente': row['qtd_pendente'] or 0,
+            'quitada': (row['qtd_pendente'] or 0) == 0,
+        })
+
+    return {
+        'total_a_receber_mes': kpis['a_receber'] or Decimal('0'),
+        'faturamento_mes': faturamento_mes,
+        'qtd_vendas_mes': qtd_vendas_mes,
+        'ticket_medio_mes': faturamento_mes / qtd_vendas_mes if qtd_vendas_mes else Decimal('0'),
+        'fiados_por_cliente': fiados_por_cliente,
+    }
+
+
+def _proximo_mes(data):
+    return data.replace(year=data.year + 1, month=1) if data.month == 12 else data.replace(month=data.month + 1)
+
+
+def _reais(valor):
+    return (valor or Decimal('0')).quantize(Decimal('0.01'))
+
+
+def _variacao(atual, anterior):
+    """Percent change, or None without a base to compare with."""
+    if not anterior:
+        return None
+    return ((atual - anterior) * 100 / anterior).quantize(Decimal('0.1'))
+
+
+def _por_periodo(trunc, inicio, fim):
+    return {
+        linha['periodo']: linha
+        for linha in (
+            ResumoDiario.objects
+            .filter(data__gte=inicio, data__lt=fim)
+            .annotate(periodo=trunc('data'))
+            .values('periodo')
+            .annotate(
+                faturamento=Sum('total'),
+                qtd=Sum('quantidade'),
+                fiado=Sum('total', filter=Q(forma_pagamento='FIA')),
+                fiado_pendente=Sum('total', filter=Q(forma_pagamento='FIA', paga=False)),
+            )
+            .order_by()
+        )
+    }
+
+
+def _ponto(periodo, linhas, anterior):
+    linha = linhas.get(periodo, {})
+    faturamento = _reais(linha.get('faturamento'))
+    qtd = linha.get('qtd') or 0
+    faturamento_anterior = _reais(linhas.get(anterior, {}).get('faturamento'))
+    return {
+        'periodo': periodo,
+        'faturamento': faturamento,
+        'qtd': qtd,
+        'ticket_medio': _reais(faturamento / qtd if qtd else None),
+        'fiado': _reais(linha.get('fiado')),
+        'fiado_pendente': _reais(linha.get('fiado_pendente')),
+        'faturamento_ano_anterior': faturamento_anterior,
+        'variacao_anual': _variacao(faturamento, faturamento_anterior),
+    }
+
+
+def tendencias(inicio, fim):
+    """
+    Monthly and weekly series from the month of ``inicio`` to the month of
+    ``fim`` (both first days), each point compared with the same period one
+    year before. Three grouped queries over the rollups, whatever the range.
+
+    The monthly points also carry cost and margin, from ``ResumoProdutoMes``;
+    there is no weekly cost rollup.
+    """
+    fim_exclusivo = _proximo_mes(fim)
+    base = inicio.replace(year=inicio.year - 1)
+    semana_inicial = inicio - timedelta(days=inicio.weekday())
+
+    meses = _por_periodo(TruncMonth, base, fim_exclusivo)
+    semanas = _por_periodo(TruncWeek, semana_inicial - timedelta(weeks=52), fim_exclusivo)
+    custos = {
+        (linha['ano'], linha['mes']): linha
+        for linha in (
+            ResumoProdutoMes.objects
+            .filter(ano__gte=base.year, ano__lte=fim.year)
+            .values('ano', 'mes')
+            .annotate(valor=Sum('valor'), custo=Sum('custo'))
+            .order_by()
+        )
+    }
+
+    mensal = []
+    mes = inicio
+    while mes < fim_exclusivo:
+        anterior = mes.replace(year=mes.year - 1)
+        ponto = _ponto(mes, meses, anterior)
+        atual = custos.get((mes.year, mes.month), {})
+        valor = _reais(atual.get('valor'))
+        lucro = valor - _reais(atual.get('custo'))
+        passado = custos.get((anterior.year, anterior.month), {})
+        lucro_anterior = _reais(passado.get('valor')) - _reais(passado.get('custo'))
+        ponto.update({
+            'custo': _reais(atual.get('custo')),
+            'lucro': lucro,
+            'margem': (lucro * 100 / valor).quantize(Decimal('0.1')) if valor else None,
+            'lucro_ano_anterior': lucro_anterior,
+            'variacao_lucro_anual': _variacao(lucro, lucro_anterior),
+        })
+        mensal.append(ponto)
+        mes = _proximo_mes(mes)
+
+    semanal = []
+    semana = semana_inicial
+    while semana < fim_exclusivo:
+        semanal.append(_ponto(semana, semanas, semana - timedelta(weeks=52)))
+        semana += timedelta(weeks=1)
+
+    return {'mensal': mensal, 'semanal': semanal}
+
+
+DIAS_SEMANA = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
+
+
+def mapa_calor(inicio, fim, por=None, operador_id=None, categoria=None):
+    """
+    Sales count and revenue by ISO weekday x local hour between the datetimes
+    ``inicio`` and ``fim``, as 7x24 matrices (``[dia - 1][hora]``).
+
+    Returns one series per operator or per category with ``por`` set to
+    ``'operador'``/``'categoria'``, a single one otherwise. Filtering or
+    splitting by category counts the sales with items of the category and
+    their items' value (before the sale's discount). The grouping runs in
+    one query; only the non-empty cells come back.
+    """
+    por_item = por == 'categoria' or categoria is not None
+    if por_item:
+        linhas = ItemVenda.objects.filter(venda__data_hora__gte=inicio, venda__data_hora__lt=fim)
+        data_hora, operador = 'venda__data_hora', 'venda__operador'
+        metricas = {'vendas': Count('venda', distinct=True), 'faturamento': Sum('subtotal')}
+        if categoria is not None:
+            linhas = linhas.filter(produto__categoria__slug=categoria)
+    else:
+        linhas = Venda.objects.filter(data_hora__gte=inicio, data_hora__lt=fim)
+        data_hora, operador = 'data_hora', 'operador'
+        metricas = {'vendas': Count('id'), 'faturamento': Sum('total')}
+    if operador_id is not None:
+        linhas = linhas.filter(**{f'{operador}_id': operador_id})
+
+    grupo = {'operador': f'{operador}__username', 'categoria': 'produto__categoria__nome'}.get(por)
+    campos = ['dia', 'hora'] + ([grupo] if grupo else [])
+    linhas = (
+        linhas
+        .annotate(dia=ExtractIsoWeekDay(data_hora), hora=ExtractHour(data_hora))
+        .values(*campos)
+        .annotate(**metricas)
+        .order_by()
+    )
+
+    series = {}
+    for linha in linhas:
+        nome = (linha[grupo] or '-') if grupo else 'Todas'
+        serie = series.get(nome)
+        if serie is None:
+            serie = series[nome] = {
+                'nome': nome,
+                'vendas': [[0] * 24 for _ in DIAS_SEMANA],
+                'faturamento': [[Decimal('0.00')] * 24 for _ in DIAS_SEMANA],
+            }
+        serie['vendas'][linha['dia'] - 1][linha['hora']] = linha['vendas']
+        serie['faturamento'][linha['dia'] - 1][linha['hora']] = _reais(linha['faturamento'])
+    return [series[nome] for nome in sorted(series)]
+
+
+# XLSX files larger than this are spooled to disk while being built.
+MAX_XLSX_MEMORIA = 4 * 1024 * 1024
+
+
+def arquivo_planilha(gerar):
+    """Spooled temporary file with what ``gerar(destino)`` wrote, rewound."""
+    destino = tempfile.SpooledTemporaryFile(max_size=MAX_XLSX_MEMORIA)
+    try:
+        gerar(destino)
+    except BaseException:
+        destino.close()
+        raise
+    destino.seek(0)
+    return destino
+
+
+def planilha_relatorio(ano, mes, rows, totals, destino):
+    """Writes the XLSX of the monthly report to ``destino``."""
+    wb, ws = planilhas.planilha(f"{mes:02d}-{ano}", [18, 28, 16, 12, 8, 16, 14, 14])
+
+    headers = ['Categoria', 'Produto', 'Valor Unitário', 'Custo', 'Qtd', 'Valor Total', 'Custo Total', 'Lucro']
+    ws.append([planilhas.celula(ws, h, 'cabecalho') for h in headers])
+
+    # Reused across rows, as in planilhas.fatura.
+    valor_unit, custo_unit, valor_total, custo_total, lucro = (
+        planilhas.celula(ws, None, 'moeda') for _ in range(5)
+    )
+    for r in rows:
+        valor_unit.value = float(r['valor_unit'])
+        custo_unit.value = float(r['custo_unit'])
+        valor_total.value = float(r['valor_total'])
+        custo_total.value = float(r['custo_total'])
+        lucro.value = float(r['lucro'])
+        ws.append([r['categoria'], r['nome'], valor_unit, custo_unit, r['qtd'], valor_total, custo_total, lucro])
+        # Rows stored by months closed before the subtotals have none.
+        subtotal = r.get('subtotal')
+        if subtotal:
+            linha = planilhas.linha_total(ws, 8, 'subtotal', {
+                1: f"Subtotal {subtotal['categoria']}",
+                6: float(subtotal['valor_total']),
+                7: float(subtotal['custo_total']),
+                8: float(subtotal['lucro']),
+            })
+            linha[4].value = subtotal['qtd']
+            ws.append(linha)
+
+    # Two summary rows
+    for estilo, label, prefixo in [
+        ('total_cantina', 'Total Cantina', 'cantina'),
+        ('total_geral', 'Total Geral (c/ Serviços)', 'geral'),
+    ]:
+        ws.append(planilhas.linha_total(ws, 8, estilo, {
+            1: label,
+            6: float(totals[f'{prefixo}_valor']),
+            7: float(totals[f'{prefixo}_custo']),
+            8: float(totals[f'{prefixo}_lucro']),
+        }))
+
+    wb.save(destino)
+
+
+def _vendas_fiado(ano, mes):
+    inicio, fim = intervalo_mes(ano, mes)
+    return Venda.objects.filter(forma_pagamento='FIA', data_hora__gte=inicio, data_hora__lt=fim)
+
+
+def _itens_fatura(vendas, *campos):
+    """Items of ``vendas`` as ``campos`` followed by the fields of an invoice line."""
+    return ItemVenda.objects.filter(venda__in=vendas).values_list(
+        *campos, 'venda__data_hora', 'produto__nome', 'quantidade', 'preco_unitario', 'subtotal', 'venda__paga',
+    )
+
+
+def _linha_fatura(data_hora, *resto):
+    return (timezone.localtime(data_hora).strftime('%d/%m/%Y'), *resto)
+
+
+def _titulos_fatura(nome, ano, mes):
+    return f"Fatura — {nome} — {MESES_NOMES[mes]}/{ano}", f"Fatura {mes:02d}-{ano}"
+
+
+def nome_fatura(nome, ano, mes):
+    """File name of a client's invoice."""
+    safe_nome = ''.join(c if c.isalnum() else '_' for c in nome)
+    return f"fatura_{safe_nome}_{ano}_{mes:02d}.xlsx"
+
+
+def planilha_fatura(cliente, ano, mes, destino):
+    """Writes the XLSX of the client's invoice (tab sales) for the month to ``destino``."""
+    vendas = _vendas_fiado(ano, mes).filter(cliente=cliente)
+    totais = vendas.aggregate(
+        total_geral=Sum('total'),
+        total_pendente=Sum('total', filter=Q(paga=False)),
+    )
+    itens = _itens_fatura(vendas).order_by('venda__data_hora', 'venda_id', 'id')
+
+    planilhas.fatura(
+        *_titulos_fatura(cliente.nome, ano, mes),
+        (_linha_fatura(*item) for item in itens.iterator(chunk_size=2000)),
+        totais['total_geral'], totais['total_pendente'],
+        destino,
+    )
+
+
+# Invoices submitted to the pool ahead of the one being zipped, per process.
+FILA_POR_PROCESSO = 2
+# Below this many clients starting the worker processes costs more than it saves.
+MIN_FATURAS_PARALELO = 8
+
+
+class _Saida:
+    """Unseekable file for ``zipfile``; what was written is taken out as it goes."""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def tirar(self):
+        dados = b''.join(self.partes)
+        self.partes.clear()
+        return dados
+
+
+def _faturas(ano, mes, clientes):
+    """``(nome do arquivo, argumentos de planilhas.fatura_bytes)`` per client, in order."""
+    itens = (
+        _itens_fatura(_vendas_fiado(ano, mes).filter(cliente__isnull=False), 'venda__cliente_id')
+        .order_by('venda__cliente__nome', 'venda__cliente_id', 'venda__data_hora', 'venda_id', 'id')
+    )
+    # Both queries are in client order, so the items are split by client
+    # while they are read.
+    grupos = itertools.groupby(itens.iterator(chunk_size=2000), key=itemgetter(0))
+    grupo = next(grupos, None)
+    for cliente in clientes:
+        linhas = []
+        if grupo is not None and grupo[0] == cliente['cliente_id']:
+            linhas = [_linha_fatura(*item[1:]) for item in grupo[1]]
+            grupo = next(grupos, None)
+        nome = f"{cliente['cliente_id']}_{nome_fatura(cliente['cliente__nome'], ano, mes)}"
+        yield nome, (
+            *_titulos_fatura(cliente['cliente__nome'], ano, mes),
+            linhas, cliente['total_geral'], cliente['total_pendente'],
+        )
+
+
+def _renderizar(faturas, processos):
+    """``(nome, bytes)`` of the invoices, in order; rendered by ``processos`` worker processes."""
+    if processos <= 1:
+        for nome, argumentos in faturas:
+            yield nome, planilhas.fatura_bytes(*argumentos)
+        return
+
+    # spawn: forking a server process that may be running other threads is
+    # unsafe, and planilhas needs nothing set up in the child.
+    pool = ProcessPoolExecutor(processos, mp_context=multiprocessing.get_context('spawn'))
+    fila = deque()
+    try:
+        for nome, argumentos in faturas:
+            fila.append((nome, pool.submit(planilhas.fatura_bytes, *argumentos)))
+            if len(fila) >= processos * FILA_POR_PROCESSO:
+                nome_pronto, futuro = fila.popleft()
+                yield nome_pronto, futuro.result()
+        while fila:
+            nome_pronto, futuro = fila.popleft()
+            yield nome_pronto, futuro.result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def faturas_zip(ano, mes, processos=1, progresso=None):
+    """
+    Parts of a ZIP with the invoice of every client with fiado sales in the
+    month. ``progresso(feitas, total)`` is called after each invoice.
+    """
+    clientes = list(
+        _vendas_fiado(ano, mes)
+        .filter(cliente__isnull=False)
+        .values('cliente_id', 'cliente__nome')
+        .annotate(total_geral=Sum('total'), total_pendente=Sum('total', filter=Q(paga=False)))
+        .order_by('cliente__nome', 'cliente_id')
+    )
+    if len(clientes) < MIN_FATURAS_PARALELO:
+        processos = 1
+
+    saida = _Saida()
+    # The XLSX files are already compressed.
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_STORED) as arquivo_zip:
+        faturas = _renderizar(_faturas(ano, mes, clientes), processos)
+        for feitas, (nome, conteudo) in enumerate(faturas, 1):
+            arquivo_zip.writestr(nome, conteudo)
+            if progresso is not None:
+                progresso(feitas, len(clientes))
+            yield saida.tirar()
+    yield saida.tirar()
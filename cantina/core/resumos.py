@@ -0,0 +1,236 @@
+"""Sales rollups (``ResumoDiario`` and ``ResumoProdutoMes``).
+
+``ResumoDiario`` holds one row per day x payment method x paid flag with the
+number of sales and their total; ``ResumoProdutoMes`` one row per product x
+local month with the quantity sold, the revenue and the cost. Every write
+path that creates sales or changes their payment status applies its delta
+here in the same transaction, so the dashboard and the monthly report read a
+few hundred rows instead of the period's sales. Checkouts apply their delta
+last, after the stock update, so the rollup rows stay locked only until the
+commit. ``reconstruir()`` (the ``reconstruir_resumos`` command) rebuilds both
+tables from the sales.
+
+``ContadorVendas`` keeps the all-time number of sales and revenue in
+``PARCELAS_CONTADOR`` slots; each write adds to a random slot, so concurrent
+checkouts rarely wait on the same row. ``reconciliar_contador()`` (the
+``reconciliar_contador_vendas`` command) recounts it from the sales.
+``ResumoDiario`` (``PARCELAS_DIARIO``) and ``ResumoProdutoMes``
+(``PARCELAS_PRODUTO_MES``) are spread the same way, so terminals taking the
+same payment method or selling the same product do not queue on one row;
+their readers sum the slots.
+
+Since every change to the sales passes through here, this is also where the
+stored reports of closed months are outdated (``fechamentos.invalidar``).
+"""
+
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear, TruncDate
+from django.utils import timezone
+
+from . import fechamentos
+from .models import ContadorVendas, FechamentoMes, ItemVenda, ResumoDiario, ResumoProdutoMes, Venda
+
+PARCELAS_CONTADOR = 8
+PARCELAS_DIARIO = 8
+PARCELAS_PRODUTO_MES = 4
+
+
+def _incrementar(modelo, deltas):
+    """
+    Adds ``{chave: {campo: valor}}`` to the rollup rows of ``modelo``, where
+    ``chave`` is a tuple of ``(campo, valor)`` pairs identifying the row.
+
+    All rows are written by a single ``INSERT ... ON CONFLICT DO UPDATE``
+    (Postgres and SQLite), so the number of queries does not depend on how
+    many rows a sale touches.
+    """
+    # Sorted, so concurrent transactions lock the rows in the same order.
+    linhas = [(chave, valores) for chave, valores in sorted(deltas.items()) if any(valores.values())]
+    if not linhas:
+        return
+
+    campos_chave = [campo for campo, _ in linhas[0][0]]
+    campos_valor = list(linhas[0][1])
+    campos = [modelo._meta.get_field(campo) for campo in campos_chave + campos_valor]
+    q = connection.ops.quote_name
+    tabela = q(modelo._meta.db_table)
+    colunas = [q(campo.column) for campo in campos]
+    colunas_valor = colunas[len(campos_chave):]
+
+    valores = []
+    for chave, incremento in linhas:
+        brutos = [valor for _, valor in chave] + [incremento[campo] for campo in campos_valor]
+        valores.extend(
+            campo.get_db_prep_save(valor, connection) for campo, valor in zip(campos, brutos)
+        )
+    linha_sql = '(' + ', '.join(['%s'] * len(campos)) + ')'
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {tabela} ({", ".join(colunas)}) '
+            f'VALUES {", ".join([linha_sql] * len(linhas))} '
+            f'ON CONFLICT ({", ".join(colunas[:len(campos_chave)])}) DO UPDATE SET '
+            + ', '.join(f'{coluna} = {tabela}.{coluna} + excluded.{coluna}' for coluna in colunas_valor),
+            valores,
+        )
+
+
+def _delta_diario():
+    return defaultdict(lambda: {'quantidade': 0, 'total': Decimal('0')})
+
+
+def _chave_diaria(data, forma, paga, slot):
+    return (('data', data), ('forma_pagamento', forma), ('paga', paga), ('slot', slot))
+
+
+def _vendas(vendas, sinal):
+    deltas = _delta_diario()
+    geral = {'quantidade': 0, 'total': Decimal('0')}
+    slot = random.randrange(PARCELAS_DIARIO)
+    for venda in vendas:
+        delta = deltas[_chave_diaria(timezone.localdate(venda.data_hora), venda.forma_pagamento, venda.paga, slot)]
+        for soma in (delta, geral):
+            soma['quantidade'] += sinal
+            soma['total'] += sinal * venda.total
+    _incrementar(ResumoDiario, deltas)
+    _incrementar(ContadorVendas, {(('slot', random.randrange(PARCELAS_CONTADOR)),): geral})
+    return {(chave[0][1].year, chave[0][1].month) for chave in deltas}
+
+
+def _itens(itens, sinal):
+    deltas = defaultdict(lambda: {'quantidade': 0, 'valor': Decimal('0'), 'custo': Decimal('0')})
+    slot = random.randrange(PARCELAS_PRODUTO_MES)
+    for item in itens:
+        data = timezone.localdate(item.venda.data_hora)
+        delta = deltas[(('ano', data.year), ('mes', data.month), ('produto_id', item.produto_id), ('slot', slot))]
+        delta['quantidade'] += sinal * item.quantidade
+        delta['valor'] += sinal * item.subtotal
+        delta['custo'] += sinal * item.quantidade * item.custo_unitario
+    _incrementar(ResumoProdutoMes, deltas)
+    return {(chave[0][1], chave[1][1]) for chave in deltas}
+
+
+def adicionar(vendas, itens=()):
+    """
+    Counts new sales and their items in the rollups. The items need ``venda``
+    loaded.
+    """
+    fechamentos.invalidar(_vendas(vendas, 1) | _itens(itens, 1))
+
+
+def remover(vendas, itens=()):
+    """Takes sales and items out of the rollups, before they are deleted or changed."""
+    fechamentos.invalidar(_vendas(vendas, -1) | _itens(itens, -1))
+
+
+def quitar(pendentes):
+    """
+    Moves the unpaid sales of the ``pendentes`` queryset to the paid rows.
+    Must run in the same transaction as the update that pays them, with the
+    rows locked.
+    """
+    deltas = _delta_diario()
+    # The unpaid side may go negative in this slot; only the sum counts.
+    slot = random.randrange(PARCELAS_DIARIO)
+    por_dia = (
+        pendentes
+        .filter(paga=False)
+        .annotate(data=TruncDate('data_hora'))
+        .values('data', 'forma_pagamento')
+        .annotate(quantidade=Count('id'), soma=Sum('total'))
+        .order_by()
+    )
+    for linha in por_dia:
+        for paga, sinal in ((False, -1), (True, 1)):
+            delta = deltas[_chave_diaria(linha['data'], linha['forma_pagamento'], paga, slot)]
+            delta['quantidade'] += sinal * linha['quantidade']
+            delta['total'] += sinal * linha['soma']
+    _incrementar(ResumoDiario, deltas)
+    fechamentos.invalidar((linha['data'].year, linha['data'].month) for linha in por_dia)
+
+
+def totais_vendas():
+    """All-time ``qtd_vendas`` and ``faturamento``, read from the counter slots."""
+    totais = ContadorVendas.objects.aggregate(qtd_vendas=Sum('quantidade'), faturamento=Sum('total'))
+    return {'qtd_vendas': totais['qtd_vendas'] or 0, 'faturamento': totais['faturamento'] or Decimal('0')}
+
+
+@transaction.atomic
+def reconciliar_contador():
+    """
+    Recounts the sales counter from the sales. Returns ``(antes, depois)``
+    as ``totais_vendas()`` dicts.
+    """
+    ContadorVendas.objects.bulk_create(
+        [ContadorVendas(slot=slot) for slot in range(PARCELAS_CONTADOR)],
+        ignore_conflicts=True,
+    )
+    # Checkouts committing after this lock add to the slots after the recount.
+    list(ContadorVendas.objects.select_for_update().order_by('slot'))
+    antes = totais_vendas()
+
+    totais = Venda.objects.aggregate(quantidade=Count('id'), total=Sum('total'))
+    ContadorVendas.objects.filter(slot__gte=PARCELAS_CONTADOR).delete()
+    ContadorVendas.objects.exclude(slot=0).update(quantidade=0, total=0)
+    ContadorVendas.objects.filter(slot=0).update(quantidade=totais['quantidade'], total=totais['total'] or 0)
+    return antes, totais_vendas()
+
+
+@transaction.atomic
+def reconstruir():
+    """
+    Rebuilds both rollups from the sales; returns the number of rows.
+    """
+    ResumoDiario.objects.all().delete()
+    ResumoProdutoMes.objects.all().delete()
+
+    diarios = [
+        ResumoDiario(
+            data=linha['data'],
+            forma_pagamento=linha['forma_pagamento'],
+            paga=linha['paga'],
+            quantidade=linha['quantidade'],
+            total=linha['soma'],
+        )
+        for linha in (
+            Venda.objects
+            .annotate(data=TruncDate('data_hora'))
+            .values('data', 'forma_pagamento', 'paga')
+            .annotate(quantidade=Count('id'), soma=Sum('total'))
+            .order_by()
+        )
+    ]
+    mensais = [
+        ResumoProdutoMes(
+            produto_id=linha['produto_id'],
+            ano=linha['ano'],
+            mes=linha['mes'],
+            quantidade=linha['qtd'],
+            valor=linha['soma'],
+            custo=linha['custo_total'],
+        )
+        for linha in (
+            ItemVenda.objects
+            .annotate(ano=ExtractYear('venda__data_hora'), mes=ExtractMonth('venda__data_hora'))
+            .values('produto_id', 'ano', 'mes')
+            .annotate(
+                qtd=Sum('quantidade'),
+                soma=Sum('subtotal'),
+                custo_total=Sum(
+                    F('quantidade') * F('custo_unitario'),
+                    output_field=DecimalField(max_digits=12, decimal_places=2),
+                ),
+            )
+            .order_by()
+        )
+    ]
+    ResumoDiario.objects.bulk_create(diarios, batch_size=500)
+    ResumoProdutoMes.objects.bulk_create(mensais, batch_size=500)
+    fechamentos.invalidar(FechamentoMes.objects.values_list('ano', 'mes'))
+    reconciliar_contador()
+    return len(diarios) + len(mensais)
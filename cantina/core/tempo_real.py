@@ -0,0 +1,131 @@
+"""Live catalog updates pushed to the POS over Server-Sent Events.
+
+Each ASGI process runs one ``Hub``. While at least one page is connected the
+hub follows the catalog change log (``catalogo.alteracoes_desde``) and fans
+the changes out to every connection, so the database is polled once per
+process instead of once per terminal. Commits made in the same process wake
+the hub right away; changes committed by other processes are picked up on
+the next poll.
+"""
+
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.dispatch import receiver
+
+from . import catalogo
+
+# Seconds between polls of the change log while pages are connected.
+INTERVALO = 1.0
+# Comment line sent on idle streams so proxies keep the connection open.
+INTERVALO_PING = 15.0
+# A page that falls this many events behind is disconnected; EventSource
+# reconnects with Last-Event-ID and catches up from the change log.
+MAX_FILA = 100
+
+
+class Hub:
+    def __init__(self):
+        self.filas = set()
+        self._loop = None
+        self._acordar = None
+        self._tarefa = None
+        self._sequencia = None
+        self._estado = {}
+
+    def assinar(self):
+        """Registers a connection; returns the queue its events arrive on."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._acordar = asyncio.Event()
+            self._tarefa = None
+        if self._tarefa is None or self._tarefa.done():
+            self._sequencia = None
+            self._estado = {}
+            self._tarefa = loop.create_task(self._acompanhar())
+
+        fila = asyncio.Queue(maxsize=MAX_FILA)
+        self.filas.add(fila)
+        return fila
+
+    def cancelar(self, fila):
+        self.filas.discard(fila)
+
+    def notificar(self):
+        """Wakes the hub; safe to call from any thread."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._acordar.set)
+
+    async def _acompanhar(self):
+        self._sequencia = await sync_to_async(catalogo.sequencia_atual)()
+        while self.filas:
+            try:
+                await asyncio.wait_for(self._acordar.wait(), INTERVALO)
+            except asyncio.TimeoutError:
+                pass
+            self._acordar.clear()
+
+            dados = await sync_to_async(catalogo.alteracoes_desde)(self._sequencia)
+            self._sequencia = dados['sequencia']
+            evento = self._novidades(dados)
+            if evento['produtos'] or evento['removidos']:
+                self._publicar(evento)
+
+    def _novidades(self, dados):
+        """
+        Keeps only what changed since the last event: the change log resends
+        recent changes on every poll.
+        """
+        produtos = [p for p in dados['produtos'] if self._estado.get(p['id']) != p]
+        removidos = dados['removidos']
+        if dados['completo']:
+            ativos = {p['id'] for p in dados['produtos']}
+            removidos = [i for i, p in self._estado.items() if p is not None and i not in ativos]
+        removidos = [i for i in removidos if i not in self._estado or self._estado[i] is not None]
+
+        self._estado.update({p['id']: p for p in produtos})
+        self._estado.update({i: None for i in removidos})
+        return {
+            'sequencia': self._sequencia,
+            'completo': False,
+            'produtos': produtos,
+            'removidos': removidos,
+        }
+
+    def _publicar(self, evento):
+        for fila in list(self.filas):
+            try:
+                fila.put_nowait(evento)
+            except asyncio.QueueFull:
+                self.cancelar(fila)
+
+
+hub = Hub()
+
+
+def _formatar(dados):
+    return f"id: {dados['sequencia']}\nevent: catalogo\ndata: {json.dumps(dados)}\n\n"
+
+
+async def eventos(desde):
+    """SSE stream: the changes after ``desde``, then every change as it happens."""
+    fila = hub.assinar()
+    try:
+        yield _formatar(await sync_to_async(catalogo.alteracoes_desde)(desde))
+        while fila in hub.filas:
+            try:
+                dados = await asyncio.wait_for(fila.get(), INTERVALO_PING)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield _formatar(dados)
+    finally:
+        hub.cancelar(fila)
+
+
+@receiver(catalogo.catalogo_alterado)
+def _acordar_hub(sender, **kwargs):
+    hub.notificar()
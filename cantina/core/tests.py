@@ -1,11 +1,31 @@
+import asyncio
+import gzip
+import io
 import json
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from unittest import mock
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from .models import Categoria, Cliente, Produto, Venda
+from . import cartoes, catalogo, checkout, estoque, feed, planilhas, relatorios, resumos, tempo_real
+from .checkout import carregar_produtos
+from .models import (
+    AlteracaoProduto, Categoria, ChaveIdempotencia, Cliente, ContadorVendas, FechamentoMes, ItemVenda,
+    MovimentacaoEstoque, Produto, ResumoDiario, ResumoProdutoMes, Venda,
+)
+from .periodos import intervalo_dia, intervalo_mes
 
 
 class POSFlowTests(TestCase):
@@ -147,5 +167,1430 @@ class POSFlowTests(TestCase):
 
         response = self.client.get(reverse('exportar_vendas_csv'))
         self.assertEqual(response.status_code, 200)
-        self.assertIn('Cartao', response.content.decode('utf-8'))
-        self.assertNotIn('Cartão', response.content.decode('utf-8'))
+        conteudo = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('Cartao', conteudo)
+        self.assertNotIn('Cartão', conteudo)
+
+    def test_exportar_vendas_csv_por_periodo_e_gzip(self):
+        for dia in (date(2025, 3, 1), date(2025, 3, 31), date(2025, 4, 1)):
+            Venda.objects.create(
+                operador=self.user, data_hora=timezone.make_aware(datetime.combine(dia, datetime.min.time())),
+                subtotal=Decimal('10.00'), total=Decimal('10.00'), forma_pagamento='DIN',
+            )
+        self.user.is_superuser = True
+        self.user.save(update_fields=['is_superuser'])
+
+        periodo = {'de': '2025-03-01', 'ate': '2025-03-31'}
+        response = self.client.get(reverse('exportar_vendas_csv'), periodo)
+        linhas = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([linha.split(',')[1] for linha in linhas[1:]], ['31/03/2025 00:00', '01/03/2025 00:00'])
+
+        response = self.client.get(reverse('exportar_vendas_csv'), {**periodo, 'gzip': '1'})
+        self.assertIn('vendas_2025-03-01_2025-03-31.csv.gz', response['Content-Disposition'])
+        self.assertEqual(len(gzip.decompress(b''.join(response.streaming_content)).splitlines()), 3)
+
+        response = self.client.get(reverse('exportar_vendas_csv'), {'de': '31/03/2025'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='op', password='123456')
+        self.client.login(username='op', password='123456')
+
+        self.categoria = Categoria.objects.create(nome='Lanches', slug='lanches')
+        self.pizza = Produto.objects.create(
+            nome='Pizza', categoria=self.categoria,
+            custo=Decimal('12.00'), preco=Decimal('30.00'), estoque=12,
+        )
+        self.fatia = Produto.objects.create(
+            nome='Pizza Fatia', categoria=self.categoria,
+            custo=Decimal('2.00'), preco=Decimal('6.00'),
+            produto_estoque=self.pizza, fator_estoque=1,
+        )
+        self.produtos = [
+            Produto.objects.create(
+                nome=f'Salgado {i}', categoria=self.categoria,
+                custo=Decimal('1.00'), preco=Decimal('4.00'), estoque=20,
+            )
+            for i in range(6)
+        ]
+
+    def _finalizar(self, itens, forma='DIN'):
+        payload = {
+            'cliente_id': None,
+            'forma_pagamento': forma,
+            'desconto_percentual': 0,
+            'itens': itens,
+        }
+        return self.client.post(
+            reverse('finalizar_venda'),
+            data=json.dumps(payload),
+            content_type='application/json',
+        )
+
+    def test_quantidade_de_queries_nao_depende_do_carrinho(self):
+        with CaptureQueriesContext(connection) as um_item:
+            response = self._finalizar([{'id': self.produtos[0].id, 'quantity': 1}])
+        self.assertEqual(response.status_code, 200)
+
+        with CaptureQueriesContext(connection) as varios_itens:
+            response = self._finalizar(
+                [{'id': p.id, 'quantity': 2} for p in self.produtos]
+                + [{'id': self.fatia.id, 'quantity': 3}]
+            )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(len(um_item), len(varios_itens))
+        venda = Venda.objects.latest('id')
+        self.assertEqual(venda.itens.count(), 7)
+        self.assertEqual(venda.subtotal, Decimal('66.00'))
+
+    def test_produto_vinculado_consome_estoque_da_fonte(self):
+        response = self._finalizar([{'id': self.fatia.id, 'quantity': 4}])
+
+        self.assertEqual(response.status_code, 200)
+        self.pizza.refresh_from_db()
+        self.fatia.refresh_from_db()
+        self.assertEqual(self.pizza.estoque, 8)
+        self.assertEqual(self.fatia.estoque, 0)
+
+    def test_linhas_que_dividem_a_mesma_fonte_somam_o_consumo(self):
+        self.pizza.fator_estoque = 6
+        self.pizza.save(update_fields=['fator_estoque'])
+
+        response = self._finalizar([
+            {'id': self.pizza.id, 'quantity': 1},
+            {'id': self.fatia.id, 'quantity': 7},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Estoque insuficiente', response.json()['error'])
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.estoque, 12)
+        self.assertFalse(Venda.objects.exists())
+
+    def test_produto_inativo_retorna_404(self):
+        self.produtos[0].ativo = False
+        self.produtos[0].save(update_fields=['ativo'])
+
+        response = self._finalizar([{'id': self.produtos[0].id, 'quantity': 1}])
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Venda.objects.exists())
+
+    @override_settings(CHECKOUT_STOCK_MODE='conditional')
+    def test_modo_condicional_baixa_estoque_da_fonte(self):
+        response = self._finalizar([
+            {'id': self.fatia.id, 'quantity': 2},
+            {'id': self.produtos[0].id, 'quantity': 5},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.pizza.refresh_from_db()
+        self.produtos[0].refresh_from_db()
+        self.assertEqual(self.pizza.estoque, 10)
+        self.assertEqual(self.produtos[0].estoque, 15)
+
+    @override_settings(CHECKOUT_STOCK_MODE='conditional')
+    def test_modo_condicional_rejeita_quando_estoque_acabou(self):
+        itens = [{'id': self.fatia.id, 'quantity': 3}]
+        # Stock changed after the checkout read it: the conditional UPDATE
+        # is what must reject the sale.
+        Produto.objects.filter(id=self.pizza.id).update(estoque=2)
+
+        def leitura_antiga(ids, bloquear):
+            produtos = carregar_produtos(ids, bloquear)
+            produtos[self.pizza.id].estoque = 12
+            return produtos
+
+        with mock.patch('core.checkout.carregar_produtos', side_effect=leitura_antiga):
+            response = self._finalizar(itens)
+
+        self.assertEqual(response.status_code, 400)
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.estoque, 2)
+        self.assertFalse(Venda.objects.exists())
+
+    @override_settings(CHECKOUT_STOCK_MODE='conditional')
+    def test_modo_condicional_ignora_produto_sem_controle_de_estoque(self):
+        Produto.objects.filter(id=self.pizza.id).update(estoque=0)
+
+        response = self._finalizar([{'id': self.fatia.id, 'quantity': 3}])
+
+        self.assertEqual(response.status_code, 200)
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.estoque, 0)
+
+
+class EstoqueParceladoTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin', password='123456', is_superuser=True)
+        self.client.login(username='admin', password='123456')
+
+        self.categoria = Categoria.objects.create(nome='Lanches', slug='lanches')
+        self.pizza = Produto.objects.create(
+            nome='Pizza', categoria=self.categoria,
+            custo=Decimal('12.00'), preco=Decimal('30.00'), estoque=10,
+            estoque_parcelas=4,
+        )
+        estoque.distribuir(self.pizza, 10)
+        self.fatia = Produto.objects.create(
+            nome='Pizza Fatia', categoria=self.categoria,
+            custo=Decimal('2.00'), preco=Decimal('6.00'),
+            produto_estoque=self.pizza,
+        )
+
+    def _finalizar(self, produto, quantidade):
+        payload = {
+            'forma_pagamento': 'DIN',
+            'itens': [{'id': produto.id, 'quantity': quantidade}],
+        }
+        return self.client.post(
+            reverse('finalizar_venda'),
+            data=json.dumps(payload),
+            content_type='application/json',
+        )
+
+    def _estoque_atual(self):
+        return Produto.objects.com_estoque_atual().get(id=self.pizza.id).estoque_atual
+
+    def test_distribuir_divide_o_total_entre_as_parcelas(self):
+        quantidades = list(self.pizza.parcelas.values_list('quantidade', flat=True))
+        self.assertEqual(quantidades, [3, 3, 2, 2])
+
+    def test_venda_consome_parcelas_sem_alterar_estoque_consolidado(self):
+        response = self._finalizar(self.fatia, 2)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._estoque_atual(), 8)
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.estoque, 10)
+
+        estoque.consolidar()
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.estoque, 8)
+
+    def test_venda_maior_que_qualquer_parcela_usa_varias_parcelas(self):
+        response = self._finalizar(self.fatia, 9)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._estoque_atual(), 1)
+
+    def test_venda_acima_do_total_e_rejeitada(self):
+        response = self._finalizar(self.fatia, 11)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._estoque_atual(), 10)
+        self.assertFalse(Venda.objects.exists())
+
+    def test_entrada_de_estoque_redistribui_parcelas(self):
+        self._finalizar(self.fatia, 3)
+
+        response = self.client.post(reverse('estoque'), {
+            'produto_id': self.pizza.id,
+            'tipo': 'ENT',
+            'quantidade': 5,
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.estoque, 12)
+        self.assertEqual(self._estoque_atual(), 12)
+
+
+class CheckoutRetryTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='admin', password='123456', is_superuser=True)
+        self.client.login(username='admin', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.produto = Produto.objects.create(
+            nome='Suco', categoria=categoria,
+            custo=Decimal('2.50'), preco=Decimal('5.00'), estoque=10,
+        )
+        self.payload = json.dumps({
+            'forma_pagamento': 'DIN',
+            'itens': [{'id': self.produto.id, 'quantity': 1}],
+        })
+
+    def _finalizar(self):
+        return self.client.post(
+            reverse('finalizar_venda'), data=self.payload, content_type='application/json',
+        )
+
+    @mock.patch('core.checkout.time.sleep')
+    def test_banco_bloqueado_e_repetido_de_forma_transparente(self, sleep):
+        original = checkout._registrar_venda
+        chamadas = []
+
+        def bloqueia_na_primeira(*args):
+            chamadas.append(args)
+            if len(chamadas) == 1:
+                raise OperationalError('database is locked')
+            return original(*args)
+
+        with mock.patch('core.checkout._registrar_venda', side_effect=bloqueia_na_primeira):
+            response = self._finalizar()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(chamadas), 2)
+        self.assertEqual(Venda.objects.count(), 1)
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.estoque, 9)
+
+        retries = self.client.get(reverse('metricas_checkout')).json()['retries']
+        self.assertEqual(retries['bloqueado'], 1)
+        self.assertEqual(retries['esgotado'], 0)
+
+    @mock.patch('core.checkout.time.sleep')
+    def test_conflito_persistente_retorna_503(self, sleep):
+        with mock.patch('core.checkout._registrar_venda', side_effect=OperationalError('database is locked')):
+            response = self._finalizar()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(sleep.call_count, checkout.MAX_TENTATIVAS - 1)
+        self.assertEqual(checkout.contadores_retry()['esgotado'], 1)
+
+    def test_erro_que_nao_e_conflito_nao_e_repetido(self):
+        with mock.patch('core.checkout._registrar_venda', side_effect=OperationalError('no such table')) as registrar:
+            response = self._finalizar()
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(registrar.call_count, 1)
+
+
+class IdempotenciaTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='op', password='123456')
+        self.client.login(username='op', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.produto = Produto.objects.create(
+            nome='Suco', categoria=categoria,
+            custo=Decimal('2.50'), preco=Decimal('5.00'), estoque=10,
+        )
+        self.payload = {
+            'forma_pagamento': 'DIN',
+            'itens': [{'id': self.produto.id, 'quantity': 2}],
+        }
+
+    def _finalizar(self, payload=None, **headers):
+        return self.client.post(
+            reverse('finalizar_venda'),
+            data=json.dumps(payload or self.payload),
+            content_type='application/json',
+            headers=headers,
+        )
+
+    def test_chave_repetida_devolve_resposta_original_sem_vender_de_novo(self):
+        primeira = self._finalizar(**{'Idempotency-Key': 'abc-123'})
+        segunda = self._finalizar(**{'Idempotency-Key': 'abc-123'})
+
+        self.assertEqual(primeira.status_code, 200)
+        self.assertEqual(segunda.status_code, 200)
+        self.assertEqual(segunda.json(), primeira.json())
+        self.assertEqual(segunda['Idempotent-Replayed'], 'true')
+        self.assertEqual(Venda.objects.count(), 1)
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.estoque, 8)
+
+    def test_chave_no_corpo_da_requisicao(self):
+        payload = {**self.payload, 'idempotency_key': 'no-corpo'}
+
+        self._finalizar(payload)
+        self._finalizar(payload)
+
+        self.assertEqual(Venda.objects.count(), 1)
+
+    def test_venda_rejeitada_nao_consome_a_chave(self):
+        payload = {**self.payload, 'itens': [{'id': self.produto.id, 'quantity': 50}]}
+        self.assertEqual(self._finalizar(payload, **{'Idempotency-Key': 'k1'}).status_code, 400)
+
+        response = self._finalizar(**{'Idempotency-Key': 'k1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_chave_expirada_ainda_nao_removida_vale_como_nova(self):
+        self._finalizar(**{'Idempotency-Key': 'abc-123'})
+        ChaveIdempotencia.objects.update(criado_em=timezone.now() - timedelta(hours=25))
+
+        response = self._finalizar(**{'Idempotency-Key': 'abc-123'})
+
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Venda.objects.count(), 2)
+        self.assertEqual(ChaveIdempotencia.objects.get().venda_id, response.json()['venda_id'])
+
+    def test_chaves_expiradas_sao_removidas(self):
+        self._finalizar(**{'Idempotency-Key': 'antiga'})
+        self._finalizar(**{'Idempotency-Key': 'recente'})
+        ChaveIdempotencia.objects.filter(chave='antiga').update(
+            criado_em=timezone.now() - timedelta(hours=25)
+        )
+
+        call_command('limpar_idempotencia', stdout=io.StringIO())
+
+        self.assertEqual(
+            list(ChaveIdempotencia.objects.values_list('chave', flat=True)), ['recente']
+        )
+
+
+class SincronizarVendasTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='op', password='123456')
+        self.client.login(username='op', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.cliente = Cliente.objects.create(nome='Aluno 1', codigo_cartao='ABC123')
+        self.produto = Produto.objects.create(
+            nome='Suco', categoria=categoria,
+            custo=Decimal('2.50'), preco=Decimal('5.00'), estoque=5,
+        )
+        self.data_hora = timezone.now() - timedelta(hours=2)
+
+    def _venda(self, uuid, quantidade, **extra):
+        return {
+            'uuid': uuid,
+            'data_hora': self.data_hora.isoformat(),
+            'forma_pagamento': 'DIN',
+            'itens': [{'id': self.produto.id, 'quantity': quantidade}],
+            **extra,
+        }
+
+    def _sincronizar(self, vendas):
+        return self.client.post(
+            reverse('sincronizar_vendas'),
+            data=json.dumps({'vendas': vendas}),
+            content_type='application/json',
+        )
+
+    def test_lote_informa_resultado_por_venda(self):
+        response = self._sincronizar([
+            self._venda('u1', 2),
+            self._venda('u2', 4),
+            self._venda('u3', 3, forma_pagamento='FIA', cliente_id=self.cliente.id),
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        resultados = response.json()['resultados']
+        self.assertEqual([r['uuid'] for r in resultados], ['u1', 'u2', 'u3'])
+        self.assertEqual([r['success'] for r in resultados], [True, False, True])
+        self.assertIn('Estoque insuficiente', resultados[1]['error'])
+
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.estoque, 0)
+        vendas = Venda.objects.order_by('id')
+        self.assertEqual(vendas.count(), 2)
+        self.assertEqual(vendas[0].data_hora, self.data_hora)
+        self.assertFalse(vendas[1].paga)
+
+    def test_lote_reenviado_nao_duplica_vendas(self):
+        lote = [self._venda('u1', 1), self._venda('u2', 1)]
+        primeira = self._sincronizar(lote).json()['resultados']
+
+        segunda = self._sincronizar(lote).json()['resultados']
+
+        self.assertEqual(Venda.objects.count(), 2)
+        self.assertTrue(all(r['duplicada'] for r in segunda))
+        self.assertEqual(
+            [r['venda_id'] for r in segunda], [r['venda_id'] for r in primeira]
+        )
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.estoque, 3)
+
+    def test_quantidade_de_queries_nao_depende_do_lote(self):
+        self.produto.estoque = 0
+        self.produto.save(update_fields=['estoque'])
+        with CaptureQueriesContext(connection) as pequeno:
+            self._sincronizar([self._venda('a1', 1)])
+        with CaptureQueriesContext(connection) as grande:
+            self._sincronizar([self._venda(f'b{i}', 1) for i in range(8)])
+
+        self.assertEqual(len(pequeno), len(grande))
+        self.assertEqual(Venda.objects.count(), 9)
+
+    def test_venda_sem_uuid_ou_data_e_rejeitada(self):
+        sem_uuid = self._venda('', 1)
+        sem_data = self._venda('u1', 1, data_hora='ontem')
+
+        resultados = self._sincronizar([sem_uuid, sem_data]).json()['resultados']
+
+        self.assertEqual([r['error'] for r in resultados], ['UUID inválido', 'Data/hora inválida'])
+        self.assertFalse(Venda.objects.exists())
+
+
+class CatalogoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='op', password='123456')
+        self.client.login(username='op', password='123456')
+
+        self.categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.produto = Produto.objects.create(
+            nome='Suco', categoria=self.categoria,
+            custo=Decimal('2.50'), preco=Decimal('5.00'), estoque=10,
+        )
+        Produto.objects.create(
+            nome='Antigo', categoria=self.categoria,
+            custo=Decimal('1.00'), preco=Decimal('2.00'), ativo=False,
+        )
+
+    def test_catalogo_lista_somente_produtos_ativos(self):
+        response = self.client.get(reverse('catalogo'))
+
+        self.assertEqual(response.status_code, 200)
+        dados = response.json()
+        self.assertEqual([c['slug'] for c in dados['categorias']], ['bebidas'])
+        self.assertEqual(dados['produtos'], [{
+            'id': self.produto.id, 'nome': 'Suco', 'descricao': '',
+            'preco': '5.00', 'estoque': 10, 'fonte': self.produto.id, 'fator': 1,
+            'estoque_fonte': 10, 'categoria': 'bebidas',
+        }])
+
+    def test_estoque_do_catalogo_e_o_consumido_no_checkout(self):
+        caixa = Produto.objects.create(
+            nome='Suco (caixa)', categoria=self.categoria, custo=Decimal('12.00'),
+            preco=Decimal('25.00'), produto_estoque=self.produto, fator_estoque=6,
+        )
+        Produto.objects.filter(id=self.produto.id).update(ativo=False)
+
+        dados = self.client.get(reverse('catalogo')).json()
+
+        self.assertEqual(
+            [(p['id'], p['estoque'], p['fonte'], p['fator'], p['estoque_fonte']) for p in dados['produtos']],
+            [(caixa.id, 1, self.produto.id, 6, 10)],
+        )
+
+    def test_catalogo_em_cache_responde_304_sem_consultar_o_banco(self):
+        etag = self.client.get(reverse('catalogo'))['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('catalogo'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        catalogo_queries = [q for q in queries if 'core_produto' in q['sql']]
+        self.assertEqual(catalogo_queries, [])
+
+    @mock.patch.object(catalogo, 'MARGEM_SEQUENCIA', timedelta(0))
+    def test_alteracao_de_produto_muda_a_versao(self):
+        etag = self.client.get(reverse('catalogo'))['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produto.preco = Decimal('6.00')
+            self.produto.save()
+        response = self.client.get(reverse('catalogo'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['produtos'][0]['preco'], '6.00')
+
+    @mock.patch.object(catalogo, 'MARGEM_SEQUENCIA', timedelta(0))
+    def test_venda_atualiza_estoque_do_catalogo(self):
+        self.client.get(reverse('catalogo'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('finalizar_venda'),
+                data=json.dumps({
+                    'forma_pagamento': 'DIN',
+                    'itens': [{'id': self.produto.id, 'quantity': 3}],
+                }),
+                content_type='application/json',
+            )
+
+        response = self.client.get(reverse('catalogo'))
+        self.assertEqual(response.json()['produtos'][0]['estoque'], 7)
+
+    def _alteracoes(self, desde):
+        return self.client.get(reverse('catalogo_alteracoes'), {'desde': desde}).json()
+
+    def test_alteracoes_retorna_somente_produtos_alterados(self):
+        outro = Produto.objects.create(
+            nome='Bolo', categoria=self.categoria,
+            custo=Decimal('3.00'), preco=Decimal('7.00'), estoque=4,
+        )
+        with mock.patch.object(catalogo, 'MARGEM_SEQUENCIA', timedelta(0)):
+            desde = self._alteracoes(0)['sequencia']
+
+            self.client.post(
+                reverse('finalizar_venda'),
+                data=json.dumps({
+                    'forma_pagamento': 'DIN',
+                    'itens': [{'id': outro.id, 'quantity': 1}],
+                }),
+                content_type='application/json',
+            )
+            self.produto.ativo = False
+            self.produto.save()
+
+            dados = self._alteracoes(desde)
+
+        self.assertFalse(dados['completo'])
+        self.assertEqual([(p['id'], p['estoque']) for p in dados['produtos']], [(outro.id, 3)])
+        self.assertEqual(dados['removidos'], [self.produto.id])
+        self.assertGreater(dados['sequencia'], desde)
+
+    @mock.patch.object(catalogo, 'MARGEM_SEQUENCIA', timedelta(0))
+    def test_venda_envia_os_produtos_que_dividem_o_estoque(self):
+        pizza = Produto.objects.create(
+            nome='Pizza', categoria=self.categoria, custo=Decimal('12.00'), preco=Decimal('30.00'), estoque=12,
+        )
+        fatia = Produto.objects.create(
+            nome='Pizza Fatia', categoria=self.categoria, custo=Decimal('2.00'),
+            preco=Decimal('6.00'), produto_estoque=pizza,
+        )
+        inteira = Produto.objects.create(
+            nome='Pizza Inteira', categoria=self.categoria, custo=Decimal('12.00'),
+            preco=Decimal('30.00'), produto_estoque=pizza, fator_estoque=6,
+        )
+        desde = self._alteracoes(0)['sequencia']
+
+        self.client.post(
+            reverse('finalizar_venda'),
+            data=json.dumps({'forma_pagamento': 'DIN', 'itens': [{'id': fatia.id, 'quantity': 1}]}),
+            content_type='application/json',
+        )
+        dados = self._alteracoes(desde)
+
+        self.assertEqual(
+            sorted((p['id'], p['estoque'], p['estoque_fonte']) for p in dados['produtos']),
+            [(pizza.id, 11, 11), (fatia.id, 11, 11), (inteira.id, 1, 11)],
+        )
+
+    @mock.patch.object(catalogo, 'MARGEM_SEQUENCIA', timedelta(0))
+    def test_versao_vem_do_banco_e_nao_do_cache(self):
+        etag = self.client.get(reverse('catalogo'))['ETag']
+
+        # A change made by another worker process: nothing touches this
+        # process's cache, only the database.
+        Produto.objects.filter(id=self.produto.id).update(preco=Decimal('6.00'))
+        catalogo.registrar_alteracoes([self.produto.id])
+
+        response = self.client.get(reverse('catalogo'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['produtos'][0]['preco'], '6.00')
+
+    @mock.patch.object(catalogo, 'MARGEM_SEQUENCIA', timedelta(0))
+    def test_alteracao_de_categoria_recarrega_o_catalogo(self):
+        desde = self._alteracoes(0)['sequencia']
+
+        self.categoria.nome = 'Sucos'
+        self.categoria.save()
+
+        dados = self._alteracoes(desde)
+        self.assertTrue(dados['completo'])
+        self.assertGreater(dados['sequencia'], desde)
+
+    def test_sequencia_desconhecida_retorna_catalogo_completo(self):
+        dados = self._alteracoes(10 ** 9)
+
+        self.assertTrue(dados['completo'])
+        self.assertEqual([p['id'] for p in dados['produtos']], [self.produto.id])
+
+    def test_alteracoes_recentes_sao_reenviadas(self):
+        primeira = AlteracaoProduto.objects.order_by('id').first()
+
+        sequencia = self._alteracoes(0)['sequencia']
+        dados = self._alteracoes(primeira.id)
+
+        self.assertEqual(sequencia, primeira.id - 1)
+        self.assertEqual(dados['sequencia'], primeira.id)
+        self.assertEqual(len(dados['removidos']), 1)
+
+
+class CatalogoEventosTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='op', password='123456')
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.produto = Produto.objects.create(
+            nome='Suco', categoria=categoria,
+            custo=Decimal('2.50'), preco=Decimal('5.00'), estoque=10,
+        )
+
+    def test_sem_asgi_o_terminal_volta_ao_polling(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('catalogo_eventos'))
+
+        self.assertEqual(response.status_code, 204)
+
+    async def test_stream_envia_alteracoes_confirmadas(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('catalogo_eventos'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+
+        async def proximo_evento():
+            while True:
+                evento = await asyncio.wait_for(anext(stream), 5)
+                if isinstance(evento, bytes):
+                    evento = evento.decode()
+                if not evento.startswith(':'):
+                    return json.loads(evento.split('data: ', 1)[1])
+
+        inicial = await proximo_evento()
+        self.assertTrue(inicial['completo'])
+        self.assertEqual(inicial['produtos'][0]['preco'], '5.00')
+
+        self.produto.preco = Decimal('6.00')
+        await sync_to_async(self.produto.save)()
+
+        with mock.patch.object(tempo_real, 'INTERVALO', 0.05):
+            evento = await proximo_evento()
+        self.assertEqual(
+            [(p['id'], p['preco']) for p in evento['produtos']], [(self.produto.id, '6.00')]
+        )
+        await stream.aclose()
+
+
+class BuscaClienteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='op', password='123456')
+        self.client.login(username='op', password='123456')
+
+        self.joao = Cliente.objects.create(nome='João Silva', codigo_cartao='JOA001')
+        self.maria = Cliente.objects.create(nome='Maria João', codigo_cartao='MAR001')
+        self.cartao = Cliente.objects.create(nome='Pedro', codigo_cartao='joao')
+
+    def _buscar(self, termo):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('buscar_cliente'), {'termo': termo})
+        self.assertEqual(
+            len([q for q in queries if 'core_cliente' in q['sql']]), 1,
+        )
+        return response
+
+    def test_busca_ignora_acentos_e_ordena_por_relevancia(self):
+        response = self._buscar('Joao')
+
+        nomes = [c['nome'] for c in response.json()['clientes']]
+        self.assertEqual(nomes, ['Pedro', 'João Silva', 'Maria João'])
+
+    def test_busca_curta_usa_substring(self):
+        response = self._buscar('ri')
+
+        self.assertEqual([c['nome'] for c in response.json()['clientes']], ['Maria João'])
+
+    def test_nome_busca_acompanha_alteracao_do_nome(self):
+        self.maria.nome = 'Márcia'
+        self.maria.save(update_fields=['nome'])
+
+        self.assertEqual(Cliente.objects.busca('marcia').get(), self.maria)
+        self.assertFalse(Cliente.objects.busca('maria').exists())
+
+    def test_cliente_inativo_nao_aparece(self):
+        Cliente.objects.filter(id=self.joao.id).update(ativo=False)
+
+        response = self._buscar('JOA001')
+
+        self.assertEqual(response.status_code, 404)
+
+
+class ClientePorCartaoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='op', password='123456')
+        self.client.login(username='op', password='123456')
+        self.cliente = Cliente.objects.create(nome='Aluno 1', codigo_cartao='ABC123')
+
+    def _resolver(self, codigo):
+        return self.client.get(reverse('cliente_por_cartao', args=[codigo]))
+
+    def test_cartao_resolvido_sem_consultar_clientes(self):
+        self._resolver('ABC123')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self._resolver('abc123')
+
+        self.assertEqual(response.json()['cliente']['id'], self.cliente.id)
+        self.assertFalse([q for q in queries if 'core_cliente' in q['sql']])
+
+    def test_alteracao_de_cliente_invalida_os_cartoes(self):
+        self._resolver('ABC123')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cliente.ativo = False
+            self.cliente.save()
+            Cliente.objects.create(nome='Aluno 2', codigo_cartao='XYZ999')
+
+        self.assertEqual(self._resolver('ABC123').status_code, 404)
+        self.assertEqual(self._resolver('XYZ999').json()['cliente']['nome'], 'Aluno 2')
+
+    def test_alteracao_sem_aviso_do_cache_vale_apos_a_validade(self):
+        # Another worker saved the client: this worker's cache never saw the bump.
+        self._resolver('ABC123')
+        Cliente.objects.filter(id=self.cliente.id).update(ativo=False)
+
+        self.assertEqual(self._resolver('ABC123').status_code, 200)
+        with mock.patch.object(cartoes, 'VALIDADE', 0):
+            self.assertEqual(self._resolver('ABC123').status_code, 404)
+
+
+class ResumoDiarioTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='123456')
+        self.client.login(username='admin', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.cliente = Cliente.objects.create(nome='Aluno 1', codigo_cartao='ABC123')
+        self.produto = Produto.objects.create(
+            nome='Suco', categoria=categoria,
+            custo=Decimal('2.50'), preco=Decimal('5.00'),
+        )
+
+    def _vender(self, forma, quantidade, **extra):
+        response = self.client.post(
+            reverse('finalizar_venda'),
+            data=json.dumps({
+                'forma_pagamento': forma,
+                'itens': [{'id': self.produto.id, 'quantity': quantidade}],
+                **extra,
+            }),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['venda_id']
+
+    def _resumos(self):
+        return list(
+            ResumoDiario.objects
+            .values('forma_pagamento', 'paga')
+            .annotate(qtd=Sum('quantidade'), soma=Sum('total'))
+            .exclude(qtd=0)
+            .order_by('forma_pagamento', 'paga')
+            .values_list('forma_pagamento', 'paga', 'qtd', 'soma')
+        )
+
+    def test_resumo_acompanha_vendas_e_quitacoes(self):
+        self._vender('DIN', 2)
+        fiado = self._vender('FIA', 1, cliente_id=self.cliente.id)
+        self._vender('FIA', 3, cliente_id=self.cliente.id)
+
+        self.client.post(reverse('quitar_venda', args=[fiado]))
+        self.assertEqual(self._resumos(), [
+            ('DIN', True, 1, Decimal('10.00')),
+            ('FIA', False, 1, Decimal('15.00')),
+            ('FIA', True, 1, Decimal('5.00')),
+        ])
+
+        self.client.post(reverse('quitar_cliente_fiados', args=[self.cliente.id]))
+        self.assertEqual(self._resumos(), [
+            ('DIN', True, 1, Decimal('10.00')),
+            ('FIA', True, 2, Decimal('20.00')),
+        ])
+
+        incremental = self._resumos()
+        call_command('reconstruir_resumos', stdout=io.StringIO())
+        self.assertEqual(self._resumos(), incremental)
+
+    def test_dashboard_soma_o_resumo(self):
+        self._vender('DIN', 2)
+        self._vender('FIA', 1, cliente_id=self.cliente.id)
+
+        response = self.client.get(reverse('vendas'))
+
+        self.assertEqual(response.context['faturamento_mes'], Decimal('15.00'))
+        self.assertEqual(response.context['total_a_receber_mes'], Decimal('5.00'))
+        self.assertEqual(response.context['qtd_vendas_mes'], 2)
+        self.assertEqual(response.context['ticket_medio_mes'], Decimal('7.50'))
+
+    def test_dashboard_soma_as_parcelas_do_dia(self):
+        for slot in (0, 5):
+            with mock.patch.object(resumos.random, 'randrange', return_value=slot):
+                self._vender('DIN', 2)
+
+        self.assertEqual(ResumoDiario.objects.filter(forma_pagamento='DIN').count(), 2)
+        response = self.client.get(reverse('vendas'))
+        self.assertEqual(response.context['faturamento_mes'], Decimal('20.00'))
+        self.assertEqual(response.context['qtd_vendas_mes'], 2)
+
+    def test_contador_global_e_reconciliado(self):
+        self._vender('DIN', 2)
+        self._vender('FIA', 1, cliente_id=self.cliente.id)
+        self.assertEqual(
+            resumos.totais_vendas(), {'qtd_vendas': 2, 'faturamento': Decimal('15.00')},
+        )
+
+        ContadorVendas.objects.update(quantidade=0)
+        call_command('reconciliar_contador_vendas', stdout=io.StringIO())
+
+        self.assertEqual(
+            resumos.totais_vendas(), {'qtd_vendas': 2, 'faturamento': Decimal('15.00')},
+        )
+        self.assertEqual(ContadorVendas.objects.count(), resumos.PARCELAS_CONTADOR)
+
+    def test_produtos_nao_percorre_vendas_nem_produtos_das_categorias(self):
+        cache.clear()
+        Produto.objects.create(
+            nome='Antigo', categoria=self.produto.categoria, custo=Decimal('0.50'), preco=Decimal('1.00'), ativo=False,
+        )
+        self._vender('DIN', 2)
+
+        response = self.client.get(reverse('produtos_list'))
+        self.assertEqual(response.context['vendas_stats']['faturamento'], Decimal('10.00'))
+        self.assertEqual(
+            [(c['nome'], c['qtd_produtos']) for c in response.context['categorias']], [('Bebidas', 1)],
+        )
+
+        Produto.objects.create(
+            nome='Água', categoria=self.produto.categoria, custo=Decimal('1.00'), preco=Decimal('3.00'),
+        )
+        with mock.patch.object(catalogo, 'MARGEM_SEQUENCIA', timedelta(0)):
+            self.assertEqual(catalogo.categorias_com_contagem()[0]['qtd_produtos'], 2)
+
+
+class PeriodoTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='op', password='123456')
+        self.cliente = Cliente.objects.create(nome='Aluno 1', codigo_cartao='ABC123')
+
+    def test_intervalo_mes_usa_o_fuso_local(self):
+        with timezone.override('America/Sao_Paulo'):
+            inicio, fim = intervalo_mes(2025, 12)
+            noite = timezone.make_aware(datetime(2025, 11, 30, 22, 0))
+
+        self.assertEqual(inicio.isoformat(), '2025-12-01T00:00:00-03:00')
+        self.assertEqual(fim.isoformat(), '2026-01-01T00:00:00-03:00')
+        # 01:00 UTC on Dec 1st is still November in Sao Paulo.
+        self.assertLess(noite, inicio)
+
+    def _plano(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be scanned sequentially.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_filtros_de_periodo_usam_indices(self):
+        inicio, fim = intervalo_mes(2025, 3)
+        periodo = {'data_hora__gte': inicio, 'data_hora__lt': fim}
+        dia_inicio, dia_fim = intervalo_dia(date(2025, 3, 10))
+
+        consultas = {
+            'venda_data_hora': Venda.objects.filter(**periodo),
+            'venda_cliente_fiado': Venda.objects.filter(
+                cliente=self.cliente, forma_pagamento='FIA', paga=False, **periodo,
+            ),
+            'venda_operador_data': Venda.objects.filter(
+                operador=self.user, data_hora__gte=dia_inicio, data_hora__lt=dia_fim,
+            ),
+        }
+        for indice, queryset in consultas.items():
+            with self.subTest(indice=indice):
+                self.assertIn(indice, self._plano(queryset))
+
+
+class RelatorioMensalTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='123456')
+        self.client.login(username='admin', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.suco = Produto.objects.create(
+            nome='Suco', categoria=categoria, custo=Decimal('2.50'), preco=Decimal('5.00'),
+        )
+        self.agua = Produto.objects.create(
+            nome='Água', categoria=categoria, custo=Decimal('1.00'), preco=Decimal('3.00'),
+        )
+
+    def _vender(self, itens):
+        response = self.client.post(
+            reverse('finalizar_venda'),
+            data=json.dumps({
+                'forma_pagamento': 'DIN',
+                'itens': [{'id': produto.id, 'quantity': qtd} for produto, qtd in itens],
+            }),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def _relatorio(self):
+        hoje = timezone.localdate()
+        response = self.client.get(reverse('relatorio_mensal'), {'mes': hoje.month, 'ano': hoje.year})
+        return response.context['rows'], response.context['totals']
+
+    def test_relatorio_le_o_resumo_mensal(self):
+        self._vender([(self.suco, 2), (self.agua, 1)])
+        self._vender([(self.suco, 1)])
+        Produto.objects.filter(id=self.suco.id).update(custo=Decimal('4.00'))
+
+        rows, totals = self._relatorio()
+
+        self.assertEqual(
+            [(r['nome'], r['qtd'], r['valor_total'], r['custo_total'], r['lucro']) for r in rows],
+            [
+                ('Suco', 3, Decimal('15.00'), Decimal('7.50'), Decimal('7.50')),
+                ('Água', 1, Decimal('3.00'), Decimal('1.00'), Decimal('2.00')),
+            ],
+        )
+        self.assertEqual(totals['geral_lucro'], Decimal('9.50'))
+
+    def test_subtotais_por_categoria(self):
+        from openpyxl import load_workbook
+
+        lanches = Categoria.objects.create(nome='Lanches', slug='lanches')
+        pao = Produto.objects.create(nome='Pão', categoria=lanches, custo=Decimal('1.00'), preco=Decimal('3.00'))
+        self._vender([(self.suco, 2), (self.agua, 1), (pao, 2)])
+
+        rows, _ = self._relatorio()
+
+        self.assertEqual(
+            [(r['nome'], r['subtotal'] and r['subtotal']['categoria']) for r in rows],
+            [('Suco', None), ('Água', 'Bebidas'), ('Pão', 'Lanches')],
+        )
+        self.assertEqual(
+            rows[1]['subtotal'],
+            {
+                'categoria': 'Bebidas', 'qtd': 3, 'valor_total': Decimal('13.00'),
+                'custo_total': Decimal('6.00'), 'lucro': Decimal('7.00'),
+            },
+        )
+
+        hoje = timezone.localdate()
+        response = self.client.get(reverse('relatorio_mensal_xlsx'), {'mes': hoje.month, 'ano': hoje.year})
+        ws = load_workbook(io.BytesIO(b''.join(response.streaming_content))).active
+        linhas = list(ws.iter_rows(values_only=True))
+        self.assertEqual(linhas[3], ('Subtotal Bebidas', None, None, None, 3, 13.0, 6.0, 7.0))
+        self.assertEqual(linhas[5], ('Subtotal Lanches', None, None, None, 2, 6.0, 2.0, 4.0))
+
+    def test_parcelas_do_produto_sao_somadas(self):
+        for slot in (0, 3):
+            with mock.patch.object(resumos.random, 'randrange', return_value=slot):
+                self._vender([(self.suco, 2)])
+
+        self.assertEqual(ResumoProdutoMes.objects.filter(produto=self.suco).count(), 2)
+        rows, _ = self._relatorio()
+        self.assertEqual([(r['nome'], r['qtd'], r['valor_total']) for r in rows], [('Suco', 4, Decimal('20.00'))])
+
+    def test_custo_do_item_e_congelado_na_venda(self):
+        self._vender([(self.suco, 2)])
+        Produto.objects.filter(id=self.suco.id).update(custo=Decimal('4.00'))
+
+        call_command('reconstruir_resumos', stdout=io.StringIO())
+
+        self.assertEqual(ItemVenda.objects.get().custo_unitario, Decimal('2.50'))
+        rows, _ = self._relatorio()
+        self.assertEqual([(r['nome'], r['custo_total']) for r in rows], [('Suco', Decimal('5.00'))])
+
+
+class FechamentoMesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='123456')
+        self.client.login(username='admin', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.produto = Produto.objects.create(
+            nome='Suco', categoria=categoria, custo=Decimal('2.50'), preco=Decimal('5.00'),
+        )
+        self.cliente = Cliente.objects.create(nome='Aluno 1')
+        hoje = timezone.localdate()
+        self.mes = {'mes': hoje.month, 'ano': hoje.year}
+        anterior = hoje.replace(day=1) - timedelta(days=1)
+        self.mes_anterior = {'mes': anterior.month, 'ano': anterior.year}
+
+        response = self.client.post(
+            reverse('finalizar_venda'),
+            data=json.dumps({
+                'forma_pagamento': 'FIA',
+                'cliente_id': self.cliente.id,
+                'itens': [{'id': self.produto.id, 'quantity': 2}],
+            }),
+            content_type='application/json',
+        )
+        self.venda = Venda.objects.get(id=response.json()['venda_id'])
+
+    def _fechar(self, mes):
+        self.client.post(reverse('fechar_mes'), mes)
+        return FechamentoMes.objects.get(ano=mes['ano'], mes=mes['mes'])
+
+    def test_mes_fechado_e_servido_do_que_foi_guardado(self):
+        self._fechar(self.mes)
+        Produto.objects.filter(id=self.produto.id).update(nome='Suco de Uva')
+
+        response = self.client.get(reverse('relatorio_mensal'), self.mes)
+        self.assertEqual([r['nome'] for r in response.context['rows']], ['Suco'])
+        self.assertEqual(response.context['totals']['geral_valor'], Decimal('10.00'))
+
+        response = self.client.get(reverse('relatorio_mensal_xlsx'), self.mes)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'PK'))
+        with self.assertNumQueries(3):  # session, user, fechamento
+            response = self.client.get(
+                reverse('relatorio_mensal_xlsx'), self.mes, HTTP_IF_NONE_MATCH=response['ETag'],
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_fatura_de_mes_aberto_e_transmitida(self):
+        from openpyxl import load_workbook
+
+        url = reverse('baixar_fatura_cliente', args=[self.cliente.id, self.mes['ano'], self.mes['mes']])
+        response = self.client.get(url)
+
+        self.assertTrue(response.streaming)
+        self.assertNotIn('ETag', response)
+        ws = load_workbook(io.BytesIO(b''.join(response.streaming_content))).active
+        linhas = list(ws.iter_rows(values_only=True))
+        self.assertEqual(linhas[2][1:], ('Suco', 2, 5.0, 10.0, 'Pendente'))
+        self.assertEqual([linha[4] for linha in linhas[3:]], [10.0, 10.0])  # total, pendente
+        self.assertEqual(ws['E3'].number_format, planilhas.MOEDA)
+        self.assertEqual([r.coord for r in ws.merged_cells.ranges], ['A1:F1'])
+
+    def test_quitar_invalida_so_o_mes_afetado(self):
+        fechamento = self._fechar(self.mes)
+        anterior = self._fechar(self.mes_anterior)
+        url = reverse('baixar_fatura_cliente', args=[self.cliente.id, self.mes['ano'], self.mes['mes']])
+        etag = self.client.get(url)['ETag']
+
+        self.client.post(reverse('quitar_venda', args=[self.venda.id]))
+
+        fechamento.refresh_from_db()
+        anterior.refresh_from_db()
+        self.assertGreater(fechamento.versao, 1)
+        self.assertIsNone(fechamento.relatorio)
+        self.assertEqual(anterior.versao, 1)
+        self.assertIsNotNone(anterior.relatorio)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        response = self.client.get(reverse('vendas'), self.mes)
+        self.assertEqual(response.context['total_a_receber_mes'], Decimal('0'))
+        self.assertTrue(response.context['fiados_por_cliente'][0]['quitada'])
+
+    def test_reabrir_volta_a_calcular(self):
+        self._fechar(self.mes)
+        self.client.post(reverse('fechar_mes'), {**self.mes, 'acao': 'reabrir'})
+        Produto.objects.filter(id=self.produto.id).update(nome='Suco de Uva')
+
+        response = self.client.get(reverse('relatorio_mensal'), self.mes)
+        self.assertIsNone(response.context['fechamento'])
+        self.assertEqual([r['nome'] for r in response.context['rows']], ['Suco de Uva'])
+
+
+class VendasHojeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='op', password='123456')
+        self.client.login(username='op', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.produto = Produto.objects.create(
+            nome='Suco', categoria=categoria, custo=Decimal('2.50'), preco=Decimal('5.00'),
+        )
+
+    def _vender(self, quantidade):
+        response = self.client.post(
+            reverse('finalizar_venda'),
+            data=json.dumps({
+                'forma_pagamento': 'DIN',
+                'itens': [{'id': self.produto.id, 'quantity': quantidade}],
+            }),
+            content_type='application/json',
+        )
+        return response.json()['venda_id']
+
+    @mock.patch('core.views.MARGEM_VENDAS_HOJE', timedelta(0))
+    def test_novas_vendas_desde_a_ultima_vista(self):
+        self._vender(1)
+        ultima = self.client.get(reverse('vendas_hoje')).context['ultima']
+        nova = self._vender(2)
+        Venda.objects.create(
+            operador=User.objects.create_user(username='outro'),
+            subtotal=Decimal('5.00'), total=Decimal('5.00'), forma_pagamento='DIN',
+        )
+
+        data = self.client.get(reverse('vendas_hoje_novas'), {'desde': ultima}).json()
+
+        self.assertEqual(data['dia'], timezone.localdate().isoformat())
+        self.assertEqual((data['ultima'], [venda['id'] for venda in data['vendas']]), (nova, [nova]))
+        self.assertEqual((data['qtd'], data['total']), (2, '15.00'))
+        self.assertEqual(data['vendas'][0]['total'], '10.00')
+        self.assertEqual(data['vendas'][0]['itens'], [
+            {'quantidade': 2, 'produto': 'Suco', 'preco_unitario': '5.00'},
+        ])
+
+        Venda.objects.filter(id=nova).update(total=Decimal('8.00'))
+        data = self.client.get(reverse('vendas_hoje_novas'), {'desde': nova}).json()
+        self.assertEqual((data['ultima'], data['vendas']), (nova, []))
+        self.assertEqual((data['qtd'], data['total']), (2, '13.00'))
+
+        response = self.client.get(reverse('vendas_hoje_novas'), {'desde': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_vendas_recentes_sao_reenviadas(self):
+        # A slower checkout may still commit an id below the recent ones.
+        antiga = self._vender(1)
+        Venda.objects.filter(id=antiga).update(modificado_em=timezone.now() - timedelta(minutes=1))
+        recente = self._vender(2)
+
+        self.assertEqual(self.client.get(reverse('vendas_hoje')).context['ultima'], antiga)
+        data = self.client.get(reverse('vendas_hoje_novas'), {'desde': 0}).json()
+        self.assertEqual(([venda['id'] for venda in data['vendas']], data['ultima']), ([antiga, recente], antiga))
+
+
+class TendenciasTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='123456')
+        self.client.login(username='admin', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        produto = Produto.objects.create(
+            nome='Suco', categoria=categoria, custo=Decimal('2.50'), preco=Decimal('5.00'),
+        )
+        for data, forma, paga, qtd, total in [
+            (date(2024, 3, 5), 'DIN', True, 4, '40.00'),
+            (date(2025, 3, 4), 'DIN', True, 3, '30.00'),
+            (date(2025, 3, 4), 'FIA', False, 3, '30.00'),
+        ]:
+            ResumoDiario.objects.create(
+                data=data, forma_pagamento=forma, paga=paga, quantidade=qtd, total=Decimal(total),
+            )
+        ResumoProdutoMes.objects.create(
+            produto=produto, ano=2024, mes=3, quantidade=8, valor=Decimal('40.00'), custo=Decimal('20.00'),
+        )
+        ResumoProdutoMes.objects.create(
+            produto=produto, ano=2025, mes=3, quantidade=12, valor=Decimal('60.00'), custo=Decimal('45.00'),
+        )
+
+    def test_series_com_comparacao_anual_em_consultas_fixas(self):
+        with self.assertNumQueries(3):
+            series = relatorios.tendencias(date(2021, 4, 1), date(2025, 3, 1))
+
+        self.assertEqual(len(series['mensal']), 48)
+        marco = series['mensal'][-1]
+        self.assertEqual(marco['periodo'], date(2025, 3, 1))
+        self.assertEqual(
+            (marco['faturamento'], marco['qtd'], marco['ticket_medio']),
+            (Decimal('60.00'), 6, Decimal('10.00')),
+        )
+        self.assertEqual((marco['fiado'], marco['fiado_pendente']), (Decimal('30.00'), Decimal('30.00')))
+        self.assertEqual(marco['variacao_anual'], Decimal('50.0'))
+        self.assertEqual((marco['lucro'], marco['margem']), (Decimal('15.00'), Decimal('25.0')))
+        self.assertEqual(marco['variacao_lucro_anual'], Decimal('-25.0'))
+
+        semana = next(p for p in series['semanal'] if p['periodo'] == date(2025, 3, 3))
+        self.assertEqual((semana['faturamento'], semana['faturamento_ano_anterior']), (Decimal('60.00'), Decimal('40.00')))
+
+    def test_api_valida_o_periodo(self):
+        response = self.client.get(reverse('tendencias_api'), {'inicio': '2025-01', 'fim': '2025-03'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['mensal'][-1]['faturamento'], '60.00')
+
+        response = self.client.get(reverse('tendencias_api'), {'inicio': '2025-04', 'fim': '2025-03'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('tendencias'), {'inicio': '2025-01', 'fim': '2025-03'})
+        self.assertEqual(len(response.context['mensal']), 3)
+
+
+class MapaCalorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='123456')
+        self.client.login(username='admin', password='123456')
+        self.outro = User.objects.create_user(username='op', password='123456')
+
+        bebidas = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        lanches = Categoria.objects.create(nome='Lanches', slug='lanches')
+        suco = Produto.objects.create(nome='Suco', categoria=bebidas, custo=Decimal('2.50'), preco=Decimal('5.00'))
+        pao = Produto.objects.create(nome='Pão', categoria=lanches, custo=Decimal('1.00'), preco=Decimal('3.00'))
+
+        # Monday 10h (twice) and Wednesday 15h, local time.
+        for operador, quando, itens in [
+            (self.user, datetime(2025, 3, 3, 10, 15), [(suco, 2)]),
+            (self.outro, datetime(2025, 3, 3, 10, 40), [(suco, 1), (pao, 1)]),
+            (self.user, datetime(2025, 3, 5, 15, 0), [(pao, 2)]),
+        ]:
+            total = sum(produto.preco * qtd for produto, qtd in itens)
+            venda = Venda.objects.create(
+                operador=operador, data_hora=timezone.make_aware(quando),
+                subtotal=total, total=total, forma_pagamento='DIN',
+            )
+            for produto, qtd in itens:
+                ItemVenda.objects.create(
+                    venda=venda, produto=produto, quantidade=qtd,
+                    preco_unitario=produto.preco, subtotal=produto.preco * qtd,
+                )
+        self.inicio, self.fim = intervalo_mes(2025, 3)
+
+    def test_matriz_por_dia_e_hora_em_uma_consulta(self):
+        with self.assertNumQueries(1):
+            series = relatorios.mapa_calor(self.inicio, self.fim)
+
+        self.assertEqual([serie['nome'] for serie in series], ['Todas'])
+        vendas, faturamento = series[0]['vendas'], series[0]['faturamento']
+        self.assertEqual((len(vendas), len(vendas[0])), (7, 24))
+        self.assertEqual((vendas[0][10], faturamento[0][10]), (2, Decimal('18.00')))
+        self.assertEqual((vendas[2][15], faturamento[2][15]), (1, Decimal('6.00')))
+        self.assertEqual(sum(map(sum, vendas)), 3)
+
+    def test_separado_por_operador_e_filtrado_por_categoria(self):
+        series = relatorios.mapa_calor(self.inicio, self.fim, por='operador')
+        self.assertEqual(
+            [(serie['nome'], serie['vendas'][0][10]) for serie in series], [('admin', 1), ('op', 1)],
+        )
+
+        series = relatorios.mapa_calor(self.inicio, self.fim, categoria='lanches')
+        self.assertEqual(
+            (series[0]['vendas'][0][10], series[0]['faturamento'][0][10], series[0]['vendas'][2][15]),
+            (1, Decimal('3.00'), 1),
+        )
+
+        response = self.client.get(
+            reverse('mapa_calor_api'), {'inicio': '2025-03-01', 'fim': '2025-03-31', 'por': 'categoria'},
+        )
+        self.assertEqual([serie['nome'] for serie in response.json()['series']], ['Bebidas', 'Lanches'])
+        response = self.client.get(reverse('mapa_calor'), {'inicio': '2025-03-01', 'fim': '2025-03-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(reverse('mapa_calor_api'), {'por': 'x'}).status_code, 400)
+
+
+class ExportarItensTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='123456')
+        self.client.login(username='admin', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.suco = Produto.objects.create(
+            nome='Suco', categoria=categoria, custo=Decimal('2.50'), preco=Decimal('5.00'),
+        )
+        cliente = Cliente.objects.create(nome='Aluno 1')
+        for dia, qtd in ((date(2025, 3, 10), 2), (date(2025, 4, 2), 1)):
+            venda = Venda.objects.create(
+                cliente=cliente, operador=self.user,
+                data_hora=timezone.make_aware(datetime.combine(dia, datetime.min.time()).replace(hour=9)),
+                subtotal=5 * qtd, total=5 * qtd, forma_pagamento='CAR',
+            )
+            ItemVenda.objects.create(
+                venda=venda, produto=self.suco, quantidade=qtd,
+                preco_unitario=Decimal('5.00'), subtotal=Decimal('5.00') * qtd,
+            )
+
+    def test_uma_linha_por_item_em_uma_consulta(self):
+        response = self.client.get(reverse('exportar_itens_csv'), {'de': '2025-03-01', 'ate': '2025-03-31'})
+
+        with self.assertNumQueries(1):
+            linhas = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(linhas), 2)
+        self.assertEqual(
+            linhas[1].split(',')[2:],
+            ['10/03/2025 09:00', 'Aluno 1', 'admin', 'Cartao', 'Paga', '0.00',
+             'Suco', 'Bebidas', '2', '5.00', '2.50', '10.00'],
+        )
+
+
+@mock.patch.object(feed, 'MARGEM', timedelta(0))
+class FeedVendasTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='123456')
+        self.client.login(username='admin', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        self.suco = Produto.objects.create(
+            nome='Suco', categoria=categoria, custo=Decimal('2.50'), preco=Decimal('5.00'),
+        )
+        self.cliente = Cliente.objects.create(nome='Aluno 1')
+        self.venda = Venda.objects.create(
+            cliente=self.cliente, operador=self.user, subtotal=5, total=5, forma_pagamento='FIA', paga=False,
+        )
+        ItemVenda.objects.create(venda=self.venda, produto=self.suco, preco_unitario=Decimal('5.00'))
+        MovimentacaoEstoque.objects.create(produto=self.suco, tipo='ENT', quantidade=3, usuario=self.user)
+
+    def ler(self, **params):
+        response = self.client.get(reverse('feed_vendas'), params)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        linhas = [json.loads(linha) for linha in b''.join(response.streaming_content).splitlines()]
+        return linhas[:-1], linhas[-1]
+
+    def test_retoma_do_cursor_e_inclui_quitacoes(self):
+        registros, fim = self.ler()
+        self.assertEqual([r['fonte'] for r in registros], ['venda', 'item', 'movimentacao'])
+        self.assertEqual(registros[0]['total'], '5.00')
+        self.assertTrue(fim['completo'])
+
+        registros, fim = self.ler(desde=fim['cursor'])
+        self.assertEqual(registros, [])
+
+        self.client.post(reverse('quitar_cliente_fiados', args=[self.cliente.id]))
+        registros, fim = self.ler(desde=fim['cursor'])
+        self.assertEqual([(r['fonte'], r['id'], r['paga']) for r in registros], [('venda', self.venda.id, True)])
+
+    @override_settings(FEED_TOKEN='segredo')
+    def test_token_do_job_sem_sessao(self):
+        self.client.logout()
+        url = reverse('feed_vendas')
+
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response['WWW-Authenticate']), (401, 'Bearer'))
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer errado').status_code, 401)
+
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 4)
+
+        with override_settings(FEED_TOKEN=None):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer segredo').status_code, 401)
+
+    def test_limite_e_cursor_invalido(self):
+        registros, fim = self.ler(limite=1)
+        self.assertEqual(len(registros), 3)
+        self.assertFalse(fim['completo'])
+
+        response = self.client.get(reverse('feed_vendas'), {'desde': 'nao-e-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FaturasMesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='123456')
+        self.client.login(username='admin', password='123456')
+
+        categoria = Categoria.objects.create(nome='Bebidas', slug='bebidas')
+        suco = Produto.objects.create(nome='Suco', categoria=categoria, custo=Decimal('2.50'), preco=Decimal('5.00'))
+        self.clientes = [Cliente.objects.create(nome=nome) for nome in ('Bruno', 'Ana', 'Ana')]
+        data_hora = timezone.make_aware(datetime(2025, 3, 10, 9))
+        for qtd, cliente in enumerate(self.clientes, 1):
+            venda = Venda.objects.create(
+                cliente=cliente, operador=self.user, data_hora=data_hora,
+                subtotal=5 * qtd, total=5 * qtd, forma_pagamento='FIA', paga=False,
+            )
+            ItemVenda.objects.create(venda=venda, produto=suco, quantidade=qtd, preco_unitario=Decimal('5.00'))
+        Venda.objects.create(operador=self.user, data_hora=data_hora, total=5, forma_pagamento='DIN')
+
+    def ler(self, conteudo):
+        from openpyxl import load_workbook
+
+        arquivos = zipfile.ZipFile(io.BytesIO(conteudo))
+        return {
+            nome: [linha[4] for linha in load_workbook(io.BytesIO(arquivos.read(nome))).active.iter_rows(values_only=True)]
+            for nome in arquivos.namelist()
+        }
+
+    def test_zip_com_uma_fatura_por_cliente_em_duas_consultas(self):
+        response = self.client.get(reverse('baixar_faturas_mes', args=[2025, 3]))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        with self.assertNumQueries(2):
+            conteudo = b''.join(response.streaming_content)
+        ana, outra_ana, bruno = self.clientes[1], self.clientes[2], self.clientes[0]
+        self.assertEqual(self.ler(conteudo), {
+            f'{ana.id}_fatura_Ana_2025_03.xlsx': [None, 'Total', 10.0, 10.0, 10.0],
+            f'{outra_ana.id}_fatura_Ana_2025_03.xlsx': [None, 'Total', 15.0, 15.0, 15.0],
+            f'{bruno.id}_fatura_Bruno_2025_03.xlsx': [None, 'Total', 5.0, 5.0, 5.0],
+        })
+
+    @mock.patch.object(relatorios, 'MIN_FATURAS_PARALELO', 0)
+    def test_processos_e_progresso(self):
+        progresso = mock.Mock()
+        conteudo = b''.join(relatorios.faturas_zip(2025, 3, processos=2, progresso=progresso))
+
+        self.assertEqual(len(self.ler(conteudo)), 3)
+        self.assertEqual(progresso.call_args_list, [mock.call(1, 3), mock.call(2, 3), mock.call(3, 3)])
+
+    def test_comando_grava_o_zip_e_mostra_o_progresso(self):
+        saida = io.StringIO()
+        with tempfile.TemporaryDirectory() as pasta:
+            arquivo = f'{pasta}/faturas.zip'
+            call_command('gerar_faturas', 2025, 3, saida=arquivo, stdout=saida)
+            with open(arquivo, 'rb') as zip_gerado:
+                self.assertEqual(len(self.ler(zip_gerado.read())), 3)
+
+        self.assertIn('3/3 faturas', saida.getvalue())
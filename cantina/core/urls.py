@@ -11,17 +11,32 @@ urlpatterns = [
     path('produtos/', views.produtos_list, name='produtos_list'),
     path('vendas/', views.vendas_dashboard, name='vendas'),
     path('vendas/hoje/', views.vendas_hoje, name='vendas_hoje'),
+    path('vendas/hoje/novas/', views.vendas_hoje_novas, name='vendas_hoje_novas'),
     path('vendas/export.csv', views.exportar_vendas_csv, name='exportar_vendas_csv'),
     path('vendas/export-clientes.csv', views.exportar_vendas_clientes_csv, name='exportar_vendas_clientes_csv'),
+    path('vendas/export-itens.csv', views.exportar_itens_csv, name='exportar_itens_csv'),
     path('vendas/<int:venda_id>/quitar/', views.quitar_venda, name='quitar_venda'),
     path('clientes/<int:cliente_id>/quitar-fiados/', views.quitar_cliente_fiados, name='quitar_cliente_fiados'),
     path('estoque/', views.estoque_view, name='estoque'),
 
+    path('api/catalogo/', views.catalogo_api, name='catalogo'),
+    path('api/catalogo/alteracoes/', views.catalogo_alteracoes, name='catalogo_alteracoes'),
+    path('api/catalogo/eventos/', views.catalogo_eventos, name='catalogo_eventos'),
     path('api/buscar-cliente/', views.buscar_cliente, name='buscar_cliente'),
+    path('api/cliente-por-cartao/<str:codigo>/', views.cliente_por_cartao, name='cliente_por_cartao'),
     path('api/finalizar-venda/', views.finalizar_venda, name='finalizar_venda'),
+    path('api/sincronizar-vendas/', views.sincronizar_vendas, name='sincronizar_vendas'),
+    path('api/metricas/checkout/', views.metricas_checkout, name='metricas_checkout'),
 
     path('vendas/lancamento/', views.lancar_venda_mensal, name='lancamento_mensal'),
     path('vendas/fatura/<int:cliente_id>/<int:ano>/<int:mes>/', views.baixar_fatura_cliente, name='baixar_fatura_cliente'),
+    path('vendas/faturas/<int:ano>/<int:mes>/', views.baixar_faturas_mes, name='baixar_faturas_mes'),
     path('relatorio/mensal/', views.relatorio_mensal_dashboard, name='relatorio_mensal'),
     path('relatorio/mensal.xlsx', views.relatorio_mensal_xlsx, name='relatorio_mensal_xlsx'),
+    path('relatorio/mensal/fechar/', views.fechar_mes, name='fechar_mes'),
+    path('relatorio/tendencias/', views.tendencias_dashboard, name='tendencias'),
+    path('api/tendencias/', views.tendencias_api, name='tendencias_api'),
+    path('relatorio/mapa-calor/', views.mapa_calor_dashboard, name='mapa_calor'),
+    path('api/mapa-calor/', views.mapa_calor_api, name='mapa_calor_api'),
+    path('api/feed/vendas/', views.feed_vendas, name='feed_vendas'),
 ]
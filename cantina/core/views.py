@@ -1,26 +1,46 @@
 import csv
-import io
+import hmac
 import json
+import logging
+import zlib
 from datetime import datetime, timedelta
 from decimal import Decimal, InvalidOperation
 from urllib.parse import urlencode
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import AuthenticationForm
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
-from django.db.models import Avg, Count, Prefetch, Q, Sum
-from django.http import HttpResponse, JsonResponse
+from django.db.models import Count, Prefetch, Q, Sum
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils import timezone
-from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 
-from .models import Categoria, Cliente, ItemVenda, MovimentacaoEstoque, Produto, Venda
+from . import cartoes, catalogo, estoque, fechamentos, feed, relatorios, resumos, tempo_real
+from .checkout import (
+    VendaInvalida,
+    VendaRepetida,
+    contadores_retry,
+    registrar_lote,
+    registrar_venda,
+    resposta_venda,
+)
+from .models import Categoria, ChaveIdempotencia, Cliente, ItemVenda, MovimentacaoEstoque, Produto, Venda
+from .periodos import intervalo_dia, intervalo_mes
+from .relatorios import MESES_NOMES
 
-MAX_DESCONTO_PERCENTUAL = Decimal('50.00')
-FORMAS_PAGAMENTO_VALIDAS = {codigo for codigo, _ in Venda.FORMA_PAGAMENTO_CHOICES}
+logger = logging.getLogger(__name__)
+
+MAX_CHAVE_IDEMPOTENCIA = ChaveIdempotencia._meta.get_field('chave').max_length
 
 
 def admin_required(view_func):
@@ -48,14 +68,52 @@ def logout_view(request):
 
 @login_required
 def pos_view(request):
-    categorias = Categoria.objects.filter(ativo=True).prefetch_related('produtos')
-    produtos = Produto.objects.filter(ativo=True).select_related('categoria')
+    sequencia = catalogo.sequencia_atual()
+    _, dados = catalogo.obter_catalogo()
+    return render(request, 'pos.html', {**dados, 'sequencia': sequencia})
+
+
+def _etag_catalogo(request):
+    return str(catalogo.versao())
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_etag_catalogo)
+def catalogo_api(request):
+    """Active POS catalog; answers 304 while the catalog version is unchanged."""
+    versao, dados = catalogo.obter_catalogo()
+    return JsonResponse({'versao': versao, **dados})
+
+
+@login_required
+def catalogo_alteracoes(request):
+    """Products changed after the ``desde`` sequence, for terminals polling stock."""
+    try:
+        desde = int(request.GET.get('desde', '0'))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Sequência inválida'}, status=400)
+
+    return JsonResponse(catalogo.alteracoes_desde(desde))
 
-    context = {
-        'categorias': categorias,
-        'produtos': produtos,
-    }
-    return render(request, 'pos.html', context)
+
+@login_required
+async def catalogo_eventos(request):
+    """SSE stream of catalog changes; EventSource resumes from Last-Event-ID."""
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the stream would hold a worker for as long as the page
+        # is open. A 204 stops EventSource and the POS falls back to polling.
+        return HttpResponse(status=204)
+
+    try:
+        desde = int(request.headers.get('Last-Event-ID') or request.GET.get('desde', '0'))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Sequência inválida'}, status=400)
+
+    response = StreamingHttpResponse(tempo_real.eventos(desde), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
@@ -69,17 +127,9 @@ def buscar_cliente(request):
             status=400
         )
 
-    clientes = (
-        Cliente.objects
-        .filter(ativo=True)
-        .filter(
-            Q(codigo_cartao__iexact=termo) |
-            Q(nome__icontains=termo)
-        )
-        .order_by("nome")[:10]
-    )
+    clientes = list(Cliente.objects.filter(ativo=True).busca(termo)[:10])
 
-    if not clientes.exists():
+    if not clientes:
         return JsonResponse(
             {"success": False, "error": "Cliente não encontrado"},
             status=404
@@ -98,6 +148,20 @@ def buscar_cliente(request):
     })
 
 
+@login_required
+def cliente_por_cartao(request, codigo):
+    """Card swipe fast path, answered from the in-memory card resolver."""
+    cliente = cartoes.resolver(codigo)
+    if cliente is None:
+        return JsonResponse({"success": False, "error": "Cliente não encontrado"}, status=404)
+
+    id, nome, codigo_cartao = cliente
+    return JsonResponse({
+        "success": True,
+        "cliente": {"id": id, "nome": nome, "codigo_cartao": codigo_cartao},
+    })
+
+
 @login_required
 @require_POST
 def finalizar_venda(request):
@@ -107,150 +171,165 @@ def finalizar_venda(request):
     except json.JSONDecodeError:
         return JsonResponse({'success': False, 'error': 'JSON inválido'}, status=400)
 
-    cliente_id = data.get('cliente_id')
-    itens = data.get('itens', [])
-    forma = data.get('forma_pagamento')
-
-    if not itens:
+    if not isinstance(data, dict):
         return JsonResponse({'success': False, 'error': 'Dados incompletos'}, status=400)
 
-    if forma not in FORMAS_PAGAMENTO_VALIDAS:
-        return JsonResponse({'success': False, 'error': 'Forma de pagamento inválida'}, status=400)
+    chave = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if chave is not None:
+        chave = str(chave).strip()
+        if not chave or len(chave) > MAX_CHAVE_IDEMPOTENCIA:
+            return JsonResponse({'success': False, 'error': 'Chave de idempotência inválida'}, status=400)
 
     try:
-        desconto_percentual = Decimal(str(data.get('desconto_percentual', 0)))
-    except (InvalidOperation, TypeError, ValueError):
-        return JsonResponse({'success': False, 'error': 'Desconto inválido'}, status=400)
+        venda = registrar_venda(request.user, data, chave_idempotencia=chave)
+    except VendaRepetida as exc:
+        response = JsonResponse(exc.resposta)
+        response['Idempotent-Replayed'] = 'true'
+        return response
+    except VendaInvalida as exc:
+        return JsonResponse({'success': False, 'error': exc.mensagem}, status=exc.status)
+    except Exception:
+        logger.exception('Erro ao finalizar venda')
+        return JsonResponse({'success': False, 'error': 'Erro interno ao finalizar venda'}, status=500)
 
-    if desconto_percentual < 0 or desconto_percentual > MAX_DESCONTO_PERCENTUAL:
-        return JsonResponse({'success': False, 'error': 'Desconto deve estar entre 0% e 50%'}, status=400)
+    return JsonResponse(resposta_venda(venda))
 
-    cliente = None
-    if cliente_id:
-        cliente = get_object_or_404(Cliente, id=cliente_id, ativo=True)
 
-    if forma == 'FIA' and not cliente:
-        return JsonResponse({'success': False, 'error': 'Fiado só é permitido para cliente identificado'}, status=400)
+@login_required
+@require_POST
+def sincronizar_vendas(request):
+    """Recebe um lote de vendas registradas offline por um terminal."""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'JSON inválido'}, status=400)
+
+    if not isinstance(data, dict):
+        return JsonResponse({'success': False, 'error': 'Dados incompletos'}, status=400)
 
     try:
-        with transaction.atomic():
-            subtotal = Decimal('0.00')
-            itens_validados = []
+        resultados = registrar_lote(request.user, data.get('vendas'))
+    except VendaInvalida as exc:
+        return JsonResponse({'success': False, 'error': exc.mensagem}, status=exc.status)
+    except Exception:
+        logger.exception('Erro ao sincronizar vendas')
+        return JsonResponse({'success': False, 'error': 'Erro interno ao sincronizar vendas'}, status=500)
 
-            for item in itens:
-                produto_id = item.get('id')
-                quantidade_raw = item.get('quantity')
+    return JsonResponse({'success': True, 'resultados': resultados})
 
-                if produto_id is None or quantidade_raw is None:
-                    return JsonResponse({'success': False, 'error': 'Item inválido na venda'}, status=400)
 
-                try:
-                    quantidade = int(quantidade_raw)
-                except (TypeError, ValueError):
-                    return JsonResponse({'success': False, 'error': 'Quantidade inválida'}, status=400)
-
-                if quantidade <= 0:
-                    return JsonResponse({'success': False, 'error': 'Quantidade deve ser maior que zero'}, status=400)
-
-                produto = get_object_or_404(Produto.objects.select_for_update(), id=produto_id, ativo=True)
-
-                # Determine which product's stock is consumed and by how much.
-                consumo = quantidade * produto.fator_estoque
-                if produto.produto_estoque_id:
-                    stock_prod = Produto.objects.select_for_update().get(id=produto.produto_estoque_id)
-                else:
-                    stock_prod = produto
-
-                if stock_prod.estoque > 0 and consumo > stock_prod.estoque:
-                    return JsonResponse(
-                        {'success': False, 'error': f'Estoque insuficiente para {produto.nome}'},
-                        status=400
-                    )
-
-                preco = Decimal(str(produto.preco))
-                subtotal_item = preco * quantidade
-                subtotal += subtotal_item
-
-                itens_validados.append({
-                    'produto': produto,
-                    'stock_prod': stock_prod,
-                    'consumo': consumo,
-                    'quantidade': quantidade,
-                    'preco_unitario': preco,
-                    'subtotal': subtotal_item,
-                })
-
-            desconto_valor = (subtotal * desconto_percentual) / Decimal('100')
-            total = subtotal - desconto_valor
+@login_required
+@admin_required
+def metricas_checkout(request):
+    """Retry counters of the checkout engine, to watch lock contention."""
+    return JsonResponse({'retries': contadores_retry()})
 
-            venda = Venda.objects.create(
-                cliente=cliente,
-                operador=request.user,
-                subtotal=subtotal,
-                desconto_percentual=desconto_percentual,
-                desconto_valor=desconto_valor,
-                total=total,
-                forma_pagamento=forma,
-                paga=(forma != 'FIA'),
-                quitada_em=None if forma == 'FIA' else timezone.now(),
-            )
 
-            for item in itens_validados:
-                produto    = item['produto']
-                stock_prod = item['stock_prod']
+# Sale ids are assigned at insert but become visible at commit, so a slower
+# checkout can commit a lower id after a higher one was read. Sales younger
+# than this are sent again on the next poll; the page skips those it shows.
+MARGEM_VENDAS_HOJE = timedelta(seconds=5)
 
-                if stock_prod.estoque > 0:
-                    stock_prod.estoque -= item['consumo']
-                    stock_prod.save(update_fields=['estoque'])
 
-                ItemVenda.objects.create(
-                    venda=venda,
-                    produto=produto,
-                    quantidade=item['quantidade'],
-                    preco_unitario=item['preco_unitario'],
-                    subtotal=item['subtotal'],
-                )
-
-            return JsonResponse({
-                'success': True,
-                'venda_id': venda.id,
-                'subtotal': float(subtotal),
-                'desconto_percentual': float(desconto_percentual),
-                'desconto_valor': float(desconto_valor),
-                'total': float(total),
-                'message': f'Venda #{venda.id} finalizada com sucesso!',
-            })
+def _ultima_vista(vendas, desde=0):
+    """Id the next poll starts after, for ``vendas`` sorted by id."""
+    limite = timezone.now() - MARGEM_VENDAS_HOJE
+    recente = next((venda for venda in vendas if venda.modificado_em >= limite), None)
+    if recente is not None:
+        return recente.id - 1
+    return vendas[-1].id if vendas else desde
 
-    except Exception:
-        return JsonResponse({'success': False, 'error': 'Erro interno ao finalizar venda'}, status=500)
+
+def _vendas_do_dia(usuario, dia):
+    inicio, fim = intervalo_dia(dia)
+    return Venda.objects.filter(operador=usuario, data_hora__gte=inicio, data_hora__lt=fim)
+
+
+def _totais_do_dia(usuario, dia):
+    """Number and sum of the operator's sales of ``dia``, in one aggregate."""
+    totais = _vendas_do_dia(usuario, dia).aggregate(total=Sum('total'), qtd=Count('id'))
+    return totais['qtd'], totais['total'] or Decimal('0.00')
 
 
 @login_required
 def vendas_hoje(request):
     hoje = timezone.localdate()
     vendas = (
-        Venda.objects
-        .filter(operador=request.user, data_hora__date=hoje)
+        _vendas_do_dia(request.user, hoje)
         .prefetch_related('itens__produto')
         .select_related('cliente')
         .order_by('-data_hora')
     )
-    totais = vendas.aggregate(total_dia=Sum('total'), qtd=Count('id'))
+    qtd, total = _totais_do_dia(request.user, hoje)
     return render(request, 'vendas_hoje.html', {
         'vendas': vendas,
-        'total_dia': totais['total_dia'] or 0,
-        'qtd_vendas': totais['qtd'] or 0,
+        'ultima': _ultima_vista(sorted(vendas, key=lambda venda: venda.id)),
+        'total_dia': total,
+        'qtd_vendas': qtd,
         'hoje': hoje,
     })
 
 
+def _venda_hoje_json(venda):
+    return {
+        'id': venda.id,
+        'data_hora': venda.data_hora.isoformat(),
+        'hora': timezone.localtime(venda.data_hora).strftime('%H:%M'),
+        'cliente': venda.cliente.nome if venda.cliente else None,
+        'forma_pagamento': venda.forma_pagamento,
+        'forma_pagamento_display': venda.get_forma_pagamento_display(),
+        'total': str(venda.total),
+        'desconto_percentual': str(venda.desconto_percentual) if venda.desconto_percentual else None,
+        'desconto_valor': str(venda.desconto_valor),
+        'itens': [
+            {
+                'quantidade': item.quantidade,
+                'produto': item.produto.nome,
+                'preco_unitario': str(item.preco_unitario),
+            }
+            for item in venda.itens.all()
+        ],
+    }
+
+
+@login_required
+def vendas_hoje_novas(request):
+    """
+    The operator's sales of today after venda ``desde``, so the page adds them
+    to what it shows without reloading the day, and the day's current count
+    and sum. Recent sales come again in the next poll (see
+    ``MARGEM_VENDAS_HOJE``).
+    """
+    try:
+        desde = max(int(request.GET.get('desde', 0)), 0)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Parâmetro desde inválido.'}, status=400)
+
+    hoje = timezone.localdate()
+    vendas = list(
+        _vendas_do_dia(request.user, hoje)
+        .filter(id__gt=desde)
+        .prefetch_related('itens__produto')
+        .select_related('cliente')
+        .order_by('id')
+    )
+    qtd, total = _totais_do_dia(request.user, hoje)
+    return JsonResponse({
+        'dia': hoje.isoformat(),
+        'ultima': _ultima_vista(vendas, desde),
+        'qtd': qtd,
+        'total': f'{total:.2f}',
+        'vendas': [_venda_hoje_json(venda) for venda in vendas],
+    })
+
+
 @login_required
 @admin_required
 def produtos_list(request):
     termo = request.GET.get('q', '').strip()
     categoria_slug = request.GET.get('categoria', '').strip()
 
-    produtos = Produto.objects.filter(ativo=True).select_related('categoria')
+    produtos = Produto.objects.filter(ativo=True).select_related('categoria').com_estoque_atual()
 
     if termo:
         produtos = produtos.filter(nome__icontains=termo)
@@ -258,7 +337,7 @@ def produtos_list(request):
     if categoria_slug:
         produtos = produtos.filter(categoria__slug=categoria_slug)
 
-    categorias = Categoria.objects.filter(ativo=True).prefetch_related('produtos')
+    categorias = catalogo.categorias_com_contagem()
 
     vendas = (
         Venda.objects
@@ -266,10 +345,7 @@ def produtos_list(request):
         .order_by('-data_hora')[:10]
     )
 
-    vendas_stats = Venda.objects.aggregate(
-        qtd_vendas=Count('id'),
-        faturamento=Sum('total')
-    )
+    vendas_stats = resumos.totais_vendas()
 
     return render(
         request,
@@ -285,12 +361,6 @@ def produtos_list(request):
     )
 
 
-MESES_NOMES = [
-    '', 'Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
-    'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro',
-]
-
-
 @login_required
 @admin_required
 def vendas_dashboard(request):
@@ -305,39 +375,9 @@ def vendas_dashboard(request):
         mes = hoje.month
         ano = hoje.year
 
-    vendas_mes = Venda.objects.filter(data_hora__year=ano, data_hora__month=mes)
-    fiados_mes = vendas_mes.filter(forma_pagamento='FIA')
-
-    total_a_receber_mes = (
-        fiados_mes.filter(paga=False).aggregate(total=Sum('total'))['total'] or 0
-    )
-    faturamento_mes = vendas_mes.aggregate(total=Sum('total'))['total'] or 0
-    qtd_vendas_mes = vendas_mes.count()
-    ticket_medio_mes = vendas_mes.aggregate(media=Avg('total'))['media'] or 0
-
-    fiados_raw = (
-        fiados_mes
-        .values('cliente_id', 'cliente__nome')
-        .annotate(
-            total_fiado=Sum('total'),
-            total_pendente=Sum('total', filter=Q(paga=False)),
-            qtd_fiado=Count('id'),
-            qtd_pendente=Count('id', filter=Q(paga=False)),
-        )
-        .order_by('cliente__nome')
-    )
-
-    fiados_por_cliente = []
-    for row in fiados_raw:
-        fiados_por_cliente.append({
-            'cliente_id': row['cliente_id'],
-            'cliente_nome': row['cliente__nome'] or 'Consumidor final',
-            'total_fiado': row['total_fiado'] or Decimal('0'),
-            'total_pendente': row['total_pendente'] or Decimal('0'),
-            'qtd_fiado': row['qtd_fiado'] or 0,
-            'qtd_pendente': row['qtd_pendente'] or 0,
-            'quitada': (row['qtd_pendente'] or 0) == 0,
-        })
+    inicio, fim = intervalo_mes(ano, mes)
+    vendas_mes = Venda.objects.filter(data_hora__gte=inicio, data_hora__lt=fim)
+    fechamento, painel = fechamentos.painel(ano, mes)
 
     vendas = (
         vendas_mes
@@ -351,12 +391,11 @@ def vendas_dashboard(request):
     next_ano = ano if mes < 12 else ano + 1
 
     return render(request, 'vendas.html', {
-        'total_a_receber_mes': total_a_receber_mes,
-        'faturamento_mes': faturamento_mes,
-        'qtd_vendas_mes': qtd_vendas_mes,
-        'ticket_medio_mes': ticket_medio_mes,
-        'fiados_por_cliente': fiados_por_cliente,
+        **painel,
+        'fechamento': fechamento,
         'vendas': vendas,
+        'primeiro_dia': timezone.localdate(inicio),
+        'ultimo_dia': timezone.localdate(fim - timedelta(days=1)),
         'mes': mes,
         'ano': ano,
         'mes_nome': MESES_NOMES[mes],
@@ -371,47 +410,191 @@ def vendas_dashboard(request):
 @admin_required
 @require_POST
 def quitar_venda(request, venda_id):
-    venda = get_object_or_404(Venda, id=venda_id)
+    with transaction.atomic():
+        venda = get_object_or_404(Venda.objects.select_for_update(), id=venda_id)
 
-    if venda.paga:
-        messages.info(request, f'Venda #{venda.id} já está quitada.')
-        return redirect('vendas')
+        if venda.paga:
+            messages.info(request, f'Venda #{venda.id} já está quitada.')
+            return redirect('vendas')
 
-    venda.paga = True
-    venda.quitada_em = timezone.now()
-    venda.save(update_fields=['paga', 'quitada_em'])
+        resumos.quitar(Venda.objects.filter(id=venda.id))
+        venda.paga = True
+        venda.quitada_em = timezone.now()
+        venda.save(update_fields=['paga', 'quitada_em', 'modificado_em'])
 
     messages.success(request, f'Venda #{venda.id} quitada com sucesso.')
     return redirect('vendas')
 
 
+# Payment method labels in the CSV exports, without the tilde.
+FORMAS_CSV = {forma: nome.replace('Cartão', 'Cartao') for forma, nome in Venda.FORMA_PAGAMENTO_CHOICES}
+
+
+class _Eco:
+    """File-like target for ``csv.writer`` that hands back each written row."""
+
+    def write(self, valor):
+        return valor
+
+
+def _csv_em_partes(cabecalho, linhas, linhas_por_parte=1000):
+    """CSV text in parts of ``linhas_por_parte`` rows; the header goes out first."""
+    writer = csv.writer(_Eco())
+    yield writer.writerow(cabecalho)
+    parte = []
+    for linha in linhas:
+        parte.append(writer.writerow(linha))
+        if len(parte) >= linhas_por_parte:
+            yield ''.join(parte)
+            parte = []
+    if parte:
+        yield ''.join(parte)
+
+
+def _gzip(partes):
+    # Flushed after every part, so compressed bytes stream as rows are read.
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for parte in partes:
+        yield compressor.compress(parte.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def _periodo_exportacao(params):
+    """
+    ``(inicio, fim)`` datetimes for ``?de=&ate=`` (AAAA-MM-DD, inclusive local
+    days; either may be missing). Raises ValueError on a bad date.
+    """
+    de = datetime.strptime(params['de'], '%Y-%m-%d').date() if params.get('de') else None
+    ate = datetime.strptime(params['ate'], '%Y-%m-%d').date() if params.get('ate') else None
+    return (
+        intervalo_dia(de)[0] if de else None,
+        intervalo_dia(ate)[1] if ate else None,
+    )
+
+
+def _resposta_csv(request, nome, partes):
+    """Streams the CSV parts; gzipped as ``nome.csv.gz`` with ``?gzip=1``."""
+    if request.GET.get('gzip') == '1':
+        response = StreamingHttpResponse(_gzip(partes), content_type='application/gzip')
+        response['Content-Disposition'] = f'attachment; filename="{nome}.csv.gz"'
+    else:
+        response = StreamingHttpResponse(partes, content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{nome}.csv"'
+    return response
+
+
 @login_required
 @admin_required
 def exportar_vendas_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="vendas.csv"'
+    try:
+        inicio, fim = _periodo_exportacao(request.GET)
+    except ValueError:
+        return HttpResponse('Data inválida; use AAAA-MM-DD.', status=400)
+
+    vendas = Venda.objects.all()
+    if inicio:
+        vendas = vendas.filter(data_hora__gte=inicio)
+    if fim:
+        vendas = vendas.filter(data_hora__lt=fim)
+
+    # Plain tuples read in chunks (a server-side cursor on Postgres), so
+    # memory does not grow with the number of sales.
+    linhas = (
+        [
+            id,
+            timezone.localtime(data_hora).strftime('%d/%m/%Y %H:%M'),
+            cliente or 'Consumidor final',
+            operador or '-',
+            FORMAS_CSV.get(forma, forma),
+            subtotal,
+            desconto_percentual,
+            desconto_valor,
+            total,
+            'Paga' if paga else 'Fiado',
+        ]
+        for (
+            id, data_hora, cliente, operador, forma, subtotal, desconto_percentual, desconto_valor, total, paga,
+        ) in (
+            vendas
+            .order_by('-data_hora')
+            .values_list(
+                'id', 'data_hora', 'cliente__nome', 'operador__username', 'forma_pagamento',
+                'subtotal', 'desconto_percentual', 'desconto_valor', 'total', 'paga',
+            )
+            .iterator(chunk_size=2000)
+        )
+    )
 
-    writer = csv.writer(response)
-    writer.writerow([
-        'ID', 'Data', 'Cliente', 'Operador', 'Forma de pagamento',
-        'Subtotal', 'Desconto (%)', 'Desconto (R$)', 'Total', 'Status'
-    ])
+    nome = 'vendas'
+    if request.GET.get('de') or request.GET.get('ate'):
+        nome = f"vendas_{request.GET.get('de', 'inicio')}_{request.GET.get('ate', 'hoje')}"
+    return _resposta_csv(request, nome, _csv_em_partes(
+        [
+            'ID', 'Data', 'Cliente', 'Operador', 'Forma de pagamento',
+            'Subtotal', 'Desconto (%)', 'Desconto (R$)', 'Total', 'Status'
+        ],
+        linhas,
+    ))
 
-    for venda in Venda.objects.select_related('cliente', 'operador').order_by('-data_hora'):
-        writer.writerow([
-            venda.id,
-            venda.data_hora.strftime('%d/%m/%Y %H:%M'),
-            venda.cliente.nome if venda.cliente else 'Consumidor final',
-            venda.operador.username if venda.operador else '-',
-            venda.get_forma_pagamento_display().replace('Cartão', 'Cartao'),
-            venda.subtotal,
-            venda.desconto_percentual,
-            venda.desconto_valor,
-            venda.total,
-            'Paga' if venda.paga else 'Fiado',
-        ])
 
-    return response
+@login_required
+@admin_required
+def exportar_itens_csv(request):
+    """One row per ``ItemVenda`` with its sale, product and category, for BI."""
+    try:
+        inicio, fim = _periodo_exportacao(request.GET)
+    except ValueError:
+        return HttpResponse('Data inválida; use AAAA-MM-DD.', status=400)
+
+    itens = ItemVenda.objects.all()
+    if inicio:
+        itens = itens.filter(venda__data_hora__gte=inicio)
+    if fim:
+        itens = itens.filter(venda__data_hora__lt=fim)
+
+    linhas = (
+        [
+            venda_id,
+            id,
+            timezone.localtime(data_hora).strftime('%d/%m/%Y %H:%M'),
+            cliente or 'Consumidor final',
+            operador or '-',
+            FORMAS_CSV.get(forma, forma),
+            'Paga' if paga else 'Fiado',
+            desconto_percentual,
+            produto,
+            categoria,
+            quantidade,
+            preco_unitario,
+            custo_unitario if custo_unitario is not None else '',
+            subtotal,
+        ]
+        for (
+            venda_id, id, data_hora, cliente, operador, forma, paga, desconto_percentual,
+            produto, categoria, quantidade, preco_unitario, custo_unitario, subtotal,
+        ) in (
+            itens
+            .order_by('-venda__data_hora', 'venda_id', 'id')
+            .values_list(
+                'venda_id', 'id', 'venda__data_hora', 'venda__cliente__nome', 'venda__operador__username',
+                'venda__forma_pagamento', 'venda__paga', 'venda__desconto_percentual',
+                'produto__nome', 'produto__categoria__nome',
+                'quantidade', 'preco_unitario', 'custo_unitario', 'subtotal',
+            )
+            .iterator(chunk_size=2000)
+        )
+    )
+
+    nome = 'itens_vendidos'
+    if request.GET.get('de') or request.GET.get('ate'):
+        nome = f"itens_vendidos_{request.GET.get('de', 'inicio')}_{request.GET.get('ate', 'hoje')}"
+    return _resposta_csv(request, nome, _csv_em_partes(
+        [
+            'Venda', 'Item', 'Data', 'Cliente', 'Operador', 'Forma de pagamento', 'Status',
+            'Desconto da venda (%)', 'Produto', 'Categoria', 'Qtd', 'Preço Unit.', 'Custo Unit.', 'Subtotal',
+        ],
+        linhas,
+    ))
 
 
 @login_required
@@ -464,13 +647,21 @@ def quitar_cliente_fiados(request, cliente_id):
 
     pendentes = Venda.objects.filter(cliente=cliente, paga=False, forma_pagamento='FIA')
     if mes and ano:
-        pendentes = pendentes.filter(data_hora__year=ano, data_hora__month=mes)
+        inicio, fim = intervalo_mes(ano, mes)
+        pendentes = pendentes.filter(data_hora__gte=inicio, data_hora__lt=fim)
+
+    with transaction.atomic():
+        ids = list(pendentes.select_for_update().values_list('id', flat=True))
+        pendentes = Venda.objects.filter(id__in=ids)
+        qtd = len(ids)
+        if qtd:
+            resumos.quitar(pendentes)
+            agora = timezone.now()
+            pendentes.update(paga=True, quitada_em=agora, modificado_em=agora)
 
-    qtd = pendentes.count()
     if qtd == 0:
         messages.info(request, f'Nenhuma venda fiada pendente para {cliente.nome}.')
     else:
-        pendentes.update(paga=True, quitada_em=timezone.now())
         messages.success(request, f'{qtd} venda(s) de {cliente.nome} foram quitadas.')
 
     qs = urlencode({'mes': mes, 'ano': ano}) if mes and ano else ''
@@ -515,6 +706,8 @@ def estoque_view(request):
 
         with transaction.atomic():
             produto = Produto.objects.select_for_update().get(id=produto.id)
+            if produto.estoque_parcelas:
+                produto.estoque = estoque.estoque_atual(produto, bloquear=True)
 
             if tipo == 'PER' and quantidade > produto.estoque:
                 messages.error(request, f'Estoque insuficiente para perda de {produto.nome}.')
@@ -538,6 +731,8 @@ def estoque_view(request):
                 produto.estoque -= quantidade
 
             produto.save(update_fields=update_fields)
+            if produto.estoque_parcelas:
+                estoque.distribuir(produto, produto.estoque)
 
             MovimentacaoEstoque.objects.create(
                 produto=produto,
@@ -551,7 +746,13 @@ def estoque_view(request):
         messages.success(request, 'Movimentação de estoque registrada com sucesso.')
         return redirect('estoque')
 
-    produtos = Produto.objects.filter(ativo=True).select_related('categoria').order_by('nome')
+    produtos = (
+        Produto.objects
+        .filter(ativo=True)
+        .select_related('categoria')
+        .com_estoque_atual()
+        .order_by('nome')
+    )
     movimentacoes = MovimentacaoEstoque.objects.select_related('produto', 'usuario')[:40]
 
     return render(
@@ -622,15 +823,18 @@ def lancar_venda_mensal(request):
                 observacao='Lançamento mensal manual',
             )
 
+            itens_venda = []
             for item in itens:
                 preco = Decimal(str(item['produto'].preco))
-                ItemVenda.objects.create(
+                itens_venda.append(ItemVenda.objects.create(
                     venda=venda,
                     produto=item['produto'],
                     quantidade=item['quantidade'],
                     preco_unitario=preco,
                     subtotal=preco * item['quantidade'],
-                )
+                    custo_unitario=item['produto'].custo,
+                ))
+            resumos.adicionar([venda], itens_venda)
 
         messages.success(request, f'Venda #{venda.id} lançada com sucesso! Total: R$ {subtotal:.2f}')
         return redirect('lancamento_mensal')
@@ -651,71 +855,188 @@ def lancar_venda_mensal(request):
     })
 
 
-SLUG_SERVICOS = 'servicos'
+MAX_MESES_TENDENCIA = 120
 
 
-def _build_relatorio_rows(ano, mes):
-    """Returns (rows, totals) for the monthly report. Shared by dashboard and XLSX views."""
-    itens = list(
-        ItemVenda.objects
-        .filter(venda__data_hora__year=ano, venda__data_hora__month=mes)
-        .values('produto__id', 'produto__nome', 'produto__categoria__slug', 'produto__categoria__nome')
-        .annotate(qtd_total=Sum('quantidade'), valor_total=Sum('subtotal'))
-        .order_by('produto__categoria__nome', 'produto__nome')
-    )
+def _periodo_tendencias(params):
+    """
+    ``(inicio, fim)`` months (first days) from ``?inicio=AAAA-MM&fim=AAAA-MM``;
+    the last 12 months by default. Raises ValueError on a bad range.
+    """
+    hoje = timezone.localdate()
+    fim = hoje.replace(day=1)
+    if params.get('fim'):
+        fim = datetime.strptime(params['fim'], '%Y-%m').date()
+    inicio = fim.replace(year=fim.year - 1, month=fim.month + 1) if fim.month < 12 else fim.replace(month=1)
+    if params.get('inicio'):
+        inicio = datetime.strptime(params['inicio'], '%Y-%m').date()
 
-    produto_ids = [i['produto__id'] for i in itens]
-    custos = {p.id: p.custo for p in Produto.objects.filter(id__in=produto_ids)}
-
-    rows = []
-    cantina_valor = Decimal('0')
-    cantina_custo = Decimal('0')
-    servicos_valor = Decimal('0')
-    servicos_custo = Decimal('0')
-    total_qtd = 0
-
-    for item in itens:
-        qtd = item['qtd_total'] or 0
-        valor_total = Decimal(str(item['valor_total'] or 0))
-        custo_unit = Decimal(str(custos.get(item['produto__id'], 0) or 0))
-        valor_unit = (valor_total / qtd).quantize(Decimal('0.01')) if qtd else Decimal('0')
-        custo_total = (custo_unit * qtd).quantize(Decimal('0.01'))
-        lucro = (valor_total - custo_total).quantize(Decimal('0.01'))
-        is_servico = item['produto__categoria__slug'] == SLUG_SERVICOS
-
-        rows.append({
-            'nome': item['produto__nome'],
-            'categoria': item['produto__categoria__nome'],
-            'valor_unit': valor_unit,
-            'custo_unit': custo_unit,
-            'qtd': qtd,
-            'valor_total': valor_total,
-            'custo_total': custo_total,
-            'lucro': lucro,
-            'is_servico': is_servico,
-        })
-
-        total_qtd += qtd
-        if is_servico:
-            servicos_valor += valor_total
-            servicos_custo += custo_total
-        else:
-            cantina_valor += valor_total
-            cantina_custo += custo_total
-
-    totals = {
-        'cantina_valor': cantina_valor,
-        'cantina_custo': cantina_custo,
-        'cantina_lucro': cantina_valor - cantina_custo,
-        'servicos_valor': servicos_valor,
-        'servicos_custo': servicos_custo,
-        'servicos_lucro': servicos_valor - servicos_custo,
-        'geral_valor': cantina_valor + servicos_valor,
-        'geral_custo': cantina_custo + servicos_custo,
-        'geral_lucro': (cantina_valor + servicos_valor) - (cantina_custo + servicos_custo),
-        'total_qtd': total_qtd,
+    meses = (fim.year - inicio.year) * 12 + fim.month - inicio.month + 1
+    if inicio.year < 2000 or not 1 <= meses <= MAX_MESES_TENDENCIA:
+        raise ValueError(f'O período deve ter entre 1 e {MAX_MESES_TENDENCIA} meses.')
+    return inicio, fim
+
+
+@login_required
+@admin_required
+def tendencias_dashboard(request):
+    try:
+        inicio, fim = _periodo_tendencias(request.GET)
+    except ValueError:
+        messages.error(request, 'Período inválido.')
+        inicio, fim = _periodo_tendencias({})
+
+    return render(request, 'tendencias.html', {
+        **relatorios.tendencias(inicio, fim),
+        'inicio': inicio,
+        'fim': fim,
+    })
+
+
+@login_required
+@admin_required
+def tendencias_api(request):
+    try:
+        inicio, fim = _periodo_tendencias(request.GET)
+    except ValueError:
+        return JsonResponse(
+            {'error': f'Informe inicio e fim como AAAA-MM, com até {MAX_MESES_TENDENCIA} meses.'},
+            status=400,
+        )
+
+    return JsonResponse({
+        'inicio': inicio,
+        'fim': fim,
+        **relatorios.tendencias(inicio, fim),
+    })
+
+
+MAX_DIAS_MAPA_CALOR = 5 * 366
+
+
+def _filtros_mapa_calor(params):
+    """
+    Filters of the heatmap from ``?inicio=&fim=`` (AAAA-MM-DD, inclusive; the
+    last 90 days by default), ``por``, ``operador`` and ``categoria``.
+    Raises ValueError on bad values.
+    """
+    fim = timezone.localdate()
+    if params.get('fim'):
+        fim = datetime.strptime(params['fim'], '%Y-%m-%d').date()
+    inicio = fim - timedelta(days=89)
+    if params.get('inicio'):
+        inicio = datetime.strptime(params['inicio'], '%Y-%m-%d').date()
+    if inicio.year < 2000 or not 0 <= (fim - inicio).days < MAX_DIAS_MAPA_CALOR:
+        raise ValueError('Período inválido.')
+
+    por = params.get('por') or None
+    if por not in (None, 'operador', 'categoria'):
+        raise ValueError('Agrupamento inválido.')
+    operador_id = int(params['operador']) if params.get('operador') else None
+    return {
+        'inicio': inicio,
+        'fim': fim,
+        'por': por,
+        'operador_id': operador_id,
+        'categoria': params.get('categoria') or None,
     }
-    return rows, totals
+
+
+def _mapa_calor(filtros):
+    return relatorios.mapa_calor(
+        intervalo_dia(filtros['inicio'])[0],
+        intervalo_dia(filtros['fim'])[1],
+        por=filtros['por'],
+        operador_id=filtros['operador_id'],
+        categoria=filtros['categoria'],
+    )
+
+
+@login_required
+@admin_required
+def mapa_calor_dashboard(request):
+    try:
+        filtros = _filtros_mapa_calor(request.GET)
+    except ValueError:
+        messages.error(request, 'Filtros inválidos.')
+        filtros = _filtros_mapa_calor({})
+
+    series = _mapa_calor(filtros)
+    maximo = max((max(map(max, serie['vendas'])) for serie in series), default=0)
+    for serie in series:
+        # Rows for the template: weekday label and the cells with their shade.
+        serie['linhas'] = [
+            (
+                relatorios.DIAS_SEMANA[dia],
+                [
+                    {
+                        'vendas': vendas,
+                        'faturamento': faturamento,
+                        'intensidade': f'{vendas / maximo:.2f}' if maximo else '0',
+                    }
+                    for vendas, faturamento in zip(serie['vendas'][dia], serie['faturamento'][dia])
+                ],
+            )
+            for dia in range(len(relatorios.DIAS_SEMANA))
+        ]
+
+    return render(request, 'mapa_calor.html', {
+        **filtros,
+        'series': series,
+        'horas': range(24),
+        'operadores': User.objects.filter(is_active=True).order_by('username'),
+        'categorias': Categoria.objects.filter(ativo=True),
+    })
+
+
+@login_required
+@admin_required
+def mapa_calor_api(request):
+    try:
+        filtros = _filtros_mapa_calor(request.GET)
+    except ValueError:
+        return JsonResponse(
+            {'error': f'Filtros inválidos; o período vai até {MAX_DIAS_MAPA_CALOR} dias.'},
+            status=400,
+        )
+
+    return JsonResponse({
+        **filtros,
+        'dias': relatorios.DIAS_SEMANA,
+        'series': _mapa_calor(filtros),
+    })
+
+
+def _token_feed_valido(request):
+    token = settings.FEED_TOKEN
+    esquema, _, valor = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and esquema.lower() == 'bearer' and hmac.compare_digest(
+        valor.strip().encode(), token.encode(),
+    )
+
+
+def feed_vendas(request):
+    """
+    NDJSON feed of sales, items and stock movements changed after the
+    ``desde`` cursor. Read by jobs with the ``FEED_TOKEN`` bearer token or by
+    an admin session; anything else gets a 401, not the login page.
+    """
+    if not (_token_feed_valido(request) or request.user.is_superuser):
+        response = JsonResponse({'success': False, 'error': 'Não autorizado'}, status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+
+    try:
+        posicoes = feed.ler_cursor(request.GET.get('desde', ''))
+        limite = int(request.GET.get('limite', feed.LIMITE))
+        if not (1 <= limite <= feed.LIMITE):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Cursor ou limite inválido'}, status=400)
+
+    response = StreamingHttpResponse(feed.linhas(posicoes, limite), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-store'
+    return response
 
 
 @login_required
@@ -731,7 +1052,7 @@ def relatorio_mensal_dashboard(request):
         mes = now.month
         ano = now.year
 
-    rows, totals = _build_relatorio_rows(ano, mes)
+    fechamento, rows, totals = fechamentos.relatorio(ano, mes)
 
     prev_mes = mes - 1 if mes > 1 else 12
     prev_ano = ano if mes > 1 else ano - 1
@@ -741,6 +1062,7 @@ def relatorio_mensal_dashboard(request):
     return render(request, 'relatorio.html', {
         'rows': rows,
         'totals': totals,
+        'fechamento': fechamento,
         'mes': mes,
         'ano': ano,
         'mes_nome': MESES_NOMES[mes],
@@ -752,12 +1074,33 @@ def relatorio_mensal_dashboard(request):
     })
 
 
+def _resposta_xlsx(request, filename, fechamento, nome, gerar):
+    """
+    XLSX download of what ``gerar(destino)`` writes; for a closed month the
+    stored file, answered with 304 when the client already has it.
+    """
+    if fechamento is None:
+        return FileResponse(
+            relatorios.arquivo_planilha(gerar),
+            as_attachment=True, filename=filename, content_type=relatorios.TIPO_XLSX,
+        )
+
+    etag = fechamentos.etag(fechamento)
+    last_modified = int(fechamento.atualizado_em.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        conteudo = fechamentos.arquivo(fechamento, nome, gerar)
+        response = HttpResponse(conteudo, content_type=relatorios.TIPO_XLSX)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @login_required
 @admin_required
 def relatorio_mensal_xlsx(request):
-    from openpyxl import Workbook
-    from openpyxl.styles import Alignment, Font, PatternFill
-
     now = timezone.now()
     try:
         mes = int(request.GET.get('mes', now.month))
@@ -768,157 +1111,65 @@ def relatorio_mensal_xlsx(request):
         mes = now.month
         ano = now.year
 
-    rows, totals = _build_relatorio_rows(ano, mes)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"{mes:02d}-{ano}"
-
-    header_font = Font(bold=True, color='FFFFFF')
-    header_fill = PatternFill(start_color='1F2937', end_color='1F2937', fill_type='solid')
-    center = Alignment(horizontal='center')
-    currency_fmt = 'R$ #,##0.00'
-    total_font = Font(bold=True)
-
-    headers = ['Categoria', 'Produto', 'Valor Unitário', 'Custo', 'Qtd', 'Valor Total', 'Custo Total', 'Lucro']
-    for col, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=h)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = center
-
-    for row_num, r in enumerate(rows, 2):
-        ws.cell(row=row_num, column=1, value=r['categoria'])
-        ws.cell(row=row_num, column=2, value=r['nome'])
-        ws.cell(row=row_num, column=3, value=float(r['valor_unit'])).number_format = currency_fmt
-        ws.cell(row=row_num, column=4, value=float(r['custo_unit'])).number_format = currency_fmt
-        ws.cell(row=row_num, column=5, value=r['qtd'])
-        ws.cell(row=row_num, column=6, value=float(r['valor_total'])).number_format = currency_fmt
-        ws.cell(row=row_num, column=7, value=float(r['custo_total'])).number_format = currency_fmt
-        ws.cell(row=row_num, column=8, value=float(r['lucro'])).number_format = currency_fmt
-
-    # Two summary rows
-    cantina_row = len(rows) + 2
-    geral_row = cantina_row + 1
-
-    cantina_fill = PatternFill(start_color='DBEAFE', end_color='DBEAFE', fill_type='solid')
-    geral_fill = PatternFill(start_color='D1FAE5', end_color='D1FAE5', fill_type='solid')
-
-    for col, (label, fill, key_val, key_custo, key_lucro) in enumerate([
-        ('Total Cantina', cantina_fill, 'cantina_valor', 'cantina_custo', 'cantina_lucro'),
-        ('Total Geral',   geral_fill,  'geral_valor',   'geral_custo',   'geral_lucro'),
-    ], 0):
-        row = cantina_row + col
-        fill_obj = cantina_fill if col == 0 else geral_fill
-        label_text = 'Total Cantina' if col == 0 else 'Total Geral (c/ Serviços)'
-        ws.cell(row=row, column=1, value=label_text).font = total_font
-        ws.cell(row=row, column=6, value=float(totals[key_val])).number_format = currency_fmt
-        ws.cell(row=row, column=7, value=float(totals[key_custo])).number_format = currency_fmt
-        ws.cell(row=row, column=8, value=float(totals[key_lucro])).number_format = currency_fmt
-        for c in range(1, 9):
-            cell = ws.cell(row=row, column=c)
-            cell.font = total_font
-            cell.fill = fill_obj
-
-    col_widths = [18, 28, 16, 12, 8, 16, 14, 14]
-    for col, width in enumerate(col_widths, 1):
-        ws.column_dimensions[ws.cell(row=1, column=col).column_letter].width = width
-
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    filename = f"relatorio_{ano}_{mes:02d}.xlsx"
-    response = HttpResponse(
-        buffer.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    def gerar(destino):
+        _, rows, totals = fechamentos.relatorio(ano, mes)
+        relatorios.planilha_relatorio(ano, mes, rows, totals, destino)
+
+    return _resposta_xlsx(
+        request, f"relatorio_{ano}_{mes:02d}.xlsx",
+        fechamentos.obter(ano, mes), fechamentos.ARQUIVO_RELATORIO, gerar,
     )
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return response
 
 
 @login_required
 @admin_required
-def baixar_fatura_cliente(request, cliente_id, ano, mes):
-    from openpyxl import Workbook
-    from openpyxl.styles import Alignment, Font, PatternFill
+@require_POST
+def fechar_mes(request):
+    try:
+        mes = int(request.POST.get('mes', 0))
+        ano = int(request.POST.get('ano', 0))
+        if not (1 <= mes <= 12) or ano < 2000:
+            raise ValueError
+    except (ValueError, TypeError):
+        messages.error(request, 'Mês inválido.')
+        return redirect('relatorio_mensal')
 
+    if request.POST.get('acao') == 'reabrir':
+        if fechamentos.reabrir(ano, mes):
+            messages.success(request, f'{MESES_NOMES[mes]}/{ano} foi reaberto.')
+    else:
+        fechamentos.fechar(ano, mes, request.user)
+        messages.success(request, f'{MESES_NOMES[mes]}/{ano} foi fechado.')
+
+    return redirect(f"{reverse('relatorio_mensal')}?{urlencode({'mes': mes, 'ano': ano})}")
+
+
+@login_required
+@admin_required
+def baixar_fatura_cliente(request, cliente_id, ano, mes):
     cliente = get_object_or_404(Cliente, id=cliente_id)
 
-    vendas = (
-        Venda.objects
-        .filter(cliente=cliente, forma_pagamento='FIA', data_hora__year=ano, data_hora__month=mes)
-        .prefetch_related('itens__produto')
-        .order_by('data_hora')
+    return _resposta_xlsx(
+        request, relatorios.nome_fatura(cliente.nome, ano, mes),
+        fechamentos.obter(ano, mes), f'fatura-{cliente.id}.xlsx',
+        lambda destino: relatorios.planilha_fatura(cliente, ano, mes, destino),
     )
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Fatura {mes:02d}-{ano}"
-
-    ws.merge_cells('A1:F1')
-    title = ws['A1']
-    title.value = f"Fatura — {cliente.nome} — {MESES_NOMES[mes]}/{ano}"
-    title.font = Font(bold=True, size=13)
-
-    header_font = Font(bold=True, color='FFFFFF')
-    header_fill = PatternFill(start_color='1F2937', end_color='1F2937', fill_type='solid')
-    currency_fmt = 'R$ #,##0.00'
-
-    for col, h in enumerate(['Data', 'Produto', 'Qtd', 'Preço Unit.', 'Total', 'Status'], 1):
-        cell = ws.cell(row=2, column=col, value=h)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-
-    row_num = 3
-    total_geral = Decimal('0')
-    total_pendente = Decimal('0')
-
-    for venda in vendas:
-        for item in venda.itens.all():
-            ws.cell(row=row_num, column=1, value=venda.data_hora.strftime('%d/%m/%Y'))
-            ws.cell(row=row_num, column=2, value=item.produto.nome)
-            ws.cell(row=row_num, column=3, value=item.quantidade)
-            ws.cell(row=row_num, column=4, value=float(item.preco_unitario)).number_format = currency_fmt
-            ws.cell(row=row_num, column=5, value=float(item.subtotal)).number_format = currency_fmt
-            ws.cell(row=row_num, column=6, value='Pago' if venda.paga else 'Pendente')
-            row_num += 1
-        total_geral += venda.total
-        if not venda.paga:
-            total_pendente += venda.total
-
-    total_font = Font(bold=True)
-    total_fill = PatternFill(start_color='E5E7EB', end_color='E5E7EB', fill_type='solid')
-    pending_font = Font(bold=True, color='DC2626')
-    pending_fill = PatternFill(start_color='FEE2E2', end_color='FEE2E2', fill_type='solid')
-
-    for c in range(1, 7):
-        ws.cell(row=row_num, column=c).fill = total_fill
-    ws.cell(row=row_num, column=1, value='TOTAL').font = total_font
-    ws.cell(row=row_num, column=5, value=float(total_geral)).number_format = currency_fmt
-    ws.cell(row=row_num, column=5).font = total_font
-
-    if total_pendente > 0:
-        row_num += 1
-        for c in range(1, 7):
-            ws.cell(row=row_num, column=c).fill = pending_fill
-        ws.cell(row=row_num, column=1, value='PENDENTE').font = pending_font
-        ws.cell(row=row_num, column=5, value=float(total_pendente)).number_format = currency_fmt
-        ws.cell(row=row_num, column=5).font = pending_font
-
-    for col, width in enumerate([12, 30, 6, 14, 14, 10], 1):
-        ws.column_dimensions[ws.cell(row=2, column=col).column_letter].width = width
-
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    safe_nome = ''.join(c if c.isalnum() else '_' for c in cliente.nome)
-    filename = f"fatura_{safe_nome}_{ano}_{mes:02d}.xlsx"
-    response = HttpResponse(
-        buffer.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+
+@login_required
+@admin_required
+def baixar_faturas_mes(request, ano, mes):
+    """
+    ZIP with the invoice of every fiado client of the month, streamed as it
+    is built. For long client lists ``manage.py gerar_faturas`` writes the
+    same ZIP and reports its progress.
+    """
+    if not (1 <= mes <= 12):
+        return HttpResponse('Mês inválido.', status=400)
+
+    response = StreamingHttpResponse(
+        relatorios.faturas_zip(ano, mes, settings.INVOICE_ZIP_WORKERS),
+        content_type='application/zip',
     )
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Content-Disposition'] = f'attachment; filename="faturas_{ano}_{mes:02d}.zip"'
     return response